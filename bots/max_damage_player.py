@@ -7,93 +7,117 @@ from poke_env.player.random_player import RandomPlayer
 from poke_env.player.battle_order import DoubleBattleOrder, DefaultBattleOrder, BattleOrder
 from poke_env import utils
 from reuniclusVGC.helpers.doubles_utils import *
+from reuniclusVGC.helpers.damage import compute_damage
+from reuniclusVGC.helpers.team_selection import choose_team
+from reuniclusVGC.helpers.turn_cache import cached_affected_targets, cached_target_to_mon, cached_is_valid
 import numpy as np
 
 # Bot that tries to maximize the damage it does in the turn
 class MaxDamagePlayer(Player):
     def choose_move(self, battle):
 
-        best_order = DefaultBattleOrder()
+        # How good of a switch each of our mons is: its average type advantage against the opponent's active mons. We
+        # compute it once for the whole team, so scoring switches is just a lookup
+        opp_actives = [opp for opp in battle.opponent_active_pokemon if opp is not None]
+        advantages = compute_team_type_advantage(battle.team.values(), opp_actives).mean(axis=1) if opp_actives else np.zeros(len(battle.team))
+        switch_advantages = dict(zip(battle.team.values(), advantages))
+
+        # Go through and get actions; pairs of actions are made of a handful of single actions per mon, so we score each
+        # single action once, and then score every pair at once: rows are our first mon's actions and columns our second's
+        orders = [order for order in self.get_all_doubles_moves(battle) if order]
+        firsts, rows = self._index_orders([order.first_order for order in orders])
+        seconds, cols = self._index_orders([order.second_order for order in orders])
 
         # If we're not being forced to switch and are choosing our moves
         if not any(battle.force_switch):
 
-            # Go through and get actions, filter them down to what's possible, and then eliminate ones that dont make sense
-            orders = self.get_all_doubles_moves(battle)
-            filtered_orders = list(filter(lambda x: x and DoubleBattleOrder.is_valid(battle, x), orders))
-
-            # Iterate through all actions to pick best short-term move. These are our stored values
-            most_damage, best_switch_multiplier = 0, 0
-
-            # Go through every reasonable pair of actions and pick the pair that does the most high damage moves and multipliers of switch
-            for double_order in filtered_orders:
-                damage, switch_multiplier = 0, 0
-
-                # Add up damage I'm probably going to do and switch multipliers compared to active pokemon
-                for order in [double_order.first_order, double_order.second_order]:
-                    if not order: continue
-
-                    # If damaging move, Go through each potential target and add up damage (subtract if self-damage)
-                    if order.is_move() and (order.order.damage or order.order.base_power > 0):
-                        targets = BattleOrder.get_affected_targets(battle, order)
-                        if targets == None: targets = []
-
-                        for target in targets:
-                            stab = 1.5 if order.order.type in order.actor.types else 1
-                            target_mon = utils.showdown_target_to_mon(battle, target)
-
-                            effectiveness = order.order.type.damage_multiplier(*target_mon.types) if target_mon is not None else 1
-                            base_power = order.order.base_power
-
-                            damage += base_power*stab*effectiveness*(-1 if target < 0 else 1)
-
-                            if order.dynamax: damage += 1
+            # Damage we're probably going to do and switch multipliers compared to active pokemon, per single action
+            scores = self._score_orders(battle, firsts + seconds, switch_advantages)
+            first_scores, second_scores = scores[:len(firsts)], scores[len(firsts):]
 
-                    # Calculate whether we're going to switch into an good environment (wrt types)
-                    elif order.is_switch():
-                        switch_multiplier += np.mean([compute_type_advantage(order.actor, opp) for opp in filter(lambda x: x is not None, battle.opponent_active_pokemon)])
+            # Every pair's damage and switch multiplier, as (first actions x second actions) matrices. We only look at the
+            # pairs that get_all_doubles_moves gives us
+            damage = first_scores[:, 0][:, None] + second_scores[:, 0][None, :]
+            switch_multiplier = first_scores[:, 1][:, None] + second_scores[:, 1][None, :]
+            damage, switch_multiplier = damage[rows, cols], switch_multiplier[rows, cols]
 
-                # Choose move if it does highest damage, and then if tied, the one that has the best switch
-                if damage > most_damage:
-                    best_order, most_damage, best_switch_multiplier = double_order, damage, switch_multiplier
-                elif damage == most_damage and switch_multiplier >= best_switch_multiplier:
-                    best_order, most_damage, best_switch_multiplier = double_order, damage, switch_multiplier
+            # Pick the pair that does the most damage, and then if tied, the one that has the best switch (and the last
+            # one if they're still tied). We only check whether pairs are valid in that order, until we find one. If our
+            # best pair doesn't do any damage and switches into a bad environment, we let showdown choose
+            for i in np.lexsort((-np.arange(len(orders)), -switch_multiplier, -damage)):
+                if not cached_is_valid(battle, orders[i]): continue
+                if damage[i] > 0 or (damage[i] == 0 and switch_multiplier[i] >= 0): return orders[i]
+                break
 
         # Force Switch situation; pick switch that has the best type advantage against the opponent's active mons
         else:
-            orders = self.get_all_doubles_moves(battle)
-            filtered_orders = list(filter(lambda x: DoubleBattleOrder.is_valid(battle, x), orders))
-
-            # Go through every possible switch and choose one that has best type advantage against opponent's mon
-            multiplier = -np.inf
-            for double_order in filtered_orders:
-                if not double_order.first_order or not double_order.first_order.is_switch(): continue
-
-                # Store the score if there's a better switch
-                multipliers = []
-                for opp in battle.opponent_active_pokemon:
-                    if opp is not None: multipliers.append(compute_type_advantage(double_order.first_order.actor, opp))
-
-                if np.mean(multipliers) > multiplier: best_order, multiplier = double_order, np.mean(multipliers)
-
-        return best_order
-
-    # Choose mons who have the best average performance of the other team
+            multipliers = np.array([
+                switch_advantages[order.order] if order is not None and order.is_switch() else -np.inf for order in firsts
+            ])[rows]
+
+            # Go through every possible switch (best first, and the first one if tied) and choose the first valid one
+            for i in np.lexsort((np.arange(len(orders)), -multipliers)):
+                if multipliers[i] == -np.inf: break
+                if cached_is_valid(battle, orders[i]): return orders[i]
+
+        return DefaultBattleOrder()
+
+    # Given single actions (the same action appears in many pairs of actions), returns the distinct ones, and the index of
+    # each action in them. Pairs usually share the same single action objects, so we look them up by identity first
+    def _index_orders(self, orders):
+        distinct, keys, by_id, indices = [], {}, {}, []
+        for order in orders:
+            index = by_id.get(id(order))
+            if index is None:
+                key = None if order is None else (id(order.order), order.move_target, order.dynamax)
+                if key not in keys:
+                    keys[key] = len(distinct)
+                    distinct.append(order)
+                index = by_id[id(order)] = keys[key]
+            indices.append(index)
+        return distinct, np.array(indices, dtype=np.intp)
+
+    # Returns the damage each single action is probably going to do, and its switch multiplier, as an (actions x 2)
+    # array. Damage is the average roll of the damage calculator (see damage.py), capped at the target's hp; we compute
+    # every attack of every action at once
+    def _score_orders(self, battle, orders, switch_advantages):
+        scores = np.zeros((len(orders), 2))
+
+        # Every attack, as (attacker, move, target), the action it belongs to, and whether it hits our own mons
+        attacks, actions, signs = [], [], []
+        for i, order in enumerate(orders):
+            if not order: continue
+
+            # If damaging move, Go through each potential target and add up damage (subtract if self-damage)
+            if order.is_move() and (order.order.damage or order.order.base_power > 0):
+                targets = cached_affected_targets(battle, order)
+                if targets == None: targets = []
+
+                for target in targets:
+                    target_mon = cached_target_to_mon(battle, target)
+                    if target_mon is not None:
+                        attacks.append((order.actor, order.order, target_mon))
+                        actions.append(i)
+                        signs.append(-1 if target < 0 else 1)
+
+                    if order.dynamax: scores[i, 0] += 1
+
+            # Calculate whether we're going to switch into an good environment (wrt types)
+            elif order.is_switch():
+                scores[i, 1] += switch_advantages[order.order]
+
+        if attacks:
+            rolls, hp = compute_damage(battle, attacks)
+            np.add.at(scores[:, 0], actions, np.minimum(rolls.mean(axis=1), hp) * signs)
+
+        return scores
+
+    # Choose the 4 mons (and the 2 leads) that have the best type matchups against the other team, out of every team we
+    # can bring
     def teampreview(self, battle):
-        mon_performance = {}
-
-        # For each of our pokemons
-        for i, mon in enumerate(battle.team.values()):
-
-            # We store their average performance against the opponent team
-            mon_performance[i] = np.mean([compute_type_advantage(mon, opp) for opp in battle.opponent_team.values()])
-
-        # We sort our mons by performance
-        ordered_mons = sorted(mon_performance, key=lambda k: -mon_performance[k])
 
-        # We start with the one we consider best overall
-        # We use i + 1 as python indexes start from 0 but showdown's indexes start from 1, and return the first 4 mons, in term of importance
-        return "/team " + "".join([str(i + 1) for i in ordered_mons[:4]])
+        # We use i + 1 as python indexes start from 0 but showdown's indexes start from 1; leads go first
+        return "/team " + "".join([str(i + 1) for i in choose_team(battle)])
 
         # For right now, return a random ordering to facilitate learning
         # return "/team " + "".join(random.sample(list(map(lambda x: str(x+1), range(0, len(battle.team)))), k=4))
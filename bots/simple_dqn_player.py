@@ -1,8 +1,10 @@
+import os
 import numpy as np
 import tensorflow as tf
 from datetime import datetime
 import sys
 import random
+from collections import namedtuple
 from typing import Dict, List, Optional, Tuple
 
 from poke_env import utils
@@ -23,6 +25,12 @@ from reuniclusVGC.bots.random_doubles_player import RandomDoublesPlayer
 from poke_env.player.battle_order import DoubleBattleOrder, DefaultBattleOrder, BattleOrder, DefaultDoubleBattleOrder
 
 from reuniclusVGC.helpers.doubles_utils import *
+from reuniclusVGC.helpers.embedder import Embedder
+from reuniclusVGC.helpers.inference_server import InferenceServer
+from reuniclusVGC.helpers.masked_dqn import MaskedDQNAgent
+from reuniclusVGC.helpers.replay_memory import PrioritizedRingBufferMemory, RingBufferMemory
+from reuniclusVGC.helpers.team_selection import choose_team
+from reuniclusVGC.helpers.turn_cache import cached_is_valid, turn_cache
 
 from rl.agents.dqn import DQNAgent
 from rl.policy import LinearAnnealedPolicy, MaxBoltzmannQPolicy, Policy
@@ -33,20 +41,53 @@ from tensorflow.keras.layers import Dense, Flatten, Activation, BatchNormalizati
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.optimizers import Adam
 
+# Move targets for which our AI picks the target; every other move has only one possible one
+SINGLE_TARGETS = ['adjacentAlly', 'adjacentAllyOrSelf', 'any', 'normal']
+
+# Static decode table of a mon's 26 actions: ACTION_DECODE[action] = (kind, slot, target, dynamax). Actions 0-23 are moves
+# (ACTION_MOVE): move slot action // 6, target (action // 2) % 3 (0/1 are the opponent's mons and 2 is our other mon),
+# dynamaxing if odd. Actions 24 and 25 are switches (ACTION_SWITCH) to the mon in available_switches slot 1 and 0
+ACTION_MOVE, ACTION_SWITCH = 0, 1
+ACTION_DECODE = np.array([(ACTION_MOVE, action // 6, action // 2 % 3, action % 2) for action in range(24)] +
+                         [(ACTION_SWITCH, 25 - action, 0, 0) for action in (24, 25)], dtype=np.intp)
+_ACTION_IS_MOVE = ACTION_DECODE[:, 0] == ACTION_MOVE
+_ACTION_SLOTS, _ACTION_TARGETS = ACTION_DECODE[:, 1], ACTION_DECODE[:, 2]
+_ACTION_DYNAMAX = ACTION_DECODE[:, 3].astype(bool)
+
+# What we need to decode a slot's actions in a turn (see SimpleDQNPlayer._slot_context): the mon, its moves and available
+# switches, which of the 26 actions decode to an order, which of them are moves that need a target, and their targets
+SlotContext = namedtuple('SlotContext', ['mon', 'moves', 'switches', 'decoded', 'targeted', 'targets'])
 
 # We define our RL player
 class SimpleDQNPlayer(EnvPlayer):
 
     _EMBEDDING_SPACE = None
 
-    def __init__(self, num_battles=10000, **kwargs):
+    # If mask_actions is set, we only ever choose (and learn from) legal actions (see MaskedDQNAgent), instead of letting
+    # illegal ones fall back to a default order. memory_limit is how many transitions we remember (see _create_model), and
+    # prioritized_replay makes us replay the transitions we're most wrong about more often. With n_step > 1, we learn from
+    # n-step returns, so that the reward at the end of a battle reaches early turns in fewer updates. If
+    # random_teampreview is set, we bring random teams while training, so that we learn from every team we could bring
+    # (see teampreview)
+    def __init__(self, num_battles=10000, mask_actions=False, memory_limit=None, prioritized_replay=False, n_step=1,
+                 random_teampreview=True, **kwargs):
         super().__init__(**kwargs)
 
         # Redefine the buffer defined in env_player; this will be turn (int) => reward and will be reset every battle
         # So that we can compute te difference between this reward and the last state
         self.num_battles = num_battles
+        self.mask_actions = mask_actions
+        self.memory_limit = memory_limit if memory_limit is not None else max(num_battles, 10000)
+        self.prioritized_replay = prioritized_replay
+        self.n_step = n_step
+        self.random_teampreview = random_teampreview
         self._reward_buffer = {}
 
+        # When set (see use_inference_server), we choose moves ourselves, batching the model's predictions across battles.
+        # Battle tag => the order we chose that way, until choose_move hands it to Player
+        self._inference_server = None
+        self._batched_orders = {}
+
         # Ensure stability and reproducibility
         tf.random.set_seed(21)
         np.random.seed(21)
@@ -58,31 +99,11 @@ class SimpleDQNPlayer(EnvPlayer):
         action_space = list(range((4 * 3 * 2 + 2) * (4 * 3 * 2 + 2)))
         self._ACTION_SPACE = action_space
 
-        self._EMBEDDING_SPACE = 7913
-
-        # Preprocess all the sets that we'll use to embed battle states.
-        # The tuples are key where we retrieve the classes, the class, and whether poke_env supports returning the
-        # class (as opposed to string)
-        self._knowledge = {}
-        sets = [
-            ('Field', Field, False),
-            ('SideCondition', SideCondition, False),
-            ('Status', Status, True),
-            ('Weather', Weather, True),
-            ('PokemonType', PokemonType, True),
-            ('MoveCategory', MoveCategory, True),
-            ('TargetType', TargetType, False),
-            ('VolatileStatus', VolatileStatus, False),
-        ]
-
-        for key, klass, supported in sets:
-            if supported:
-                self._knowledge[key] = list(klass._member_map_.values())
-            else:
-                self._knowledge[key] = list(map(lambda x: x.name.lower().replace("_", ""),
-                                                list(klass._member_map_.values())))
-
-        # print(self._knowledge)
+        # We embed battles with the Embedder. We don't one-hot encode species, abilities or moves because of their large
+        # cardinalities
+        self._embedder = Embedder(gen=8, profile='doubles_no_ohe')
+        self._SCHEMA = self._embedder.schema
+        self._EMBEDDING_SPACE = self._SCHEMA.width
 
         self._model = None
         self._create_model()
@@ -94,8 +115,8 @@ class SimpleDQNPlayer(EnvPlayer):
         # Get initializer for hidden layers
         init = tf.keras.initializers.RandomNormal(mean=.1, stddev=.02)
 
-        # Input Layer; this shape is one that just works
-        self._model.add(Dense(512, input_shape=(1, 7814), activation="relu",
+        # Input Layer; one embedding per observation (keras-rl adds the window length as the first dimension)
+        self._model.add(Dense(512, input_shape=self.embedding_space, activation="relu",
                               use_bias=False, kernel_initializer=init, name='first_hidden'))
 
         # Hidden Layers
@@ -109,8 +130,17 @@ class SimpleDQNPlayer(EnvPlayer):
         self._model.add(Activation(
             "linear"))  # Same as passing activation in Dense Layer, but allows us to access last layer: https://stackoverflow.com/questions/40866124/difference-between-dense-and-activation-layer-in-keras
 
-        # This is how many battles we'll remember before we start forgetting old ones
-        self._memory = SequentialMemory(limit=max(self.num_battles, 10000), window_length=1)
+        # This is how many transitions we'll remember before we start forgetting old ones. They're stored in compact
+        # numpy arrays (along with which actions were legal, with action masking), so this can go up to millions
+        # Our rewards are sparse (we only get one when a battle ends), so with prioritized replay, we replay the
+        # transitions with the largest TD errors more often (see PrioritizedRingBufferMemory) instead of uniformly
+        # It computes n-step returns as it stores transitions, with the same discount factor as our DQN
+        gamma = 0.8
+        if self.prioritized_replay:
+            self._memory = PrioritizedRingBufferMemory(limit=self.memory_limit, window_length=1, beta_steps=self.num_battles,
+                                                       n_step=self.n_step, gamma=gamma)
+        else:
+            self._memory = RingBufferMemory(limit=self.memory_limit, window_length=1, n_step=self.n_step, gamma=gamma)
 
         # Simple epsilon greedy policy
         # This takes the output of our NeuralNet and converts it to a value
@@ -124,66 +154,82 @@ class SimpleDQNPlayer(EnvPlayer):
             nb_steps=self.num_battles,
         )
 
-        # Defining our DQN
-        self._dqn = DQNAgent(
+        # Defining our DQN; with action masking, it asks us which actions are legal in the battle we're playing (without
+        # it, MaskedDQNAgent is a DQNAgent that also supports prioritized replay)
+        self._dqn = MaskedDQNAgent(
             model=self._model,
             nb_actions=len(self.action_space),
             policy=self._policy,
             memory=self._memory,
             nb_steps_warmup=max(1000, int(self.num_battles / 10)),
             # The number of battles we go through before we start training: https://hub.packtpub.com/build-reinforcement-learning-agent-in-keras-tutorial/
-            gamma=0.8,  # This is the discount factor for the Value we learn - we care a lot about future rewards
+            gamma=gamma,  # This is the discount factor for the Value we learn - we care a lot about future rewards
             target_model_update=.01,
             # This controls how much/when our model updates: https://github.com/keras-rl/keras-rl/issues/55
             delta_clip=1,
             # Helps define Huber loss - cips values to be -1 < x < 1. https://srome.github.io/A-Tour-Of-Gotchas-When-Implementing-Deep-Q-Networks-With-Keras-And-OpenAi-Gym/
             enable_double_dqn=True,
+            mask_fn=(lambda: self.action_mask(self._current_battle)) if self.mask_actions else None,
         )
 
         self._dqn.compile(Adam(lr=0.01), metrics=["mae"])
 
+    # Returns the order a mon (our index-th active mon) does for one of its 26 actions (see ACTION_DECODE), or None if
+    # the action doesn't decode to anything (e.g. the mon doesn't have that move, or the target isn't there)
     def _action_to_single_move(self, action: int, index: int, battle):
-
-        if action < 24:
-            # If either there is no mon or we're forced to switch, there's nothing to do
-            if not battle.active_pokemon[index] or battle.force_switch[index]: return None
-            dynamax, remaining = action % 2 == 1, int(action / 2)
-            if battle.active_pokemon[index] and int(remaining / 3) < len(battle.active_pokemon[index].moves):
-                move, initial_target = list(battle.active_pokemon[index].moves.values())[
-                                           int(remaining / 3)], remaining % 3
-
-                # If there's no target needed, we create the action as we normally would. It doesn't matter what our AI
-                # returned as target since there's only one possible target
-                if move.deduced_target not in ['adjacentAlly', 'adjacentAllyOrSelf', 'any', 'normal']:
-                    return BattleOrder(order=move, actor=battle.active_pokemon[index], dynamax=dynamax)
-
-                # If we are targeting a single mon, there are three cases: your other mon, the opponents mon or their
-                # other mon. 2 corresponds to your mon and 0/1 correspond to the opponents mons (index in
-                # opponent_active_mon) For the self-taret case, we ensure there's another mon on our side to hit
-                # (otherwise we leave action1 as None)
-                elif initial_target == 2:
-                    if battle.active_pokemon[1] is not None:
-                        return BattleOrder(order=move,
-                                           move_target=utils.active_pokemon_to_showdown_target(1 - index, opp=False),
-                                           actor=battle.active_pokemon[index], dynamax=dynamax)
-
-                # In the last case (if initial_target is 0 or 1), we target the opponent, and we do it regardless of
-                # what slot was chosen if there's only 1 mon left. In the following cases, we handle whether there are
-                # two mons left or one mon left
-                elif len(battle.opponent_active_pokemon) == 2 and all(battle.opponent_active_pokemon):
-                    return BattleOrder(order=move,
-                                       move_target=utils.active_pokemon_to_showdown_target(initial_target, opp=True),
-                                       actor=battle.active_pokemon[index], dynamax=dynamax)
-                elif len(battle.opponent_active_pokemon) < 2 and any(battle.opponent_active_pokemon):
-                    initial_target = 1 if battle.opponent_active_pokemon[0] is not None else 0
-                    return BattleOrder(order=move,
-                                       move_target=utils.active_pokemon_to_showdown_target(initial_target, opp=True),
-                                       actor=battle.active_pokemon[index], dynamax=dynamax)
-
-        elif 25 - action < len(battle.available_switches[index]):
-            return BattleOrder(order=battle.available_switches[index][25 - action], actor=battle.active_pokemon[index])
-
-        return None
+        return self._slot_order(self._slot_contexts(battle)[index], action)
+
+    # Returns the context of each of our two slots this turn (see _slot_context); we only build them once per turn
+    def _slot_contexts(self, battle: DoubleBattle):
+        cache = turn_cache(battle)
+        if 'slot_contexts' not in cache: cache['slot_contexts'] = [self._slot_context(battle, index) for index in range(2)]
+        return cache['slot_contexts']
+
+    # Builds what we need to decode our index-th mon's actions this turn: which of its 26 actions decode to an order,
+    # and which showdown target each move action aims at, worked out for all of them at once from ACTION_DECODE
+    def _slot_context(self, battle: DoubleBattle, index: int) -> SlotContext:
+        mon, switches = battle.active_pokemon[index], battle.available_switches[index]
+
+        # If either there is no mon or we're forced to switch, it can't use moves
+        moves = [] if not mon or battle.force_switch[index] else list(mon.moves.values())[:4]
+
+        # If there's no target needed, it doesn't matter what target our AI returned since there's only one possible one
+        needs_target = np.zeros(4, dtype=bool)
+        needs_target[:len(moves)] = [move.deduced_target in SINGLE_TARGETS for move in moves]
+
+        # Targets 0/1 are the opponent's mons (index in opponent_active_pokemon), and 2 is our other mon. For the
+        # self-target case, we ensure there's another mon on our side to hit. If there's only one opponent mon left,
+        # we target it regardless of what slot was chosen
+        target_ok, target_values = np.zeros(3, dtype=bool), np.zeros(3, dtype=np.int64)
+        if battle.active_pokemon[1] is not None:
+            target_ok[2], target_values[2] = True, utils.active_pokemon_to_showdown_target(1 - index, opp=False)
+
+        opp_active = battle.opponent_active_pokemon
+        if len(opp_active) == 2 and all(opp_active):
+            target_ok[:2] = True
+            target_values[:2] = [utils.active_pokemon_to_showdown_target(target, opp=True) for target in range(2)]
+        elif len(opp_active) < 2 and any(opp_active):
+            target_ok[:2] = True
+            target_values[:2] = utils.active_pokemon_to_showdown_target(1 if opp_active[0] is not None else 0, opp=True)
+
+        targeted = _ACTION_IS_MOVE & needs_target[_ACTION_SLOTS]
+        decoded = np.where(_ACTION_IS_MOVE, (_ACTION_SLOTS < len(moves)) & (~targeted | target_ok[_ACTION_TARGETS]),
+                           _ACTION_SLOTS < len(switches))
+
+        return SlotContext(mon, moves, switches, decoded, targeted, target_values[_ACTION_TARGETS])
+
+    # Returns the order of one of a slot's 26 actions, given the slot's context (see _slot_context), or None
+    def _slot_order(self, context: SlotContext, action: int) -> Optional[BattleOrder]:
+        if not context.decoded[action]: return None
+
+        slot = _ACTION_SLOTS[action]
+        if not _ACTION_IS_MOVE[action]: return BattleOrder(order=context.switches[slot], actor=context.mon)
+
+        dynamax = bool(_ACTION_DYNAMAX[action])
+        if context.targeted[action]:
+            return BattleOrder(order=context.moves[slot], move_target=int(context.targets[action]), actor=context.mon,
+                               dynamax=dynamax)
+        return BattleOrder(order=context.moves[slot], actor=context.mon, dynamax=dynamax)
 
     # Takes the output of our policy (which chooses from a 676-dimensional array), and converts it into a battle order
     def _action_to_move(self, action: int, battle: DoubleBattle) -> BattleOrder:  # pyre-ignore
@@ -200,25 +246,76 @@ class SimpleDQNPlayer(EnvPlayer):
         :return: the order to send to the server.
         :rtype: BattleOrder
         """
-        row, col = action % 26, int(action / 26)
-        first_order = self._action_to_single_move(row, 0, battle) if battle.active_pokemon[0] else None
-        second_order = self._action_to_single_move(col, 1, battle) if battle.active_pokemon[1] else None
+        mask, acting = self._action_table(battle)
+        if not mask[action]: return DefaultDoubleBattleOrder()
 
-        double_order = DoubleBattleOrder(first_order=first_order, second_order=second_order)
-        if DoubleBattleOrder.is_valid(battle, double_order):
+        contexts = self._slot_contexts(battle)
+        first, second = [self._slot_order(contexts[index], slot_action) if acting[index] else None
+                         for index, slot_action in enumerate((action % 26, int(action / 26)))]
+
+        double_order = DoubleBattleOrder(first_order=first, second_order=second)
+        if cached_is_valid(battle, double_order):
             return double_order
         else:
             return DefaultDoubleBattleOrder()
 
+    # Returns a boolean array with an element per action (676), that says whether the action is legal this turn
+    def action_mask(self, battle: DoubleBattle) -> np.ndarray:
+        return self._action_table(battle)[0]
+
+    # Returns the action mask of the turn (see action_mask), and whether each of our mons acts (mons that don't do
+    # nothing, whatever the action). We only build it once per turn
+    def _action_table(self, battle: DoubleBattle):
+        cache = turn_cache(battle)
+        if 'action_table' not in cache: cache['action_table'] = self._build_action_table(battle)
+        return cache['action_table']
+
+    # Builds the action mask from each slot's decoded actions (see _slot_context): an action (a pair of actions) is
+    # legal if both of its mons' actions are, unless both mons switch to the same mon or both dynamax
+    def _build_action_table(self, battle: DoubleBattle):
+        contexts = self._slot_contexts(battle)
+        legal, acting = np.ones((2, 26), dtype=bool), np.zeros(2, dtype=bool)
+
+        for index, context in enumerate(contexts):
+            # Mons that don't have to act (there's no mon, or the other one is being forced to switch) do nothing,
+            # whatever the action
+            if not context.mon or (any(battle.force_switch) and not battle.force_switch[index]): continue
+
+            available_ids = set(move.id for move in battle.available_moves[index])
+            available = np.zeros(4, dtype=bool)
+            available[:len(context.moves)] = [move.id in available_ids for move in context.moves]
+
+            slot_legal = context.decoded & np.where(
+                _ACTION_IS_MOVE, available[_ACTION_SLOTS] & (~_ACTION_DYNAMAX | bool(battle.can_dynamax[index])), True)
+
+            # If a mon can't do any of our actions (e.g. it has to recharge), we let it do nothing
+            if slot_legal.any(): legal[index], acting[index] = slot_legal, True
+
+        # Rows are the second mon's actions and columns the first's, since action = first + 26 * second
+        mask = legal[1][:, None] & legal[0][None, :]
+
+        dynamax = acting[:, None] & np.stack([context.decoded for context in contexts]) & _ACTION_DYNAMAX[None, :]
+        mask &= ~(dynamax[1][:, None] & dynamax[0][None, :])
+
+        if acting.all():
+            first, second = contexts
+            for action_1 in (24, 25):
+                for action_2 in (24, 25):
+                    if first.decoded[action_1] and second.decoded[action_2] and \
+                            first.switches[_ACTION_SLOTS[action_1]] is second.switches[_ACTION_SLOTS[action_2]]:
+                        mask[action_2, action_1] = False
+
+        return mask.reshape(-1), acting
+
     @property
     def action_space(self) -> List:
         """
-        There are 210 possible moves w/out dynamax:
-        First mon's move possibilities:
-            4 moves * 3 possible targets (for moves w/ multiple/self-targeting we default to any target) + 3 switches
-        Second mon's move possibilities:
-            4 moves * 3 possible targets (for moves w/ multiple/self-targeting we default to any target) + 2 switches
-        First mon's move possibilities * Second mon's move possibilities = 210
+        There are 676 possible actions, one per row of ACTION_DECODE for each of our two mons:
+        Each mon's move possibilities:
+            4 moves * 3 possible targets (for moves w/ multiple/self-targeting we default to any target) * dynamax
+            + 2 switches = 26
+        First mon's move possibilities * Second mon's move possibilities = 26 * 26 = 676
+        Action row + 26 * col is the first mon's action row and the second mon's action col
         """
         return self._ACTION_SPACE
 
@@ -258,267 +355,12 @@ class SimpleDQNPlayer(EnvPlayer):
         """
         return self._dqn
 
-    # Embeds a move in a 178-dimensional array.
-    # This includes a move's accuracy, base_power, whether it breaks protect, crit ratio, pp, damage, drain %,
-    # expected of hits, whether it forces a switch, how much it heals,
-    # whether it ignores abilities/defenses/evasion/immunity, min times it can hit, max times it can hit,
-    # its priority bracket, how much recoil it causes, whether it self destructs,
-    # whether it causes you to switch/steal boosts/thaw target/uses targets offense,
-    # the moves offensive category (ohe: 3), defensive category (ohe: 3), type (ohe: ), fields (ohe: ),
-    #           side conditions (ohe: ), weathers (ohe: ), targeting types (ohe: 14), volatility status (ohe: 57),
-    #           status (ohe: ), boosts (ohe: 6), self-boosts (ohe: 6),
-    # and the chance of a secondary effect
-    def _embed_move(self, move):
-
-        # If the move is None or empty, return a negative array (filled w/ -1's)
-        if move is None or move.is_empty: return [-1] * 180
-
-        embeddings = []
-
-        embeddings.append([
-            move.accuracy,
-            move.base_power,
-            int(move.breaks_protect),
-            move.crit_ratio,
-            move.current_pp,
-            move.damage,
-            move.drain,
-            move.expected_hits,
-            int(move.force_switch),
-            move.heal,
-            int(move.ignore_ability),
-            int(move.ignore_defensive),
-            int(move.ignore_evasion),
-            1 if move.ignore_immunity else 0,
-            move.n_hit[0] if move.n_hit else 1,  # minimum times the move hits
-            move.n_hit[1] if move.n_hit else 1,  # maximum times the move hits
-            move.priority,
-            move.recoil,
-            int(move.self_destruct is not None),
-            int(move.self_switch is not None),
-            int(move.steals_boosts),
-            int(move.thaws_target),
-            int(move.use_target_offensive),
-        ])
-
-        # Add Category
-        embeddings.append([1 if move.category == category else 0 for category in self._knowledge['MoveCategory']])
-
-        # Add Defensive Category
-        embeddings.append([1 if move.defensive_category == category else 0
-                           for category in self._knowledge['MoveCategory']])
-
-        # Add Move Type
-        embeddings.append([1 if move.type == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-
-        # Add Fields (bad coding -- assumes field name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.id == field else 0 for field in self._knowledge['Field']])
-
-        # Add Side Conditions (bad coding -- assumes side condition name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.side_condition == sc else 0 for sc in self._knowledge['SideCondition']])
-
-        # Add Weathers (bad coding -- assumes field name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.weather == weather else 0 for weather in self._knowledge['Weather']])
-
-        # Add Targeting Types; cardinality is 14
-        embeddings.append([1 if move.deduced_target and move.deduced_target.lower() == tt else 0
-                           for tt in self._knowledge['TargetType']])
-
-        # Add Volatility Statuses; cardinality is 57
-        volatility_status_embeddings = []
-        for vs in self._knowledge['VolatileStatus']:
-            if vs == move.volatile_status:
-                volatility_status_embeddings.append(1)
-            elif move.secondary and vs in list(map(lambda x: x.get('volatilityStatus', '').lower(), move.secondary)):
-                volatility_status_embeddings.append(1)
-            else:
-                volatility_status_embeddings.append(0)
-        embeddings.append(volatility_status_embeddings)
-
-        # Add Statuses
-        status_embeddings = []
-        for status in self._knowledge['Status']:
-            if status == move.status:
-                status_embeddings.append(1)
-            elif move.secondary and status in list(map(lambda x: x.get('status', ''), move.secondary)):
-                status_embeddings.append(1)
-            else:
-                status_embeddings.append(0)
-        embeddings.append(status_embeddings)
-
-        # Add Boosts
-        boost_embeddings = {'atk': 0, 'def': 0, 'spa': 0, 'spd': 0, 'spe': 0, 'evasion': 0, 'accuracy': 0}
-        if move.boosts:
-            for stat in move.boosts: boost_embeddings[stat] += move.boosts[stat]
-        elif move.secondary:
-            for x in move.secondary:
-                for stat in x.get('boosts', {}): boost_embeddings[stat] += x['boosts'][stat]
-        embeddings.append(boost_embeddings.values())
-
-        # Add Self-Boosts
-        self_boost_embeddings = {'atk': 0, 'def': 0, 'spa': 0, 'spd': 0, 'spe': 0, 'evasion': 0, 'accuracy': 0}
-        if move.self_boost:
-            for stat in move.self_boost: self_boost_embeddings[stat] += move.self_boost[stat]
-        elif move.secondary:
-            for x in move.secondary:
-                for stat in x.get('self', {}).get('boosts', {}): self_boost_embeddings[stat] += x['self']['boosts'][
-                    stat]
-        embeddings.append(self_boost_embeddings.values())
-
-        # Introduce the chance of a secondary effect happening
-        chance = 0
-        for x in move.secondary:
-            chance = max(chance, x.get('chance', 0))
-        embeddings.append([chance])
-
-        return [item for sublist in embeddings for item in sublist]
-
-    # We encode the opponent's mon in a 785-dimensional embedding
-    # We encode all the mons moves, whether it is active, it's current hp, whether it's fainted, its level,
-    # weight, whether it's recharging, preparing, dynamaxed, its stats, boosts, status,
-    # types and whether it's trapped or forced to switch out.
-    # We currently don't encode its item, abilities (271) or its species (1155) because of the large cardinalities
-    def _embed_mon(self, battle, mon):
-        embeddings = []
-
-        # Append moves to embedding (and account for the fact that the mon might have <4 moves)
-        for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
-            embeddings.append(self._embed_move(move))
-
-        # Add whether the mon is active, the current hp, whether its fainted, its level,
-        # its weight and whether its recharging or preparing
-        embeddings.append([
-            int(mon.active),
-            mon.current_hp,
-            int(mon.fainted),
-            mon.level,
-            mon.weight,
-            int(mon.must_recharge),
-            1 if mon.preparing else 0,
-            int(mon.is_dynamaxed),
-        ])
-
-        # Add stats and boosts
-        embeddings.append(mon.stats.values())
-        embeddings.append(mon.boosts.values())
-
-        # Add status (one-hot encoded)
-        embeddings.append([1 if mon.status == status else 0 for status in self._knowledge['Status']])
-
-        # Add Types (one-hot encoded)
-        embeddings.append([1 if mon.type_1 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-        embeddings.append([1 if mon.type_2 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-
-        # Add whether the mon is trapped or forced to switch. But first, find the index
-        index = None
-        if mon in battle.active_pokemon: index = 0 if battle.active_pokemon[0] == mon else 1
-        embeddings.append([
-            1 if index and battle.trapped[index] else 0,
-            1 if index and battle.force_switch[index] else 0,
-        ])
-
-        # Flatten all the lists into a Nx1 list
-        return_embedding = [item for sublist in embeddings for item in sublist]
-        return return_embedding
-
-    # We encode the opponent's mon in a 787-dimensional embedding
-    # We encode all the mons moves, whether it's active, if we know it's sent, it's current hp, whether it's fainted,
-    # its level, weight, whether it's recharging, preparing, dynamaxed, its base stats (because we don't know it's
-    # IV/EV/Nature), boosts, status, types and whether it's trapped or forced to switch out. We currently don't encode
-    # its item, possible abilities (271 * 3) or its species (1155) because of the large cardinalities
-    # In the future, we should predict high/low ranges of stats based on damage and speeds/hail, and items based on cues
-    def _embed_opp_mon(self, battle, mon):
-        embeddings = []
-
-        # Append moves to embedding (and account for the fact that the mon might have <4 moves)
-
-        for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
-            embeddings.append(self._embed_move(move))
-
-        # Add whether the mon is active, the current hp, whether its fainted, its level,
-        # its weight and whether its recharging or preparing
-        embeddings.append([
-            int(mon.active),  # This mon is on the field now
-            int(mon in battle.opponent_team.values()),  # This mon was brought
-            mon.current_hp,
-            int(mon.fainted),
-            mon.level,
-            mon.weight,
-            int(mon.must_recharge),
-            1 if mon.preparing else 0,
-            int(mon.is_dynamaxed),
-        ])
-
-        # Add stats and boosts
-        embeddings.append(mon.base_stats.values())
-        embeddings.append(mon.boosts.values())
-
-        # Add status (one-hot encoded)
-        embeddings.append([1 if mon.status == status else 0 for status in self._knowledge['Status']])
-
-        # Add Types (one-hot encoded)
-        embeddings.append([1 if mon.type_1 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-        embeddings.append([1 if mon.type_2 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-
-        # Add whether the mon is trapped or forced to switch. But first, find the index
-        index = None
-        if mon in battle.active_pokemon: index = 0 if battle.active_pokemon[0] == mon else 1
-        embeddings.append([
-            1 if index and battle.trapped[index] else 0,
-            1 if index and battle.force_switch[index] else 0,
-        ])
-
-        # Flatten all the lists into a Nx1 list
-        return_embedding = [item for sublist in embeddings for item in sublist]
-        return return_embedding
-
-    # Embeds the state of the battle in a 7814-dimensional embedding
+    # Embeds the state of the battle in a self._SCHEMA.width-dimensional embedding (see Embedder.embed_battle)
     # Embed mons (and whether they're active)
     # Embed opponent mons (and whether they're active, they've been brought or we don't know)
     # Then embed all the Fields, Side Conditions, Weathers, Player Ratings, # of Turns and the bias
-    def embed_battle(self, battle: DoubleBattle):
-        embeddings = []
-
-        # Add team to embeddings
-        for mon in battle.sent_team.values():
-            embeddings.append(self._embed_mon(battle, mon))
-
-        # Embed opponent's mons. teampreview_opponent_team has empty move slots while opponent_team has moves we remember.
-        # We first embed opponent_active_pokemon, then ones we remember from the team, then the rest
-        embedded_opp_mons = set()
-        for mon in battle.opponent_active_pokemon:
-            if mon:
-                embeddings.append(self._embed_opp_mon(battle, mon))
-                embedded_opp_mons.add(mon.species)
-
-        for mon in battle.opponent_team.values():
-            if mon.species in embedded_opp_mons: continue
-            embeddings.append(self._embed_opp_mon(battle, mon))
-            embedded_opp_mons.add(mon.species)
-
-        for mon in battle.teampreview_opponent_team:
-            if mon in embedded_opp_mons: continue
-            embeddings.append(self._embed_opp_mon(battle, battle.teampreview_opponent_team[mon]))
-            embedded_opp_mons.add(mon)
-
-        # Add Dynamax stuff
-        embeddings.append(battle.can_dynamax + battle.opponent_can_dynamax + [battle.dynamax_turns_left,
-                                                                              battle.opponent_dynamax_turns_left])
-
-        # Add Fields;
-        embeddings.append([1 if field in battle.fields else 0 for field in self._knowledge['Field']])
-
-        # Add Side Conditions
-        embeddings.append([1 if sc in battle.side_conditions else 0 for sc in self._knowledge['SideCondition']])
-
-        # Add Weathers
-        embeddings.append([1 if weather == battle.weather else 0 for weather in self._knowledge['Weather']])
-
-        # Add Player Ratings, the battle's turn and a bias term
-        embeddings.append(list(map(lambda x: x if x else -1, [battle.rating, battle.opponent_rating, battle.turn, 1])))
-
-        # Flatten all the lists into a 7814-dim list
-        return np.array([item for sublist in embeddings for item in sublist])
+    def embed_battle(self, battle):
+        return self._embedder.embed_battle(battle)
 
     # Define the incremental reward for the current battle state over the last one
     def compute_reward(self, battle) -> float:
@@ -586,13 +428,20 @@ class SimpleDQNPlayer(EnvPlayer):
             env_algorithm_kwargs={"num_steps": num_steps},
         )
 
+    # Saves the model's weights, along with the version of the embedding schema they were trained on
     def save_model(self, filename=None) -> None:
-        if filename is not None:
-            self._dqn.save_weights("models/" + filename, overwrite=True)
-        else:
-            self._dqn.save_weights("models/model_" + datetime.now().strftime("%Y_%m_%d_%H_%M_%S"), overwrite=True)
+        if filename is None: filename = "model_" + datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+
+        self._dqn.save_weights("models/" + filename, overwrite=True)
+        with open("models/" + filename + ".schema", "w") as f:
+            f.write(self._SCHEMA.version)
 
+    # Loads the model's weights, checking that they were trained on the same embeddings we produce (if we know)
     def load_model(self, filename: str) -> None:
+        if os.path.exists("models/" + filename + ".schema"):
+            with open("models/" + filename + ".schema") as f:
+                self._SCHEMA.check_compatible(f.read().strip())
+
         self._dqn.load_weights("models/" + filename)
 
     def evaluate_model(self, num_battles: int, v=True) -> float:
@@ -602,28 +451,62 @@ class SimpleDQNPlayer(EnvPlayer):
         return self.n_won_battles * 1. / num_battles
 
     def choose_move(self, battle: DoubleBattle) -> BattleOrder:
+        if battle.battle_tag in self._batched_orders: return self._batched_orders.pop(battle.battle_tag)
         if battle not in self._observations or battle not in self._actions: self._init_battle(battle)
         self._observations[battle].put(self.embed_battle(battle))
         action = self._actions[battle].get()
         return self._action_to_move(action, battle)
 
-    # Same as max damage for now - we return the mons who have the best average type advantages against the other team
-    # TODO: implement using Q-values and minimax to send out position that maximizes our worst position
+    # Makes us play battles (e.g. through battle_against, with many max_concurrent_battles) without an RL loop: instead
+    # of waiting for the agent to choose each action, we choose greedily from our model's q-values (among legal actions
+    # if we mask them). Predictions of concurrent battles are batched (see InferenceServer). Returns the server
+    def use_inference_server(self, max_batch_size=64, max_delay=.005) -> InferenceServer:
+        self._inference_server = InferenceServer(self._model.predict_on_batch, max_batch_size=max_batch_size,
+                                                 max_delay=max_delay)
+        return self._inference_server
+
+    # Stops using the inference server; moves go through the RL loop again (see choose_move)
+    def stop_inference_server(self) -> None:
+        if self._inference_server is not None: self._inference_server.flush()
+        self._inference_server = None
+
+    # Chooses a move with the inference server: our model's best (legal, if we mask actions) action
+    async def choose_move_batched(self, battle: DoubleBattle) -> BattleOrder:
+        observation = np.reshape(self.embed_battle(battle), self.embedding_space)
+        q_values = await self._inference_server.predict(observation)
+
+        if self.mask_actions: q_values = np.where(self.action_mask(battle), q_values, -np.inf)
+        return self._action_to_move(int(np.argmax(q_values)), battle)
+
+    # With the inference server, we choose our move before Player handles the request, so that we wait for it without
+    # blocking other battles (choose_move blocks until the RL loop gives us an action); choose_move then just returns it.
+    # We only ask the server when the request wants a move from us: not in team preview, not on wait requests (e.g.
+    # while the opponent replaces a fainted mon), and not when Player sends a default order instead. Player picks
+    # default orders at random, so we make that choice here, the same way, before asking for a move
+    async def _handle_battle_request(self, battle, from_teampreview_request=False, maybe_default_order=False):
+        if self._inference_server is None or battle.teampreview:
+            return await super()._handle_battle_request(battle, from_teampreview_request=from_teampreview_request,
+                                                        maybe_default_order=maybe_default_order)
+
+        if getattr(battle, '_wait', False): return
+
+        if maybe_default_order and random.random() < self.DEFAULT_CHOICE_CHANCE:
+            return await self._send_message(self.choose_default_move(battle).message, battle.battle_tag)
+
+        self._batched_orders[battle.battle_tag] = await self.choose_move_batched(battle)
+        try:
+            return await super()._handle_battle_request(battle)
+        finally:
+            self._batched_orders.pop(battle.battle_tag, None)
+
+    # While training (with random_teampreview), we return a random ordering to facilitate learning. Otherwise (when
+    # evaluating, or playing through the inference server), same as max damage for now - we bring the team with the best
+    # type matchups against the other team
+    # TODO: implement using Q-values (through choose_team's score_fn) and minimax to send out position that maximizes our
+    # worst position
     def teampreview(self, battle):
+        if self.random_teampreview and self._dqn.training and self._inference_server is None:
+            return "/team " + "".join(random.sample(list(map(lambda x: str(x + 1), range(0, len(battle.team)))), k=4))
 
-        # We have a dict that has index in battle.team -> average type advantage
-        mon_performance = {}
-
-        # For each of our Pokemons
-        for i, mon in enumerate(battle.team.values()):
-            # We store their average performance against the opponent team
-            mon_performance[i] = np.mean([compute_type_advantage(mon, opp) for opp in battle.opponent_team.values()])
-
-        # We sort our mons by performance, and choose the top 4
-        ordered_mons = sorted(mon_performance, key=lambda k: -mon_performance[k])[:4]
-
-        # We start with the one we consider best overall
-        # We use i + 1 as python indexes start from 0 but showdown's indexes start from 1,
-        # and return the first 4 mons, in term of importance
-        # return "/team " + "".join([str(i + 1) for i in ordered_mons])
-        return "/team " + "".join(random.sample(list(map(lambda x: str(x + 1), range(0, len(battle.team)))), k=4))
+        # We use i + 1 as python indexes start from 0 but showdown's indexes start from 1; leads go first
+        return "/team " + "".join([str(i + 1) for i in choose_team(battle)])
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 import tensorflow as tf
 from datetime import datetime
@@ -25,6 +26,7 @@ from poke_env.player.battle_order import DoubleBattleOrder, DefaultBattleOrder,
     ForfeitBattleOrder
 
 from reuniclusVGC.helpers.doubles_utils import *
+from reuniclusVGC.helpers.embedder import Embedder
 
 from rl.agents.dqn import DQNAgent
 from rl.policy import LinearAnnealedPolicy, MaxBoltzmannQPolicy, Policy
@@ -59,31 +61,11 @@ class SinglesDQNPlayer(EnvPlayer):
         action_space = list(range(4 * 2 + 5))
         self._ACTION_SPACE = action_space
 
-        #
-        embedding_space = 2000
-        self._EMBEDDING_SPACE = (1, embedding_space)
-
-        # Preprocess all the sets that we'll use to embed battle states.
-        # The tuples are key where we retrieve the classes, the class, and whether poke_env supports returning the
-        # class (as opposed to string)
-        self._knowledge = {}
-        sets = [
-            ('Field', Field, False),
-            ('SideCondition', SideCondition, False),
-            ('Status', Status, True),
-            ('Weather', Weather, True),
-            ('PokemonType', PokemonType, True),
-            ('MoveCategory', MoveCategory, True),
-            ('TargetType', TargetType, False),
-            ('VolatileStatus', VolatileStatus, False),
-        ]
-
-        for key, klass, supported in sets:
-            if supported:
-                self._knowledge[key] = list(klass._member_map_.values())
-            else:
-                self._knowledge[key] = list(map(lambda x: x.name.lower().replace("_", ""),
-                                                list(klass._member_map_.values())))
+        # We embed battles with the Embedder. We don't one-hot encode species, abilities or moves because of their large
+        # cardinalities
+        self._embedder = Embedder(gen=8, profile='singles_no_ohe')
+        self._SCHEMA = self._embedder.schema
+        self._EMBEDDING_SPACE = (1, self._SCHEMA.width)
 
         self._model = None
         self._create_model()
@@ -95,8 +77,7 @@ class SinglesDQNPlayer(EnvPlayer):
         # Get initializer for hidden layers
         init = tf.keras.initializers.RandomNormal(mean=.1, stddev=.02)
 
-        # Input Layer; this shape is one that just works
-        # TODO: Fix input shape for new embedding shape
+        # Input Layer; one embedding per observation (keras-rl adds the window length as the first dimension)
         self._model.add(Dense(512, input_shape=self._EMBEDDING_SPACE, activation="relu",
                               use_bias=False, kernel_initializer=init, name='first_hidden'))
 
@@ -264,267 +245,12 @@ class SinglesDQNPlayer(EnvPlayer):
         """
         return self._dqn
 
-    # Embeds a move in a 178-dimensional array.
-    # This includes a move's accuracy, base_power, whether it breaks protect, crit ratio, pp, damage, drain %,
-    # expected of hits, whether it forces a switch, how much it heals,
-    # whether it ignores abilities/defenses/evasion/immunity, min times it can hit, max times it can hit,
-    # its priority bracket, how much recoil it causes, whether it self destructs,
-    # whether it causes you to switch/steal boosts/thaw target/uses targets offense,
-    # the moves offensive category (ohe: 3), defensive category (ohe: 3), type (ohe: ), fields (ohe: ),
-    #           side conditions (ohe: ), weathers (ohe: ), targeting types (ohe: 14), volatility status (ohe: 57),
-    #           status (ohe: ), boosts (ohe: 6), self-boosts (ohe: 6),
-    # and the chance of a secondary effect
-    def _embed_move(self, move):
-
-        # If the move is None or empty, return a negative array (filled w/ -1's)
-        if move is None or move.is_empty: return [-1] * 177
-
-        embeddings = []
-
-        embeddings.append([
-            move.accuracy,
-            move.base_power,
-            int(move.breaks_protect),
-            move.crit_ratio,
-            # move.current_pp,  # doom-desire-ai
-            move.damage,
-            move.drain,
-            move.expected_hits,
-            int(move.force_switch),
-            move.heal,
-            int(move.ignore_ability),
-            int(move.ignore_defensive),
-            int(move.ignore_evasion),
-            1 if move.ignore_immunity else 0,
-            move.n_hit[0] if move.n_hit else 1,  # minimum times the move hits
-            move.n_hit[1] if move.n_hit else 1,  # maximum times the move hits
-            move.priority,
-            move.recoil,
-            int(move.self_destruct is not None),
-            int(move.self_switch is not None),
-            int(move.steals_boosts),
-            int(move.thaws_target),
-            int(move.use_target_offensive),
-        ])
-
-        # Add Category
-        embeddings.append([1 if move.category == category else 0 for category in self._knowledge['MoveCategory']])
-
-        # Add Defensive Category
-        embeddings.append([1 if move.defensive_category == category else 0
-                           for category in self._knowledge['MoveCategory']])
-
-        # Add Move Type
-        embeddings.append([1 if move.type == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-
-        # Add Fields (bad coding -- assumes field name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.id == field else 0 for field in self._knowledge['Field']])
-
-        # Add Side Conditions (bad coding -- assumes side condition name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.side_condition == sc else 0 for sc in self._knowledge['SideCondition']])
-
-        # Add Weathers (bad coding -- assumes field name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.weather == weather else 0 for weather in self._knowledge['Weather']])
-
-        # Add Targeting Types; cardinality is 14
-        embeddings.append([1 if move.deduced_target and move.deduced_target.lower() == tt else 0
-                           for tt in self._knowledge['TargetType']])
-
-        # Add Volatility Statuses; cardinality is 57
-        volatility_status_embeddings = []
-        for vs in self._knowledge['VolatileStatus']:
-            if vs == move.volatile_status:
-                volatility_status_embeddings.append(1)
-            elif move.secondary and vs in list(map(lambda x: x.get('volatilityStatus', '').lower(), move.secondary)):
-                volatility_status_embeddings.append(1)
-            else:
-                volatility_status_embeddings.append(0)
-        embeddings.append(volatility_status_embeddings)
-
-        # Add Statuses
-        status_embeddings = []
-        for status in self._knowledge['Status']:
-            if status == move.status:
-                status_embeddings.append(1)
-            elif move.secondary and status in list(map(lambda x: x.get('status', ''), move.secondary)):
-                status_embeddings.append(1)
-            else:
-                status_embeddings.append(0)
-        embeddings.append(status_embeddings)
-
-        # Add Boosts
-        boost_embeddings = {'atk': 0, 'def': 0, 'spa': 0, 'spd': 0, 'spe': 0, 'evasion': 0, 'accuracy': 0}
-        if move.boosts:
-            for stat in move.boosts: boost_embeddings[stat] += move.boosts[stat]
-        elif move.secondary:
-            for x in move.secondary:
-                for stat in x.get('boosts', {}): boost_embeddings[stat] += x['boosts'][stat]
-        embeddings.append(boost_embeddings.values())
-
-        # Add Self-Boosts
-        self_boost_embeddings = {'atk': 0, 'def': 0, 'spa': 0, 'spd': 0, 'spe': 0, 'evasion': 0, 'accuracy': 0}
-        if move.self_boost:
-            for stat in move.self_boost: self_boost_embeddings[stat] += move.self_boost[stat]
-        elif move.secondary:
-            for x in move.secondary:
-                for stat in x.get('self', {}).get('boosts', {}): self_boost_embeddings[stat] += x['self']['boosts'][
-                    stat]
-        embeddings.append(self_boost_embeddings.values())
-
-        # Introduce the chance of a secondary effect happening
-        chance = 0
-        for x in move.secondary:
-            chance = max(chance, x.get('chance', 0))
-        embeddings.append([chance])
-
-        return [item for sublist in embeddings for item in sublist]
-
-    # We encode the agent's mon in a 779-dimensional embedding
-    # We encode all the mons moves, whether it is active, it's current hp, whether it's fainted, its level,
-    # weight, whether it's recharging, preparing, dynamaxed, its stats, boosts, status,
-    # types and whether it's trapped or forced to switch out.
-    # We currently don't encode its item, abilities (271) or its species (1155) because of the large cardinalities
-    def _embed_mon(self, battle, mon):
-        embeddings = []
-
-        # Append moves to embedding (and account for the fact that the mon might have <4 moves)
-        for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
-            embeddings.append(self._embed_move(move))
-
-        # Add whether the mon is active, the current hp, whether its fainted, its level,
-        # its weight and whether its recharging or preparing
-        embeddings.append([
-            int(mon.active),
-            mon.current_hp,
-            int(mon.fainted),
-            mon.level,
-            # mon.weight,  # doom-desire-ai
-            int(mon.must_recharge),
-            1 if mon.preparing else 0,
-            int(mon.is_dynamaxed),
-        ])
-
-        # Add stats and boosts
-        embeddings.append(mon.stats.values())
-        embeddings.append(mon.boosts.values())
-
-        # Add status (one-hot encoded)
-        embeddings.append([1 if mon.status == status else 0 for status in self._knowledge['Status']])
-
-        # Add Types (one-hot encoded)
-        embeddings.append([1 if mon.type_1 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-        embeddings.append([1 if mon.type_2 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-
-        # Add whether the mon is trapped or forced to switch.
-        embeddings.append([
-            int(battle.trapped),
-            int(battle.force_switch),
-        ])
-
-        # Flatten all the lists into a Nx1 list
-        return [item for sublist in embeddings for item in sublist]
-
-    # We encode the opponent's mon in a 771-dimensional embedding
-    # We encode all the mons moves, whether it's active, if we know it's sent, it's current hp, whether it's fainted,
-    # its level, weight, whether it's recharging, preparing, dynamaxed, its base stats (because we don't know it's
-    # IV/EV/Nature), boosts, status, types and whether it's trapped or forced to switch out. We currently don't encode
-    # its item, possible abilities (271 * 3) or its species (1155) because of the large cardinalities
-    # In the future, we should predict high/low ranges of stats based on damage and speeds/hail, and items based on cues
-    def _embed_opp_mon(self, battle, mon):
-        embeddings = []
-
-        # Append moves to embedding (and account for the fact that the mon might have <4 moves)
-        for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
-            embeddings.append(self._embed_move(move))
-
-        # Add whether the mon is active, the current hp, whether its fainted, its level,
-        # its weight and whether its recharging or preparing
-        embeddings.append([
-            int(mon.active),  # This mon is on the field now
-            int(mon in battle.opponent_team.values()),  # This mon was brought
-            mon.current_hp,
-            int(mon.fainted),
-            mon.level,
-            mon.weight,
-            int(mon.must_recharge),
-            1 if mon.preparing else 0,
-            int(mon.is_dynamaxed),
-        ])
-
-        # Add stats and boosts
-        embeddings.append(mon.base_stats.values())
-        embeddings.append(mon.boosts.values())
-
-        # Add status (one-hot encoded)
-        embeddings.append([1 if mon.status == status else 0 for status in self._knowledge['Status']])
-
-        # Add Types (one-hot encoded)
-        embeddings.append([1 if mon.type_1 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-        embeddings.append([1 if mon.type_2 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-
-        # Add whether the mon is trapped or forced to switch. But first, find the index
-        index = None
-        if mon in battle.active_pokemon: index = 0 if battle.active_pokemon[0] == mon else 1
-        embeddings.append([
-            1 if index and battle.trapped[index] else 0,
-            1 if index and battle.force_switch[index] else 0,
-        ])
-
-        # Flatten all the lists into a Nx1 list
-        return [item for sublist in embeddings for item in sublist]
-
-    # Embeds the state of the battle in a 7814-dimensional embedding
+    # Embeds the state of the battle in a self._SCHEMA.width-dimensional embedding (see Embedder.embed_battle)
     # Embed mons (and whether they're active)
     # Embed opponent mons (and whether they're active, they've been brought or we don't know)
     # Then embed all the Fields, Side Conditions, Weathers, Player Ratings, # of Turns and the bias
-    def embed_battle(self, battle: DoubleBattle):
-        embeddings = []
-
-        # Add team to embeddings
-        for mon in battle.sent_team.values():
-            embeddings.append(self._embed_mon(battle, mon))
-
-        for mon in battle.opponent_team.values():  # Would work if we had perfect information
-            if mon is None:
-                print(battle.opponent_team)
-            embeddings.append(self._embed_mon(battle, mon))
-
-        # Embed opponent's mons. teampreview_opponent_team has empty move slots while opponent_team has moves we remember.
-        # We first embed opponent_active_pokemon, then ones we remember from the team, then the rest
-        # embedded_opp_mons = set()
-        # for mon in battle.opponent_active_pokemon:
-        #     if mon:
-        #         embeddings.append(self._embed_opp_mon(battle, mon))
-        #         embedded_opp_mons.add(mon.species)
-        #
-        # for mon in battle.opponent_team.values():
-        #     if mon.species in embedded_opp_mons: continue
-        #     embeddings.append(self._embed_opp_mon(battle, mon))
-        #     embedded_opp_mons.add(mon.species)
-        #
-        # for mon in battle.teampreview_opponent_team:
-        #     if mon in embedded_opp_mons: continue
-        #     embeddings.append(self._embed_opp_mon(battle, battle.teampreview_opponent_team[mon]))
-        #     embedded_opp_mons.add(mon)
-
-        # Add Dynamax stuff
-        embeddings.append(battle.can_dynamax + battle.opponent_can_dynamax + [battle.dynamax_turns_left,
-                                                                              battle.opponent_dynamax_turns_left])
-
-        # Add Fields;
-        embeddings.append([1 if field in battle.fields else 0 for field in self._knowledge['Field']])
-
-        # Add Side Conditions
-        embeddings.append([1 if sc in battle.side_conditions else 0 for sc in self._knowledge['SideCondition']])
-
-        # Add Weathers
-        embeddings.append([1 if weather == battle.weather else 0 for weather in self._knowledge['Weather']])
-
-        # Add Player Ratings, the battle's turn and a bias term
-        embeddings.append(list(map(lambda x: x if x else -1, [battle.rating, battle.opponent_rating, battle.turn, 1])))
-
-        # Flatten all the lists into a 7814-dim list
-        return np.array([item for sublist in embeddings for item in sublist])
+    def embed_battle(self, battle):
+        return self._embedder.embed_battle(battle)
 
     # Define the incremental reward for the current battle state over the last one
     def compute_reward(self, battle) -> float:
@@ -592,13 +318,20 @@ class SinglesDQNPlayer(EnvPlayer):
             env_algorithm_kwargs={"num_steps": num_steps},
         )
 
+    # Saves the model's weights, along with the version of the embedding schema they were trained on
     def save_model(self, filename=None) -> None:
-        if filename is not None:
-            self._dqn.save_weights("models/" + filename, overwrite=True)
-        else:
-            self._dqn.save_weights("models/model_" + datetime.now().strftime("%Y_%m_%d_%H_%M_%S"), overwrite=True)
+        if filename is None: filename = "model_" + datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+
+        self._dqn.save_weights("models/" + filename, overwrite=True)
+        with open("models/" + filename + ".schema", "w") as f:
+            f.write(self._SCHEMA.version)
 
+    # Loads the model's weights, checking that they were trained on the same embeddings we produce (if we know)
     def load_model(self, filename: str) -> None:
+        if os.path.exists("models/" + filename + ".schema"):
+            with open("models/" + filename + ".schema") as f:
+                self._SCHEMA.check_compatible(f.read().strip())
+
         self._dqn.load_weights("models/" + filename)
 
     def evaluate_model(self, num_battles: int, v=True) -> float:
@@ -613,23 +346,12 @@ class SinglesDQNPlayer(EnvPlayer):
         action = self._actions[battle].get()
         return self._action_to_move(action, battle)
 
-    # Same as max damage for now - we return the mons who have the best average type advantages against the other team
+    # For right now, we return a random ordering to facilitate learning
     # TODO: implement using Q-values and minimax to send out position that maximizes our worst position
     def teampreview(self, battle):
 
-        # We have a dict that has index in battle.team -> average type advantage
-        mon_performance = {}
-
-        # For each of our Pokemons
-        for i, mon in enumerate(battle.team.values()):
-            # We store their average performance against the opponent team
-            mon_performance[i] = np.mean([compute_type_advantage(mon, opp) for opp in battle.opponent_team.values()])
-
-        # We sort our mons by performance, and choose the top 4
-        ordered_mons = sorted(mon_performance, key=lambda k: -mon_performance[k])[:4]
-
-        # We start with the one we consider best overall
-        # We use i + 1 as python indexes start from 0 but showdown's indexes start from 1,
-        # and return the first 4 mons, in term of importance
-        # return "/team " + "".join([str(i + 1) for i in ordered_mons])
+        # To bring the mons who have the best average type advantages against the other team instead (like max damage),
+        # sort our mons by their average type advantage and choose the top 4, starting with the one we consider best
+        # overall. We use i + 1 as python indexes start from 0 but showdown's indexes start from 1:
+        # return "/team " + "".join([str(i + 1) for i in compute_teampreview_matchup(battle)[1][:4]])
         return "/team " + "".join(random.sample(list(map(lambda x: str(x + 1), range(0, len(battle.team)))), k=4))
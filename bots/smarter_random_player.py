@@ -13,6 +13,7 @@ from poke_env.player.battle_order import DoubleBattleOrder, BattleOrder, Default
 from poke_env.player.random_player import RandomPlayer
 from reuniclusVGC.helpers.doubles_utils import *
 from reuniclusVGC.bots.random_doubles_player import RandomDoublesPlayer
+from reuniclusVGC.helpers.turn_cache import cached_affected_targets, cached_target_to_mon, cached_is_valid
 
 # Random Bot that doesn't self-hit
 # TODO: there are some errors when you put edgecase teams against edgecase teams
@@ -26,7 +27,7 @@ class SmarterRandomPlayer(Player):
         # If we're not being forced to switch and are choosing our moves
         if not any(battle.force_switch):
 
-            filtered_orders = list(filter(lambda x: DoubleBattleOrder.is_valid(battle, x), orders))
+            filtered_orders = list(filter(lambda x: cached_is_valid(battle, x), orders))
             reasonable_orders = self._filter_to_reasonable_moves(battle, filtered_orders)
 
             if reasonable_orders: order =  random.choice(reasonable_orders)
@@ -91,11 +92,11 @@ class SmarterRandomPlayer(Player):
         if order.order.self_switch: return False
 
         # If it's a self-hit
-        affected_targets = BattleOrder.get_affected_targets(battle, order)
+        affected_targets = cached_affected_targets(battle, order)
         if affected_targets and min(affected_targets) < 0:
 
             # Get the mon who is going to be hit
-            target_mon = battle.active_pokemon[min(affected_targets)]
+            target_mon = cached_target_to_mon(battle, min(affected_targets))
 
             # Only allow this as a potential move under these conditions
             if target_mon.item == 'weaknesspolicy' and order.order.type.damage_multiplier(*target_mon.types) >= 2: return True
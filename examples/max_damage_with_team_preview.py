@@ -1,8 +1,8 @@
 import asyncio
-import numpy as np
 
 from poke_env.player.player import Player
 from poke_env.player.random_player import RandomPlayer
+from reuniclusVGC.helpers.doubles_utils import compute_teampreview_matchup
 
 
 class MaxDamagePlayer(Player):
@@ -18,20 +18,8 @@ class MaxDamagePlayer(Player):
             return self.choose_random_move(battle)
 
     def teampreview(self, battle):
-        mon_performance = {}
-
-        # For each of our pokemons
-        for i, mon in enumerate(battle.team.values()):
-            # We store their average performance against the opponent team
-            mon_performance[i] = np.mean(
-                [
-                    teampreview_performance(mon, opp)
-                    for opp in battle.opponent_team.values()
-                ]
-            )
-
-        # We sort our mons by performance
-        ordered_mons = sorted(mon_performance, key=lambda k: -mon_performance[k])
+        # We sort our mons by their average type advantage against the opponent team
+        _, ordered_mons = compute_teampreview_matchup(battle)
 
         # We start with the one we consider best overall
         # We use i + 1 as python indexes start from 0
@@ -39,20 +27,6 @@ class MaxDamagePlayer(Player):
         return "/team " + "".join([str(i + 1) for i in ordered_mons])
 
 
-def teampreview_performance(mon_a, mon_b):
-    # We evaluate the performance on mon_a against mon_b as its type advantage
-    a_on_b = b_on_a = -np.inf
-    for type_ in mon_a.types:
-        if type_:
-            a_on_b = max(a_on_b, type_.damage_multiplier(*mon_b.types))
-    # We do the same for mon_b over mon_a
-    for type_ in mon_b.types:
-        if type_:
-            b_on_a = max(b_on_a, type_.damage_multiplier(*mon_a.types))
-    # Our performance metric is the different between the two
-    return a_on_b - b_on_a
-
-
 async def main():
     team_1 = """
 Goodra (M) @ Assault Vest
@@ -0,0 +1,189 @@
+import numpy as np
+
+from poke_env.data import to_id_str
+from poke_env.environment.field import Field
+from poke_env.environment.move_category import MoveCategory
+from poke_env.environment.side_condition import SideCondition
+from poke_env.environment.status import Status
+from reuniclusVGC.helpers.doubles_utils import STAT_MODS
+from reuniclusVGC.helpers.stat_ranges import stat_range
+from reuniclusVGC.helpers.type_chart import DUAL_TYPE_MATRIX, TYPE_INDEX, TYPELESS, NUM_TYPES, type_pair_index
+
+# The 16 random rolls of the damage formula, in percent
+ROLLS = np.arange(85, 101, dtype=np.int64)
+
+# Showdown applies modifiers as fractions of 4096 (e.g. 6144 is 1.5x); this is the neutral one
+NEUTRAL = 4096
+
+# Moves that hit more than one mon get their damage reduced in doubles, if they do hit more than one
+SPREAD_TARGETS = {'alladjacent', 'alladjacentfoes'}
+
+# Terrains that boost the moves of their type (for grounded attackers), by field
+TERRAIN_TYPES = {Field.ELECTRIC_TERRAIN: 'ELECTRIC', Field.GRASSY_TERRAIN: 'GRASS', Field.PSYCHIC_TERRAIN: 'PSYCHIC'}
+
+# Applies a modifier (a fraction of 4096) to damage, rounding like showdown does (half down)
+def _modify(damage, modifier):
+    return (damage * modifier + 2047) // 4096
+
+# Chains two modifiers into one, like showdown does
+def _chain(modifier1, modifier2):
+    return (modifier1 * modifier2 + 2048) >> 12
+
+# Computes the 16 damage rolls of every attack at once, with Gen 8's damage formula. Every argument is an array with an
+# element per attack; modifiers (spread, weather, stab and final) are fractions of 4096, effectiveness is the type
+# multiplier, burned says whether the attacker's burn halves the damage, and fixed is the damage of moves that do a
+# fixed amount (0 for other moves). Returns an (attacks x 16) array of damage, lowest roll first
+def damage_rolls(level, base_power, attack, defense, spread, weather, stab, effectiveness, burned, final, fixed=None):
+    level, base_power = np.asarray(level, dtype=np.int64), np.asarray(base_power, dtype=np.int64)
+    attack, defense = np.asarray(attack, dtype=np.int64), np.maximum(np.asarray(defense, dtype=np.int64), 1)
+    effectiveness = np.asarray(effectiveness, dtype=np.float64)
+
+    damage = (2*level//5 + 2) * base_power * attack // defense // 50 + 2
+    damage = _modify(_modify(damage, np.asarray(spread)), np.asarray(weather))
+
+    rolls = damage[:, None] * ROLLS[None, :] // 100
+    rolls = _modify(rolls, np.asarray(stab)[:, None])
+    rolls = np.floor(rolls * effectiveness[:, None]).astype(np.int64)
+    rolls = np.where(np.asarray(burned)[:, None], rolls // 2, rolls)
+    rolls = _modify(rolls, np.asarray(final)[:, None])
+
+    # Attacks that land always do at least 1 damage; attacks without power (or that the target is immune to) do nothing
+    rolls = np.where((effectiveness > 0)[:, None] & (base_power > 0)[:, None], np.maximum(rolls, 1), 0)
+
+    if fixed is not None:
+        fixed = np.asarray(fixed, dtype=np.int64)
+        rolls = np.where((fixed > 0)[:, None] & (effectiveness > 0)[:, None], fixed[:, None], rolls)
+
+    return rolls
+
+# Returns a mon's stat, boosted. We know our mons' stats; for opponent mons, we assume the highest their species can have
+# at their level (see stat_ranges.py), which is the worst case when they attack us
+def _stat(mon, stat, boost):
+    value = (getattr(mon, 'stats', None) or {}).get(stat) or stat_range(mon, stat)[1]
+    return int(value * STAT_MODS[min(max(boost, -6), 6) + 6])
+
+# Returns the ids of a mon's ability and item
+def _ability_item(mon):
+    return to_id_str(mon.ability) if mon.ability else None, to_id_str(mon.item) if mon.item else None
+
+# Returns whether the battle is a doubles battle; doubles battles have a list of active mons
+def _is_doubles(battle):
+    return isinstance(battle.active_pokemon, list)
+
+# Returns whether a move will hit more than one mon (and so have its damage reduced): it targets every adjacent mon (or
+# foe), and more than one of them is on the field
+def _is_spread(battle, attacker, move, ours):
+    target = to_id_str(move.deduced_target or move.target or '')
+    if target not in SPREAD_TARGETS or not _is_doubles(battle): return False
+
+    allies, foes = (battle.active_pokemon, battle.opponent_active_pokemon) if ours else \
+        (battle.opponent_active_pokemon, battle.active_pokemon)
+
+    n = len([mon for mon in foes if mon is not None and not mon.fainted])
+    if target == 'alladjacent': n += len([mon for mon in allies if mon is not None and mon is not attacker and not mon.fainted])
+    return n > 1
+
+# Static information about moves we've seen, by move id (see _move_info)
+_MOVE_INFO = {}
+
+# Returns what we need of a move that doesn't change during battles: its base power, type (as an index), whether it's
+# physical, whether it hits the physical defense, which offensive stat it uses ('atk', 'spa', 'def' for body press or
+# 'target' for foul play) and its fixed damage (0 for most moves; -1 for moves that do the attacker's level)
+def _move_info(move):
+    info = _MOVE_INFO.get(move.id)
+    if info is None:
+        physical = move.category == MoveCategory.PHYSICAL
+        if move.use_target_offensive: offensive = 'target'
+        elif move.entry.get('overrideOffensiveStat') == 'def': offensive = 'def'
+        else: offensive = 'atk' if physical else 'spa'
+
+        fixed = -1 if move.damage == 'level' else (move.damage if isinstance(move.damage, int) else 0)
+        info = (move.base_power, TYPE_INDEX[move.type], move.type.name, physical,
+                move.defensive_category == MoveCategory.PHYSICAL, offensive, fixed)
+        _MOVE_INFO[move.id] = info
+    return info
+
+# Computes the damage distribution of every (attacker, move, target) triple in a battle at once. We know our own mons'
+# stats and items; for the opponent's, we use what we've seen and assume the rest is the worst case (see _stat).
+# Doesn't take into account crits, dynamax or most abilities and items. Returns an (attacks x 16) array of damage rolls
+# (see damage_rolls) and every target's current hp (estimated for the opponent's mons), so that
+# rolls >= hp[:, None] tells which rolls KO
+def compute_damage(battle, triples):
+    our_mons = set(map(id, battle.team.values()))
+    weather_name = battle.weather.name if battle.weather else None
+    terrain_types = [type_name for field, type_name in TERRAIN_TYPES.items() if field in battle.fields]
+
+    # One row per attack: level, base power, attack, defense, spread, weather, stab, move type, target types, immune,
+    # burned, final modifier, expert belt, fixed damage, target hp. A turn's candidate orders share a handful of
+    # attacks, so we only compute each distinct attack's row once
+    rows, computed = [], {}
+    for attacker, move, target in triples:
+        key = (id(attacker), id(move), id(target))
+        if key not in computed: computed[key] = _attack_row(battle, attacker, move, target, our_mons, weather_name, terrain_types)
+        rows.append(computed[key])
+
+    if not rows: return np.zeros((0, len(ROLLS)), dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    level, base_power, attack, defense, spread, weather, stab, move_types, target_pairs, immune, burned, final, \
+        expert_belt, fixed, hp = np.array(rows, dtype=np.int64).T
+
+    effectiveness = np.where(immune.astype(bool), 0, DUAL_TYPE_MATRIX[move_types, target_pairs])
+    final = np.where(expert_belt.astype(bool) & (effectiveness > 1), _chain(final, 4915), final)
+
+    return damage_rolls(level, base_power, attack, defense, spread, weather, stab, effectiveness, burned.astype(bool),
+                        final, fixed), hp
+
+# Returns the row of an attack (see compute_damage)
+def _attack_row(battle, attacker, move, target, our_mons, weather_name, terrain_types):
+    if attacker is None or move is None or target is None or move.category == MoveCategory.STATUS:
+        return (0, 0, 1, 1, NEUTRAL, NEUTRAL, NEUTRAL, TYPELESS, TYPELESS * NUM_TYPES + TYPELESS, False, False, NEUTRAL,
+                False, 0, 0)
+
+    base_power, move_type, type_name, physical, hits_def, offensive, fixed = _move_info(move)
+    ours, target_ours = id(attacker) in our_mons, id(target) in our_mons
+    ability, item = _ability_item(attacker)
+    target_ability, target_item = _ability_item(target)
+
+    # Terrains boost the base power of the moves of their type, if the attacker is grounded
+    if type_name in terrain_types and ability != 'levitate' and item != 'airballoon' and \
+            'FLYING' not in [type_.name for type_ in attacker.types if type_]:
+        base_power = _modify(base_power, 5325)
+
+    # Offensive stat; foul play uses the target's attack, and body press the attacker's defense
+    if offensive == 'target': attack = _stat(target, 'atk', target.boosts['atk'])
+    else:
+        attack = _stat(attacker, offensive, attacker.boosts[offensive])
+        if offensive == 'atk' and ability in ('hugepower', 'purepower'): attack *= 2
+        if (offensive == 'atk' and item == 'choiceband') or (offensive == 'spa' and item == 'choicespecs'): attack = attack * 3 // 2
+
+    # Defensive stat; some special moves (e.g. psyshock) hit the target's defense
+    stat = 'def' if hits_def else 'spd'
+    defense = _stat(target, stat, target.boosts[stat])
+    if (stat == 'spd' and target_item == 'assaultvest') or target_item == 'eviolite': defense = defense * 3 // 2
+
+    spread = 3072 if _is_spread(battle, attacker, move, ours) else NEUTRAL
+
+    weather = NEUTRAL
+    if weather_name in ('SUNNYDAY', 'DESOLATELAND'): weather = {'FIRE': 6144, 'WATER': 2048}.get(type_name, NEUTRAL)
+    elif weather_name in ('RAINDANCE', 'PRIMORDIALSEA'): weather = {'WATER': 6144, 'FIRE': 2048}.get(type_name, NEUTRAL)
+
+    stab = NEUTRAL
+    if move.type in attacker.types: stab = 8192 if ability == 'adaptability' else 6144
+
+    immune = type_name == 'GROUND' and (target_ability == 'levitate' or target_item == 'airballoon')
+    burned = physical and attacker.status == Status.BRN and ability != 'guts'
+
+    # Final modifiers: screens on the target's side (which only take a third off in doubles) and the attacker's items
+    final = NEUTRAL
+    side_conditions = battle.side_conditions if target_ours else battle.opponent_side_conditions
+    if SideCondition.AURORA_VEIL in side_conditions or \
+            SideCondition.REFLECT in side_conditions and physical or \
+            SideCondition.LIGHT_SCREEN in side_conditions and not physical:
+        final = _chain(final, 2732 if _is_doubles(battle) else 2048)
+
+    if item == 'lifeorb': final = _chain(final, 5324)
+
+    hp = target.current_hp if target_ours else round(stat_range(target, 'hp')[1] * target.current_hp_fraction)
+
+    return (attacker.level, base_power, attack, defense, spread, weather, stab, move_type, type_pair_index(target), immune,
+            burned, final, item == 'expertbelt', attacker.level if fixed == -1 else fixed, hp)
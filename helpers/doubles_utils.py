@@ -6,6 +6,9 @@ from poke_env.environment.pokemon import Pokemon
 from poke_env.environment.field import Field
 from poke_env.environment.status import Status
 from poke_env.environment.side_condition import SideCondition
+from poke_env.data import to_id_str
+from reuniclusVGC.helpers.stat_ranges import stat_range
+from reuniclusVGC.helpers.type_chart import ADVANTAGE_MATRIX, type_pair_index, type_advantage_matrix, team_matchup
 from enum import Enum, unique, auto
 
 from typing import Optional
@@ -13,109 +16,142 @@ import random
 import numpy as np
 import itertools
 
+# Stat modifiers for every boost level, from -6 to 6: STAT_MODS[boost + 6]
+STAT_MODS = np.array([2/8, 2/7, 2/6, 2/5, 2/4, 2/3, 1, 3/2, 4/2, 5/2, 6/2, 7/2, 8/2])
+
 # Given a boost level, returns the modifier
 def statMod(statStage):
-    if statStage == 0: multiplier = 1
-    elif statStage == 1: multiplier = 1.5
-    elif statStage == -1: multiplier = 2.0/3
-    elif statStage == 2: multiplier = 2
-    elif statStage == -2: multiplier = 1.0/2
-    elif statStage == 3: multiplier = 2.5
-    elif statStage == -3: multiplier = 0.4
-    elif statStage == 4: multiplier = 3
-    elif statStage == -4: multiplier = 1.0/3
-    elif statStage == 5: multiplier = 3.5
-    elif statStage == -5: multiplier = 2.0/7
-    elif statStage == 6: multiplier = 4
-    elif statStage == -6: multiplier = 1.0/4
-    else: multiplier = 1
-    return multiplier
-
-# We evaluate the performance on mon1 against mon2 by its type advantage
-# We return how much better you can perform
-def compute_type_advantage(mon1, mon2):
-
-    a_on_b = b_on_a = -np.inf
-
-    # Store the max damage multiplier that the mon can do
-    for type_ in mon1.types:
-        if type_: a_on_b = max(a_on_b, type_.damage_multiplier(*mon2.types))
-
-    # Do the other way around
-    for type_ in mon2.types:
-        if type_: b_on_a = max(b_on_a, type_.damage_multiplier(*mon1.types))
+    if -6 <= statStage <= 6: return float(STAT_MODS[statStage + 6])
+    return 1
 
-    # Our performance metric is the difference between the two
-    return a_on_b - b_on_a
+# We evaluate the performance on mon1 against mon2 by its type advantage: the best multiplier mon1 can get with its types
+# on mon2, minus the best one mon2 can get on mon1. We return how much better you can perform
+def compute_type_advantage(mon1, mon2):
+    return float(ADVANTAGE_MATRIX[type_pair_index(mon1), type_pair_index(mon2)])
+
+# Same as compute_type_advantage, but for every pair of mons at once; returns a len(mons) x len(opp_mons) matrix
+def compute_team_type_advantage(mons, opp_mons):
+    return type_advantage_matrix(list(mons), list(opp_mons))
+
+# At teampreview, returns our team's type advantage matrix against the opponent's team, and the indices of our mons
+# (in battle.team) ranked by their average type advantage, best first. Repeated matchups are cached (see team_matchup)
+def compute_teampreview_matchup(battle):
+    team = tuple(mon.species for mon in battle.team.values())
+    opp_team = tuple(mon.species for mon in battle.opponent_team.values())
+    return team_matchup(team, opp_team)
+
+# Abilities that double a mon's speed, and the weathers they need (as Weather names)
+SPEED_WEATHER_ABILITIES = {
+    'slushrush': ('HAIL',),
+    'sandrush': ('SANDSTORM',),
+    'chlorophyll': ('SUNNYDAY', 'DESOLATELAND'),
+    'swiftswim': ('RAINDANCE', 'PRIMORDIALSEA'),
+}
+
+# Returns the speed multiplier that abilities give in the current weather and terrain. abilities are every ability the mon
+# could have, as ids (e.g. 'swiftswim'); if any of them doubles the mon's speed, we assume it does. We compare ids
+# because poke_env gives us ids for known abilities, not display names ('Swift Swim' never matched). Surge Surfer only
+# needs electric terrain, whatever the weather (it used to be checked only when there was weather)
+def _ability_speed_multiplier(battle, abilities):
+    weather = battle.weather.name if battle.weather else None
+    for ability in abilities:
+        if weather in SPEED_WEATHER_ABILITIES.get(ability, ()): return 2
+        if ability == 'surgesurfer' and Field.ELECTRIC_TERRAIN in battle.fields: return 2
+    return 1
+
+# Returns the ids of every ability a mon could have. poke_env stores them as the pokedex's dict of slot -> name, so we
+# look at its values (testing 'Swift Swim' in it only ever looked at the slots, e.g. '0' and 'H')
+def _possible_ability_ids(mon):
+    abilities = mon.possible_abilities or {}
+    return [to_id_str(ability) for ability in (abilities.values() if isinstance(abilities, dict) else abilities)]
+
+# Returns the speed multiplier of a side's conditions
+def _side_speed_multiplier(side_conditions):
+    if SideCondition.GRASS_PLEDGE in side_conditions: return .25 # GRASS_PLEDGE, or creating a swamp
+    elif SideCondition.TAILWIND in side_conditions: return 2
+    return 1
+
+# Returns the speed multiplier of a mon's status: paralysis halves speed, unless the mon has quick feet, which instead
+# boosts its speed by 1.5 with any status (and does nothing without one; it used to boost mons without a status)
+def _status_speed_multiplier(mon, ability):
+    if ability == 'quickfeet' and mon.status: return 1.5
+    elif mon.status == Status.PAR: return .5
+    return 1
+
+# Returns the worst case speed of a mon we don't know the stats of: the fastest it could be, or under trick room, the
+# slowest (see stat_ranges.py)
+def _worst_case_base_speed(mon, tr):
+    low, high = stat_range(mon, 'spe')
+    return low if tr else high
 
 # We compute the speed of a pokemon, based on the battle conditions, the mon itself and
 # whether it is an opponent mon. Does not take into account unburden
-# TODO: test
 def compute_effective_speed(battle, mon):
-    speed = mon.stats['spe']
-
-    # Abilities
-    if battle.weather:
-        if mon.ability == 'Slush Rush' and battle.weather.name == 'HAIL': speed *= 2
-        elif mon.ability == 'Sand Rush' and battle.weather.name == 'SANDSTORM': speed *= 2
-        elif mon.ability == 'Chlorophyll' and battle.weather.name in  ['SUNNYDAY', 'DESOLATELAND']: speed *= 2
-        elif mon.ability == 'Swift Swim' and battle.weather.name in ['RAINDANCE', 'PRIMORDIALSEA']: speed *= 2
-        elif mon.ability == 'Surge Surfer' and Field.ELECTRIC_TERRAIN in battle.fields: speed *= 2 # Field(1) corresponds to Electric Terrain
+    ability = to_id_str(mon.ability) if mon.ability else None
 
-    # Incorporate boosts
+    speed = mon.stats['spe']
+    speed *= _ability_speed_multiplier(battle, [ability])
     speed *= statMod(mon.boosts['spe'])
-
-    # Incorporate status (Paralysis) if the mon doesnt have quickfeed
-    if mon.ability == 'Quick Feet' and not mon.status: speed *= 1.5
-    elif mon.status and mon.status == Status.PAR: speed *= .5 # Status(4) corresponds to paralysis
+    speed *= _status_speed_multiplier(mon, ability)
 
     # Held Items (choice scarf, iron ball)
     if mon.item == 'ironball': speed *= .5
     elif mon.item == 'choicescarf': speed *= 1.5
 
-    # Side Conditions
-    if SideCondition.GRASS_PLEDGE in battle.side_conditions: speed *= .25 # GRASS_PLEDGE, or creating a swamp
-    elif SideCondition.TAILWIND in battle.side_conditions: speed *= 2 # TAILWIND
-
-    return speed
+    return speed * _side_speed_multiplier(battle.side_conditions)
 
 # We compute the speed of an opponent pokemon in the worst case scenario
-# TODO: test
 def compute_worst_case_scenario_speed(battle, mon):
-    tr = Field.TRICK_ROOM in battle.fields
+    ability = to_id_str(mon.ability) if mon.ability else None
 
-    # Use stat equation
-    speed = (2*mon.base_stats['spe'] + 31 + 252/4)*mon.level/100 + 5
+    # Use the mon's speed range; assuming that a mon would use their speed abilities
+    speed = _worst_case_base_speed(mon, Field.TRICK_ROOM in battle.fields)
+    speed *= _ability_speed_multiplier(battle, _possible_ability_ids(mon))
+    speed *= statMod(mon.boosts['spe'])
+    speed *= _status_speed_multiplier(mon, ability)
 
-    # Natures modification
-    speed *= .9 if tr else 1.1
+    # We don't take into account Held Items (choice scarf, iron ball) because it would make this reward useless
+    # in situations where they aren't available. Eventually, we need to run code to use all battle cues (hail, sandstorm, mon order)
+    # to guess speed number ranges. The mon is the opponent's, so their side's conditions (e.g. their tailwind) apply
+    return speed * _side_speed_multiplier(battle.opponent_side_conditions)
+
+# Computes the speed of every active mon at once: ours (with their actual stats and items), then the opponent's (in the
+# worst case scenario, see compute_worst_case_scenario_speed), each with their side's conditions (e.g. tailwind).
+# Returns the vector of speeds (nan where there's no mon), and the order in which the mons move (as indices in that
+# vector, fastest first, or slowest first under trick room; missing mons go last). Ties keep our mons first.
+# None of our bots use speeds yet (see compute_reward's ideas); this and the functions above are there for the ones that
+# will
+def compute_turn_order(battle):
+    actives = battle.active_pokemon if isinstance(battle.active_pokemon, list) else [battle.active_pokemon]
+    opp_actives = battle.opponent_active_pokemon if isinstance(battle.opponent_active_pokemon, list) else [battle.opponent_active_pokemon]
+    tr = Field.TRICK_ROOM in battle.fields
 
-    # Abilities; assuming that a mon would use their speed abilities
-    if battle.weather:
-        if 'Slush Rush' in mon.possible_abilities and battle.weather.name == 'HAIL': speed *= 2
-        elif 'Sand Rush' in mon.possible_abilities and battle.weather.name == 'SANDSTORM': speed *= 2
-        elif 'Chlorophyll' in mon.possible_abilities and battle.weather.name in  ['SUNNYDAY', 'DESOLATELAND']: speed *= 2
-        elif 'Swift Swim' in mon.possible_abilities and battle.weather.name in ['RAINDANCE', 'PRIMORDIALSEA']: speed *= 2
-        elif 'Surge Surfer' in mon.possible_abilities  and Field.ELECTRIC_TERRAIN in battle.fields: speed *= 2 # Field(1) corresponds to Electric Terrain
+    n = len(actives) + len(opp_actives)
+    base, boosts, multipliers = np.full(n, np.nan), np.zeros(n, dtype=np.intp), np.ones(n)
+    sides = np.array([_side_speed_multiplier(battle.side_conditions)] * len(actives) +
+                     [_side_speed_multiplier(battle.opponent_side_conditions)] * len(opp_actives))
 
-    # Incorporate boosts
-    speed *= statMod(mon.boosts['spe'])
+    for i, mon in enumerate(actives + opp_actives):
+        if mon is None: continue
 
-    # Incorporate status (Paralysis) if the mon doesnt have quickfeed
-    if mon.ability == 'Quick Feet' and not mon.status: speed *= 1.5
-    elif mon.status == Status.PAR: speed *= .5 # Status(4) corresponds to paralysis
+        ability = to_id_str(mon.ability) if mon.ability else None
+        if i < len(actives) and mon.stats.get('spe'):
+            base[i] = mon.stats['spe']
+            abilities = [ability]
+            if mon.item == 'ironball': multipliers[i] *= .5
+            elif mon.item == 'choicescarf': multipliers[i] *= 1.5
+        else:
+            base[i] = _worst_case_base_speed(mon, tr)
+            abilities = _possible_ability_ids(mon)
 
-    # We don't take into account Held Items (choice scarf, iron ball) because it would make this reward useless
-    # in situations where they aren't available. Eventually, we need to run code to use all battle cues (hail, sandstorm, mon order)
-    # to guess speed number ranges
-    # if mon.item == 'ironball': speed *= .5
-    # elif mon.item == 'choicescarf': speed *= 1.5
+        boosts[i] = min(max(mon.boosts['spe'], -6), 6)
+        multipliers[i] *= _ability_speed_multiplier(battle, abilities) * _status_speed_multiplier(mon, ability)
 
-    # Side Conditions
-    if SideCondition.GRASS_PLEDGE in battle.side_conditions: speed *= .25 # GRASS_PLEDGE, or creating a swamp
-    elif SideCondition.TAILWIND in battle.side_conditions: speed *= 2 # TAILWIND
+    speeds = base * STAT_MODS[boosts + 6] * multipliers * sides
 
-    return speed
+    # nans sort last either way
+    order = np.argsort(speeds if tr else -speeds, kind='stable')
+    return speeds, order
 
 def battle_debug(battle):
     print()
@@ -1,7 +1,11 @@
 import sys
+from collections import OrderedDict
 from typing import Dict, List, Optional
 
-from poke_env.data import GEN_TO_MOVES, GEN_TO_POKEDEX
+import numpy as np
+
+from poke_env.data import GEN_TO_MOVES, GEN_TO_POKEDEX, to_id_str
+from poke_env.environment.move import Move
 from poke_env.environment.field import Field
 from poke_env.environment.side_condition import SideCondition
 from poke_env.environment.status import Status
@@ -13,114 +17,281 @@ from poke_env.environment.volatile_status import VolatileStatus
 from poke_env.environment.battle import Battle
 from poke_env.player.battle_order import *
 from reuniclusVGC.helpers.doubles_utils import *
+from reuniclusVGC.helpers.encoder import OneHotEncoder, enum_to_id
+from reuniclusVGC.helpers.embedding_schema import EmbeddingSchema
+from reuniclusVGC.helpers.knowledge import load_knowledge, load_table, knowledge_version
+
+# The order in which we embed stats and boosts
+MOVE_BOOSTS = ['atk', 'def', 'spa', 'spd', 'spe', 'evasion', 'accuracy']
+BOOSTS = ['accuracy', 'atk', 'def', 'evasion', 'spa', 'spd', 'spe']
+STATS = ['atk', 'def', 'spa', 'spd', 'spe']
+BASE_STATS = ['hp', 'atk', 'def', 'spa', 'spd', 'spe']
+
+# poke_env's singles battles have a single active mon (and a single trapped, force_switch and can_dynamax flag) where
+# doubles battles have lists
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
 
 class Embedder():
 
-    def __init__(self, gen=8, priority=0):
+    # Feature profiles that configure what we embed: whether battles are doubles or singles, how many mons we embed
+    # for each side (VGC teams bring 4 mons out of the 6 the opponent shows at teampreview; empty slots are filled with
+    # -1's so that battle embeddings always have the same shape), and whether we one-hot encode species, abilities and
+    # moves, which make up most of the embedding's width
+    PROFILES = {
+        'doubles': {'doubles': True, 'team_size': 4, 'opp_team_size': 6, 'ohe': True},
+        'doubles_no_ohe': {'doubles': True, 'team_size': 4, 'opp_team_size': 6, 'ohe': False},
+        'singles': {'doubles': False, 'team_size': 6, 'opp_team_size': 6, 'ohe': True},
+        'singles_no_ohe': {'doubles': False, 'team_size': 6, 'opp_team_size': 6, 'ohe': False},
+    }
+
+    # How many battles we remember mon embeddings for (see _embed_cached); the least recently embedded ones are dropped
+    MAX_CACHED_BATTLES = 256
+
+    # Static move embeddings only depend on the generation, so we compute them once and share them across Embedders
+    # (and across processes, through the on-disk cache in knowledge.py).
+    # Maps gen -> (move_id -> row index, float32 table of shape (# of moves, MOVE_LEN))
+    _MOVE_TABLES = {}
+
+    # Bump this whenever _compute_move_embedding changes, so that we don't load stale move tables from disk
+    _MOVE_TABLE_VERSION = 1
+
+    def __init__(self, gen=8, priority=0, profile='doubles'):
 
         # TODO: implement by creating priority tiers with which we should embed different aspects of the game
         self.priority = priority
         self.gen = gen
 
-        # Store all possible game-related knowledge, so that we can can embed battle states. The tuples are key where
-        # we retrieve the classes, the class, and whether poke_env supports returning the class (as opposed to string)
-        self._knowledge = {}
-        sets = [
-            ('Field', Field, False),
-            ('SideCondition', SideCondition, False),
-            ('Status', Status, True),
-            ('Weather', Weather, True),
-            ('PokemonType', PokemonType, True),
-            ('MoveCategory', MoveCategory, True),
-            ('TargetType', TargetType, False),
-            ('VolatileStatus', VolatileStatus, False),
-        ]
+        if profile not in self.PROFILES: raise ValueError(f"Unknown embedding profile {profile}; expected one of {list(self.PROFILES)}")
+        self.profile = profile
+        self.doubles = self.PROFILES[profile]['doubles']
+        self.ohe = self.PROFILES[profile]['ohe']
+        self.TEAM_SIZE = self.PROFILES[profile]['team_size']
+        self.OPP_TEAM_SIZE = self.PROFILES[profile]['opp_team_size']
+
+        # Load all possible game-related knowledge, so that we can can embed battle states. This is built once per
+        # generation and cached on disk
+        self._knowledge, self._species_abilities = load_knowledge(gen)
+        self._knowledge_version = knowledge_version(self._knowledge)
+
+        # Maps every value we know about to where it goes in its one-hot encoding
+        self._encoder = OneHotEncoder(self._knowledge)
+
+        # Describe the layout of every embedding; their lengths and offsets depend on the generation
+        self._build_schemas()
+
+        # The offsets (within a move's features) of the only ones that change during a battle: the targeting type
+        # (which showdown can override via request_target) and the current pp. Everything else in a move is static
+        self._MOVE_TARGET_OFFSET = self.move_features_schema.offset('target_type')
+        self._MOVE_PP_OFFSET = self.move_features_schema.offset('properties') + 4
+
+        # These are the lengths of the embeddings of each function. Features are everything but the OHEs of species,
+        # abilities and moves, which the sparse embeddings replace with ids
+        self.MOVE_FEATURES_LEN = self.move_features_schema.width
+        self.MON_FEATURES_LEN = self.mon_features_schema.width
+        self.OPP_MON_FEATURES_LEN = self.opp_mon_features_schema.width
+        self.MOVE_LEN = self.move_schema.width
+        self.MON_LEN = self.mon_schema.width
+        self.OPP_MON_LEN = self.opp_mon_schema.width
+        self.BATTLE_LEN = self.conditions_schema.width
+        self.EMBEDDING_LEN = self.schema.width
+
+        # Sparse embeddings split battles into integer ids (for embedding lookups) and a dense vector of everything else.
+        # Our mons get ids for their species, ability and 4 moves; opponent mons for their species, 3 possible
+        # abilities and 4 moves. SPARSE_ID_KEYS tells which vocabulary (see vocab_size) each id belongs to
+        mon_id_keys = ['Pokemon', 'Ability'] + ['Move']*4
+        opp_mon_id_keys = ['Pokemon'] + ['Ability']*3 + ['Move']*4
+        self.SPARSE_ID_KEYS = mon_id_keys*self.TEAM_SIZE + opp_mon_id_keys*self.OPP_TEAM_SIZE
+        self.SPARSE_IDS_LEN = self.sparse_ids_schema.width
+        self.SPARSE_DENSE_LEN = self.sparse_schema.width
+
+        # Precompute every move of the generation
+        if gen not in Embedder._MOVE_TABLES:
+            move_index = {move_id: i for i, move_id in enumerate(self._knowledge['Move'])}
+            version = "%s_%d" % (self.move_schema.version, self._MOVE_TABLE_VERSION)
+            Embedder._MOVE_TABLES[gen] = (move_index, load_table(gen, 'move_table', version, self._build_move_table))
+        self._move_index, self._move_table = Embedder._MOVE_TABLES[gen]
+
+        # battle_tag -> {(embedding function, species) -> (fingerprint, embedding)}
+        self._cache = OrderedDict()
+
+    # Builds the schemas of every embedding we produce, from the knowledge sets. schema describes embed_battle;
+    # sparse_ids_schema and sparse_schema describe the ids and dense vector of embed_battle_sparse
+    def _build_schemas(self):
+        size = self._encoder.size
+
+        # Move features, in the order _compute_move_embedding writes them
+        self.move_features_schema = EmbeddingSchema('move_features', self._knowledge_version) \
+            .add('category', size('MoveCategory')).add('defensive_category', size('MoveCategory')) \
+            .add('type', size('PokemonType')).add('field', size('Field')).add('side_condition', size('SideCondition')) \
+            .add('weather', size('Weather')).add('target_type', size('TargetType')) \
+            .add('volatile_status', size('VolatileStatus')).add('status', size('Status')) \
+            .add('boosts', len(MOVE_BOOSTS)).add('self_boosts', len(MOVE_BOOSTS)).add('secondary_chance', 1) \
+            .add('properties', 23)
+        self.move_schema = EmbeddingSchema('move', self._knowledge_version).add('move', size('Move')) \
+            .add('features', self.move_features_schema)
+
+        # Mon features; flags are whether the mon is active (and for opponents, whether it was brought), its hp, etc.
+        self.mon_features_schema = EmbeddingSchema('mon_features', self._knowledge_version).add('flags', 8) \
+            .add('stats', len(STATS)).add('boosts', len(BOOSTS)).add('status', size('Status')) \
+            .add('type_1', size('PokemonType')).add('type_2', size('PokemonType')).add('trapped_force_switch', 2)
+        self.opp_mon_features_schema = EmbeddingSchema('opp_mon_features', self._knowledge_version).add('flags', 9) \
+            .add('base_stats', len(BASE_STATS)).add('boosts', len(BOOSTS)).add('status', size('Status')) \
+            .add('type_1', size('PokemonType')).add('type_2', size('PokemonType')).add('trapped_force_switch', 2)
+
+        self.mon_schema = EmbeddingSchema('mon', self._knowledge_version).add('species', size('Pokemon')) \
+            .add('ability', size('Ability'))
+        for i in range(4): self.mon_schema.add('move_%d' % i, self.move_schema)
+        self.mon_schema.add('features', self.mon_features_schema)
+
+        self.opp_mon_schema = EmbeddingSchema('opp_mon', self._knowledge_version)
+        for i in range(4): self.opp_mon_schema.add('move_%d' % i, self.move_schema)
+        self.opp_mon_schema.add('species', size('Pokemon')).add('abilities', size('Ability')) \
+            .add('features', self.opp_mon_features_schema)
+
+        # What sparse embeddings (and profiles without OHEs) keep of every mon: the features of its moves and its own
+        self.mon_dense_schema = EmbeddingSchema('mon_dense', self._knowledge_version)
+        self.opp_mon_dense_schema = EmbeddingSchema('opp_mon_dense', self._knowledge_version)
+        for i in range(4):
+            self.mon_dense_schema.add('move_%d' % i, self.move_features_schema)
+            self.opp_mon_dense_schema.add('move_%d' % i, self.move_features_schema)
+        self.mon_dense_schema.add('features', self.mon_features_schema)
+        self.opp_mon_dense_schema.add('features', self.opp_mon_features_schema)
+
+        # Dynamax is whether each active mon can dynamax and both sides' dynamax turns left; globals are the player
+        # ratings, the turn and the bias
+        actives = 2 if self.doubles else 1
+        self.conditions_schema = EmbeddingSchema('conditions', self._knowledge_version).add('dynamax', 2*actives + 2) \
+            .add('fields', size('Field')).add('side_conditions', size('SideCondition')).add('weather', size('Weather')) \
+            .add('globals', 4)
+
+        self.schema = EmbeddingSchema('battle_' + self.profile, self._knowledge_version)
+        for i in range(self.TEAM_SIZE):
+            self.schema.add('mon_%d' % i, self.mon_schema if self.ohe else self.mon_dense_schema)
+        for i in range(self.OPP_TEAM_SIZE):
+            self.schema.add('opp_mon_%d' % i, self.opp_mon_schema if self.ohe else self.opp_mon_dense_schema)
+        self.schema.add('conditions', self.conditions_schema)
+
+        # Sparse embeddings keep the features of every move and mon
+        self.sparse_schema = EmbeddingSchema('sparse_battle_' + self.profile, self._knowledge_version)
+        for i in range(self.TEAM_SIZE): self.sparse_schema.add('mon_%d' % i, self.mon_dense_schema)
+        for i in range(self.OPP_TEAM_SIZE): self.sparse_schema.add('opp_mon_%d' % i, self.opp_mon_dense_schema)
+        self.sparse_schema.add('conditions', self.conditions_schema)
+
+        self.sparse_ids_schema = EmbeddingSchema('sparse_battle_ids', self._knowledge_version)
+        for i in range(self.TEAM_SIZE):
+            self.sparse_ids_schema.add('mon_%d' % i, EmbeddingSchema('mon_ids', self._knowledge_version).add('species', 1).add('ability', 1)
+                                       .add('moves', 4))
+        for i in range(self.OPP_TEAM_SIZE):
+            self.sparse_ids_schema.add('opp_mon_%d' % i, EmbeddingSchema('opp_mon_ids', self._knowledge_version).add('species', 1)
+                                       .add('abilities', 3).add('moves', 4))
+
+    # Embeds every move of the generation into a dense table, with one row per move in self._knowledge['Move']
+    def _build_move_table(self):
+        return np.array([self._compute_move_embedding(Move(move_id)) for move_id in self._knowledge['Move']])
+
+    # Returns the number of ids of a vocabulary used in sparse embeddings (what an embedding lookup layer needs);
+    # id 0 is reserved for unknown or missing values
+    def vocab_size(self, key):
+        return self._encoder.size(key) + 1
+
+    # Returns an array of an embedded move. If out is passed, we write the embedding into it instead
+    def _embed_move(self, move, out=None):
+        embedding = np.empty(self.MOVE_LEN, dtype=np.float32) if out is None else out
+
+        # If the move is None or empty, return a negative array (filled w/ -1's)
+        if move is None or move.is_empty:
+            embedding[:] = -1
+            return embedding
 
-        for key, klass, supported in sets:
-            if supported: self._knowledge[key] =  list(klass._member_map_.values())
-            else: self._knowledge[key] = list(map(lambda x: x.name.lower().replace("_", ""), list(klass._member_map_.values())))
+        embedding[:self._encoder.size('Move')] = 0
+        i = self._encoder.encode(embedding, 0, 'Move', move.id)
+        self._embed_move_features(move, out=embedding[i:])
 
-        self._knowledge['Move'] = list(GEN_TO_MOVES[gen].keys())
-        self._knowledge['Pokemon'] = list(GEN_TO_POKEDEX[gen].keys())
-        self._knowledge['Ability'] = list(set([
-            ability for sublist in map(lambda x: x['abilities'].values(), GEN_TO_POKEDEX[gen].values()) for ability in sublist
-            ]))
+        return embedding
 
-        # These are the lengths of the embeddings of each function. TODO: depends on the generation
-        self.MOVE_LEN = 1039 # for gen8
-        self.MON_LEN = 100
-        self.OPP_MON_LEN = 50
-        self.BATTLE_LEN = 100
+    # Returns an array of a move's features (everything but its OHE). We look up the precomputed static embedding and
+    # only patch the features that can change during a battle. If out is passed, we write into it instead
+    def _embed_move_features(self, move, out=None):
+        embedding = np.empty(self.MOVE_FEATURES_LEN, dtype=np.float32) if out is None else out
 
-    # Returns an array of an embedded move; could be precomputed
-    def _embed_move(self, move):
         # If the move is None or empty, return a negative array (filled w/ -1's)
-        if move is None or move.is_empty: return [-1]*self.MOVE_LEN
+        if move is None or move.is_empty:
+            embedding[:] = -1
+            return embedding
+
+        # Moves we don't know about (shouldn't happen) get embedded from scratch
+        if move.id not in self._move_index:
+            embedding[:] = self._compute_move_embedding(move)[self._encoder.size('Move'):]
+            return embedding
+
+        embedding[:] = self._move_table[self._move_index[move.id], self._encoder.size('Move'):]
+
+        # Patch targeting types, since showdown can tell us a different target than the move's default
+        start = self._MOVE_TARGET_OFFSET
+        embedding[start:start + self._encoder.size('TargetType')] = 0
+        self._encoder.encode(embedding, start, 'TargetType', move.deduced_target.lower() if move.deduced_target else None)
 
-        embeddings = []
+        # Patch pp
+        embedding[self._MOVE_PP_OFFSET] = move.current_pp
+
+        return embedding
+
+    # Computes the embedding of a move from scratch. Used to build the move table
+    def _compute_move_embedding(self, move):
+        embedding = np.zeros(self.MOVE_LEN, dtype=np.float32)
+        secondary = move.secondary or []
 
         # OHE Move, Category, Defensive Category, Move Type
-        embeddings.append([1 if move.id == m else 0 for m in self._knowledge['Move']])
-        embeddings.append([1 if move.category == category else 0 for category in self._knowledge['MoveCategory']])
-        embeddings.append([1 if move.defensive_category == category else 0 for category in self._knowledge['MoveCategory']])
-        embeddings.append([1 if move.type == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
+        i = self._encoder.encode(embedding, 0, 'Move', move.id)
+        i = self._encoder.encode(embedding, i, 'MoveCategory', move.category)
+        i = self._encoder.encode(embedding, i, 'MoveCategory', move.defensive_category)
+        i = self._encoder.encode(embedding, i, 'PokemonType', move.type)
 
         # OHE Fields, SC, Weather (bad coding -- assumes field name will be move name, and uses string manipulation)
-        embeddings.append([1 if move.id == field else 0 for field in self._knowledge['Field']])
-        embeddings.append([1 if move.side_condition == sc else 0 for sc in self._knowledge['SideCondition']])
-        embeddings.append([1 if move.weather == weather else 0 for weather in self._knowledge['Weather']])
+        i = self._encoder.encode(embedding, i, 'Field', move.id)
+        i = self._encoder.encode(embedding, i, 'SideCondition', move.side_condition)
+        i = self._encoder.encode(embedding, i, 'Weather', move.weather)
 
         # OHE Targeting Types
-        embeddings.append([1 if move.deduced_target and move.deduced_target.lower() == tt else 0 for tt in self._knowledge['TargetType']])
+        i = self._encoder.encode(embedding, i, 'TargetType', move.deduced_target.lower() if move.deduced_target else None)
 
         # OHE Volatility Statuses
-        volatility_status_embeddings = []
-        for vs in self._knowledge['VolatileStatus']:
-            if vs == move.volatile_status: volatility_status_embeddings.append(1)
-            elif move.secondary and vs in list(map(lambda x: x.get('volatilityStatus', '').lower(), move.secondary)): volatility_status_embeddings.append(1)
-            else: volatility_status_embeddings.append(0)
-        embeddings.append(volatility_status_embeddings)
-
-        # OHE Statuses
-        status_embeddings = []
-        for status in self._knowledge['Status']:
-            if status == move.status: status_embeddings.append(1)
-            elif move.secondary and status in list(map(lambda x: x.get('status', ''), move.secondary)): status_embeddings.append(1)
-            else: status_embeddings.append(0)
-        embeddings.append(status_embeddings)
+        volatile_statuses = [move.volatile_status] + [x.get('volatilityStatus', '').lower() for x in secondary]
+        i = self._encoder.encode_all(embedding, i, 'VolatileStatus', volatile_statuses)
+
+        # OHE Statuses; secondaries store statuses as strings (e.g. 'par')
+        statuses = [move.status] + [Status[x['status'].upper()] for x in secondary if x.get('status')]
+        i = self._encoder.encode_all(embedding, i, 'Status', statuses)
 
         # OHE Boosts (which sometimes are self-boosts)
-        boost_embeddings = {'atk': 0, 'def': 0, 'spa': 0, 'spd': 0, 'spe': 0, 'evasion': 0, 'accuracy': 0}
         if move.boosts:
-            for stat in move.boosts: boost_embeddings[stat] += move.boosts[stat]
-        elif move.secondary:
-            for x in move.secondary:
-                for stat in x.get('boosts', {}): boost_embeddings[stat] += x['boosts'][stat]
-        embeddings.append(boost_embeddings.values())
+            for stat in move.boosts: embedding[i + MOVE_BOOSTS.index(stat)] += move.boosts[stat]
+        else:
+            for x in secondary:
+                for stat in x.get('boosts', {}): embedding[i + MOVE_BOOSTS.index(stat)] += x['boosts'][stat]
+        i += len(MOVE_BOOSTS)
 
         # Add Self-Boosts
-        self_boost_embeddings = {'atk': 0, 'def': 0, 'spa': 0, 'spd': 0, 'spe': 0, 'evasion': 0, 'accuracy': 0}
         if move.self_boost:
-            for stat in move.self_boost: self_boost_embeddings[stat] += move.self_boost[stat]
-        elif move.secondary:
-            for x in move.secondary:
-                for stat in x.get('self', {}).get('boosts', {}): self_boost_embeddings[stat] += x['self']['boosts'][stat]
-        embeddings.append(self_boost_embeddings.values())
+            for stat in move.self_boost: embedding[i + MOVE_BOOSTS.index(stat)] += move.self_boost[stat]
+        else:
+            for x in secondary:
+                for stat in x.get('self', {}).get('boosts', {}): embedding[i + MOVE_BOOSTS.index(stat)] += x['self']['boosts'][stat]
+        i += len(MOVE_BOOSTS)
 
         # Introduce the chance of a secondary effect happening
-        chance = 0
-        for x in move.secondary:
-            chance = max(chance, x.get('chance', 0))
-        embeddings.append([chance])
+        embedding[i] = max([x.get('chance', 0) for x in secondary] + [0])
+        i += 1
 
         # Encode other properties
-        embeddings.append([
+        embedding[i:] = [
             move.accuracy,
             move.base_power,
             int(move.breaks_protect),
             move.crit_ratio,
             move.current_pp,
-            move.damage,
+            move.damage if move.damage != 'level' else -1, # Moves like Seismic Toss do damage equal to the user's level
             move.drain,
             move.expected_hits,
             int(move.force_switch),
@@ -138,29 +309,40 @@ class Embedder():
             int(move.steals_boosts),
             int(move.thaws_target),
             int(move.use_target_offensive),
-        ])
-
-        # Flatten the arrays
-        return [item for sublist in embeddings for item in sublist]
+        ]
 
-    # Returns an array of an embedded mon; could be precomputed per battle
-    def _embed_mon(self, battle, mon):
-        embeddings = []
+        return embedding
 
-        # OHE mons
-        embeddings.append([1 if mon == pokemon else 0 for pokemon in self._knowledge['Pokemon']])
+    # Returns an array of an embedded mon; could be precomputed per battle. If out is passed, we write into it instead.
+    # If moves is False, we leave the moves' slots for the caller to fill (see embed_battles)
+    def _embed_mon(self, battle, mon, out=None, moves=True):
+        embedding = np.zeros(self.MON_LEN, dtype=np.float32) if out is None else out
+        if out is not None: embedding[:] = 0
 
-        # OHE abilities
-        embeddings.append([1 if mon.ability == ability else 0 for ability in self._knowledge['Ability']])
+        # OHE mons and abilities
+        i = self._encoder.encode(embedding, 0, 'Pokemon', mon.species)
+        i = self._encoder.encode(embedding, i, 'Ability', to_id_str(mon.ability) if mon.ability else None)
 
         # TODO: OHE items
 
         # Append moves to embedding (and account for the fact that the mon might have <4 moves)
         for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
-            embeddings.append(self._embed_move(move))
+            if moves: self._embed_move(move, out=embedding[i:i + self.MOVE_LEN])
+            i += self.MOVE_LEN
+
+        self._embed_mon_features(battle, mon, out=embedding[i:])
+
+        return embedding
+
+    # Returns an array of everything we embed about a mon besides its species, ability and moves. If out is passed, we
+    # write into it instead
+    def _embed_mon_features(self, battle, mon, out=None):
+        embedding = np.zeros(self.MON_FEATURES_LEN, dtype=np.float32) if out is None else out
+        if out is not None: embedding[:] = 0
+        i = 0
 
         # Add whether the mon is active, the current hp, whether its fainted, its level, its weight and whether its recharging or preparing
-        embeddings.append([
+        embedding[i:i + 8] = [
             int(mon.active),
             mon.current_hp,
             int(mon.fainted),
@@ -169,47 +351,60 @@ class Embedder():
             int(mon.must_recharge),
             1 if mon.preparing else 0,
             int(mon.is_dynamaxed),
-        ])
+        ]
+        i += 8
 
         # Add stats and boosts
-        embeddings.append(mon.stats.values())
-        embeddings.append(mon.boosts.values())
+        embedding[i:i + len(STATS)] = [mon.stats.get(stat) if mon.stats.get(stat) is not None else -1 for stat in STATS]
+        i += len(STATS)
+        embedding[i:i + len(BOOSTS)] = [mon.boosts[stat] for stat in BOOSTS]
+        i += len(BOOSTS)
 
-        # Add status (one-hot encoded)
-        embeddings.append([1 if mon.status == status else 0 for status in self._knowledge['Status']])
-
-        # Add Types (one-hot encoded)
-        embeddings.append([1 if mon.type_1 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-        embeddings.append([1 if mon.type_2 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
+        # Add status and types (one-hot encoded)
+        i = self._encoder.encode(embedding, i, 'Status', mon.status)
+        i = self._encoder.encode(embedding, i, 'PokemonType', mon.type_1)
+        i = self._encoder.encode(embedding, i, 'PokemonType', mon.type_2)
 
         # Add whether the mon is trapped or forced to switch. But first, find the index
-        index = None
-        if mon in battle.active_pokemon: index = 0 if battle.active_pokemon[0] == mon else 1
-        embeddings.append([
-            1 if index and battle.trapped[index] else 0,
-            1 if index and battle.force_switch[index] else 0,
-        ])
+        index = self._active_index(battle, mon)
+        embedding[i:i + 2] = [
+            1 if index is not None and _as_list(battle.trapped)[index] else 0,
+            1 if index is not None and _as_list(battle.force_switch)[index] else 0,
+        ]
 
-        # Flatten all the lists into a Nx1 list
-        return [item for sublist in embeddings for item in sublist]
+        return embedding
 
-    def _embed_opp_mon(self, battle, mon):
-        embeddings = []
+    # Returns an array of an embedded opponent mon. If out is passed, we write into it instead. moves works like
+    # _embed_mon's
+    def _embed_opp_mon(self, battle, mon, out=None, moves=True):
+        embedding = np.zeros(self.OPP_MON_LEN, dtype=np.float32) if out is None else out
+        if out is not None: embedding[:] = 0
+        i = 0
 
         # Append moves to embedding (and account for the fact that the mon might have <4 moves, or we don't know of them)
         for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
-            embeddings.append(self._embed_move(move))
-
-        # OHE mons
-        embeddings.append([1 if mon == pokemon else 0 for pokemon in self._knowledge['Pokemon']])
+            if moves: self._embed_move(move, out=embedding[i:i + self.MOVE_LEN])
+            i += self.MOVE_LEN
 
-        # OHE possible abilities
-        embeddings.append([1 if ability in GEN_TO_POKEDEX[self.gen][mon.species].abilities else 0 for ability in self._knowledge['Ability']])
+        # OHE mons and possible abilities
+        i = self._encoder.encode(embedding, i, 'Pokemon', mon.species)
+        i = self._encoder.encode_all(embedding, i, 'Ability', self._species_abilities.get(mon.species, []))
 
         # TODO: OHE items
 
+        self._embed_opp_mon_features(battle, mon, out=embedding[i:])
+
+        return embedding
+
+    # Returns an array of everything we embed about an opponent mon besides its species, possible abilities and moves.
+    # If out is passed, we write into it instead
+    def _embed_opp_mon_features(self, battle, mon, out=None):
+        embedding = np.zeros(self.OPP_MON_FEATURES_LEN, dtype=np.float32) if out is None else out
+        if out is not None: embedding[:] = 0
+        i = 0
+
         # Add whether the mon is active, the current hp, whether its fainted, its level, its weight and whether its recharging or preparing
-        embeddings.append([
+        embedding[i:i + 9] = [
             int(mon.active), # This mon is on the field now
             int(mon in battle.opponent_team.values()), # This mon was brought
             mon.current_hp,
@@ -219,73 +414,362 @@ class Embedder():
             int(mon.must_recharge),
             1 if mon.preparing else 0,
             int(mon.is_dynamaxed),
-        ])
+        ]
+        i += 9
 
         # Add stats and boosts
-        embeddings.append(mon.base_stats.values())
-        embeddings.append(mon.boosts.values())
-
-        # Add status (one-hot encoded)
-        embeddings.append([1 if mon.status == status else 0 for status in self._knowledge['Status']])
+        embedding[i:i + len(BASE_STATS)] = [mon.base_stats[stat] for stat in BASE_STATS]
+        i += len(BASE_STATS)
+        embedding[i:i + len(BOOSTS)] = [mon.boosts[stat] for stat in BOOSTS]
+        i += len(BOOSTS)
 
-        # Add Types (one-hot encoded)
-        embeddings.append([1 if mon.type_1 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
-        embeddings.append([1 if mon.type_2 == pokemon_type else 0 for pokemon_type in self._knowledge['PokemonType']])
+        # Add status and types (one-hot encoded)
+        i = self._encoder.encode(embedding, i, 'Status', mon.status)
+        i = self._encoder.encode(embedding, i, 'PokemonType', mon.type_1)
+        i = self._encoder.encode(embedding, i, 'PokemonType', mon.type_2)
 
         # Add whether the mon is trapped or forced to switch. But first, find the index
-        index = None
-        if mon in battle.active_pokemon: index = 0 if battle.active_pokemon[0] == mon else 1
-        embeddings.append([
-            1 if index and battle.trapped[index] else 0,
-            1 if index and battle.force_switch[index] else 0,
-        ])
+        index = self._active_index(battle, mon)
+        embedding[i:i + 2] = [
+            1 if index is not None and _as_list(battle.trapped)[index] else 0,
+            1 if index is not None and _as_list(battle.force_switch)[index] else 0,
+        ]
 
-        # Flatten all the lists into a Nx1 list
-        return [item for sublist in embeddings for item in sublist]
+        return embedding
 
-    # Embeds the state of the battle in a X-dimensional embedding
+    # Embeds the state of the battle in an EMBEDDING_LEN-dimensional float32 embedding
     # Embed mons (and whether they're active)
     # Embed opponent mons (and whether they're active, they've been brought or we don't know)
     # Then embed all the Fields, Side Conditions, Weathers, Player Ratings, # of Turns and the bias
-    def embed_battle(self, battle):
-        embeddings = []
+    # Every section is written in place through slices of a single buffer. Callers that embed a lot of battles (e.g.
+    # a DQN filling its input batch) can pass their own contiguous float32 array with EMBEDDING_LEN elements as out
+    def embed_battle(self, battle, out=None):
+        if out is None:
+            out = np.empty(self.EMBEDDING_LEN, dtype=np.float32)
+        elif out.size != self.EMBEDDING_LEN or out.dtype != np.float32 or not out.flags.c_contiguous:
+            raise ValueError(f"out must be a contiguous float32 array with {self.EMBEDDING_LEN} elements")
+
+        embedding = out.reshape(-1)
+
+        # Profiles without OHEs embed mons like sparse embeddings do
+        embed_mon = self._embed_mon if self.ohe else self._embed_mon_dense
+        embed_opp_mon = self._embed_opp_mon if self.ohe else self._embed_opp_mon_dense
 
         # Add team to embeddings
-        for mon in battle.sent_team.values():
-            embeddings.append(self._embed_mon(battle, mon))
+        mons = list(battle.sent_team.values())
+        for i in range(self.TEAM_SIZE):
+            section = embedding[self.schema.slice('mon_%d' % i)]
+            if i < len(mons): self._embed_cached(battle, mons[i], embed_mon, self._mon_fingerprint(battle, mons[i]), out=section)
+            else: section[:] = -1
+
+        # Embed opponent's mons
+        opp_mons = self._opp_mons_to_embed(battle)
+        for i in range(self.OPP_TEAM_SIZE):
+            section = embedding[self.schema.slice('opp_mon_%d' % i)]
+            if i < len(opp_mons):
+                self._embed_cached(battle, opp_mons[i], embed_opp_mon, self._opp_mon_fingerprint(battle, opp_mons[i]),
+                                   out=section)
+            else:
+                section[:] = -1
+
+        self._embed_conditions(battle, out=embedding[self.schema.slice('conditions')])
+
+        if battle.finished: self.forget_battle(battle)
+
+        return out
+
+    # Embeds many battles (e.g. every battle a player is waiting on) into a single (N, EMBEDDING_LEN) float32 matrix,
+    # one row per battle, that batched model inference can consume directly. Rows are the same as embed_battle's, and
+    # mons share its caches. Moves make up most of the embedding, so rather than embedding them mon by mon, we gather
+    # the moves of every mon we can't take from the cache (in every battle) and copy them out of the move table at
+    # once. out works like embed_battle's, with shape (N, EMBEDDING_LEN)
+    def embed_battles(self, battles, out=None):
+        battles = list(battles)
+
+        if out is None:
+            out = np.empty((len(battles), self.EMBEDDING_LEN), dtype=np.float32)
+        elif out.shape != (len(battles), self.EMBEDDING_LEN) or out.dtype != np.float32 or not out.flags.c_contiguous:
+            raise ValueError(f"out must be a contiguous float32 array of shape ({len(battles)}, {self.EMBEDDING_LEN})")
+
+        embedding = out.reshape(-1)
+
+        # Profiles without OHEs embed mons like sparse embeddings do
+        embed_mon = self._embed_mon if self.ohe else self._embed_mon_dense
+        embed_opp_mon = self._embed_opp_mon if self.ohe else self._embed_opp_mon_dense
+        mon_schema = self.mon_schema if self.ohe else self.mon_dense_schema
+        opp_mon_schema = self.opp_mon_schema if self.ohe else self.opp_mon_dense_schema
+
+        # Mons we embed from scratch, as (battle's cache, cache key, fingerprint, section) to cache them once their
+        # moves are in, and their moves (see _embed_moves)
+        misses, moves = [], []
+        for row, battle in enumerate(battles):
+            start = row*self.EMBEDDING_LEN
+            cache = self._battle_cache(battle)
+
+            mons = list(battle.sent_team.values())
+            opp_mons = self._opp_mons_to_embed(battle)
+            sections = [('mon_%d' % i, mons[i] if i < len(mons) else None, embed_mon, self._mon_fingerprint, mon_schema)
+                        for i in range(self.TEAM_SIZE)]
+            sections += [('opp_mon_%d' % i, opp_mons[i] if i < len(opp_mons) else None, embed_opp_mon,
+                          self._opp_mon_fingerprint, opp_mon_schema) for i in range(self.OPP_TEAM_SIZE)]
+
+            for name, mon, embed_fn, fingerprint_fn, schema in sections:
+                section = out[row, self.schema.slice(name)]
+                if mon is None:
+                    section[:] = -1
+                    continue
+
+                key, fingerprint = (embed_fn.__name__, mon.species), fingerprint_fn(battle, mon)
+                cached = cache.get(key)
+                if cached is not None and cached[0] == fingerprint:
+                    section[:] = cached[1]
+                    continue
+
+                embed_fn(battle, mon, out=section, moves=False)
+                misses.append((cache, key, fingerprint, section))
+                for i, move in enumerate((list(mon.moves.values()) + [None, None, None, None])[:4]):
+                    moves.append((start + self.schema.offset(name) + schema.offset('move_%d' % i), move))
+
+            self._embed_conditions(battle, out=out[row, self.schema.slice('conditions')])
+
+        self._embed_moves(embedding, moves)
+        for cache, key, fingerprint, section in misses: cache[key] = (fingerprint, section.copy())
+
+        for battle in battles:
+            if battle.finished: self.forget_battle(battle)
+
+        return out
+
+    # Writes moves, given as (offset, move), into embedding at their offsets, like _embed_move does (or
+    # _embed_move_features, for profiles without OHEs). We copy every move we know about out of the move table at once
+    # and patch their targeting types and pp in place
+    def _embed_moves(self, embedding, moves):
+        embed_move = self._embed_move if self.ohe else self._embed_move_features
+        move_len = self.MOVE_LEN if self.ohe else self.MOVE_FEATURES_LEN
+
+        # Where features start in the embeddings we write, and in the move table
+        features = self._encoder.size('Move') if self.ohe else 0
+        first = 0 if self.ohe else self._encoder.size('Move')
+
+        offsets, rows, targets, pps, empty = [], [], [], [], []
+        for offset, move in moves:
+            if move is None or move.is_empty:
+                empty.append(offset)
+            elif move.id not in self._move_index:
+                embed_move(move, out=embedding[offset:offset + move_len])
+            else:
+                offsets.append(offset)
+                rows.append(self._move_index[move.id])
+                target = self._encoder.index('TargetType', move.deduced_target.lower() if move.deduced_target else None)
+                targets.append(-1 if target is None else target)
+                pps.append(move.current_pp)
+
+        # If the move is None or empty, it's filled w/ -1's
+        if empty: embedding[np.array(empty)[:, None] + np.arange(move_len)] = -1
+        if not offsets: return
+
+        offsets, targets = np.array(offsets), np.array(targets)
+        embedding[offsets[:, None] + np.arange(move_len)] = self._move_table[rows, first:]
+
+        # Patch targeting types, since showdown can tell us a different target than the move's default, and pp
+        start = offsets + features + self._MOVE_TARGET_OFFSET
+        embedding[start[:, None] + np.arange(self._encoder.size('TargetType'))] = 0
+        embedding[start[targets >= 0] + targets[targets >= 0]] = 1
+        embedding[offsets + features + self._MOVE_PP_OFFSET] = pps
+
+    # Embeds the state of the battle as a tuple of SPARSE_IDS_LEN int32 ids and a SPARSE_DENSE_LEN-dimensional float32
+    # embedding. This is the same information as embed_battle, but species, abilities and moves are ids (0 if unknown
+    # or missing) instead of OHEs, so models can use embedding lookups instead of a huge first layer, and replay
+    # memories store a fraction of the floats. ids_out and dense_out work like embed_battle's out
+    def embed_battle_sparse(self, battle, ids_out=None, dense_out=None):
+        if ids_out is None:
+            ids_out = np.empty(self.SPARSE_IDS_LEN, dtype=np.int32)
+        elif ids_out.size != self.SPARSE_IDS_LEN or ids_out.dtype != np.int32 or not ids_out.flags.c_contiguous:
+            raise ValueError(f"ids_out must be a contiguous int32 array with {self.SPARSE_IDS_LEN} elements")
+
+        if dense_out is None:
+            dense_out = np.empty(self.SPARSE_DENSE_LEN, dtype=np.float32)
+        elif dense_out.size != self.SPARSE_DENSE_LEN or dense_out.dtype != np.float32 or not dense_out.flags.c_contiguous:
+            raise ValueError(f"dense_out must be a contiguous float32 array with {self.SPARSE_DENSE_LEN} elements")
+
+        ids, dense = ids_out.reshape(-1), dense_out.reshape(-1)
+        ids[:] = 0
+        i = j = 0
+
+        # Add team to embeddings; missing mons have ids of 0 and features of -1
+        mons = list(battle.sent_team.values())[:self.TEAM_SIZE]
+        for k in range(self.TEAM_SIZE):
+            mon = mons[k] if k < len(mons) else None
+            moves = (list(mon.moves.values()) + [None, None, None, None])[:4] if mon else [None, None, None, None]
+
+            if mon:
+                ids[i] = self._encoder.category_id('Pokemon', mon.species)
+                ids[i + 1] = self._encoder.category_id('Ability', to_id_str(mon.ability) if mon.ability else None)
+            for m, move in enumerate(moves):
+                if move is not None and not move.is_empty: ids[i + 2 + m] = self._encoder.category_id('Move', move.id)
+            i += 6
+
+            length = 4*self.MOVE_FEATURES_LEN + self.MON_FEATURES_LEN
+            if mon:
+                self._embed_cached(battle, mon, self._embed_mon_dense, self._mon_fingerprint(battle, mon),
+                                   out=dense[j:j + length])
+            else:
+                dense[j:j + length] = -1
+            j += length
+
+        # Embed opponent's mons the same way, with all their possible abilities
+        opp_mons = self._opp_mons_to_embed(battle)
+        for k in range(self.OPP_TEAM_SIZE):
+            mon = opp_mons[k] if k < len(opp_mons) else None
+            moves = (list(mon.moves.values()) + [None, None, None, None])[:4] if mon else [None, None, None, None]
 
-        # Embed opponent's mons. teampreview_opponent_team has empty move slots while opponent_team has moves we remember.
-        # We first embed opponent_active_pokemon, then ones we remember from the team, then the rest
+            if mon:
+                ids[i] = self._encoder.category_id('Pokemon', mon.species)
+                for a, ability in enumerate(self._species_abilities.get(mon.species, [])[:3]):
+                    ids[i + 1 + a] = self._encoder.category_id('Ability', ability)
+            for m, move in enumerate(moves):
+                if move is not None and not move.is_empty: ids[i + 4 + m] = self._encoder.category_id('Move', move.id)
+            i += 8
+
+            length = 4*self.MOVE_FEATURES_LEN + self.OPP_MON_FEATURES_LEN
+            if mon:
+                self._embed_cached(battle, mon, self._embed_opp_mon_dense, self._opp_mon_fingerprint(battle, mon),
+                                   out=dense[j:j + length])
+            else:
+                dense[j:j + length] = -1
+            j += length
+
+        self._embed_conditions(battle, out=dense[j:])
+
+        if battle.finished: self.forget_battle(battle)
+
+        return ids_out, dense_out
+
+    # Writes the features of a mon's moves, followed by the mon's features; what sparse embeddings keep of a mon. moves
+    # works like _embed_mon's
+    def _embed_mon_dense(self, battle, mon, out=None, moves=True):
+        if out is None: out = np.empty(self.mon_dense_schema.width, dtype=np.float32)
+        i = 0
+        for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
+            if moves: self._embed_move_features(move, out=out[i:i + self.MOVE_FEATURES_LEN])
+            i += self.MOVE_FEATURES_LEN
+
+        self._embed_mon_features(battle, mon, out=out[i:])
+        return out
+
+    # Same as _embed_mon_dense, for opponent mons
+    def _embed_opp_mon_dense(self, battle, mon, out=None, moves=True):
+        if out is None: out = np.empty(self.opp_mon_dense_schema.width, dtype=np.float32)
+        i = 0
+        for move in (list(mon.moves.values()) + [None, None, None, None])[:4]:
+            if moves: self._embed_move_features(move, out=out[i:i + self.MOVE_FEATURES_LEN])
+            i += self.MOVE_FEATURES_LEN
+
+        self._embed_opp_mon_features(battle, mon, out=out[i:])
+        return out
+
+    # Writes embed_fn(battle, mon) into out. Most mons don't change from one turn to the next (e.g. benched or
+    # unrevealed ones), so we remember the last embedding of every mon in the battle along with a fingerprint of
+    # everything it was computed from, and only recompute it when the fingerprint changes
+    def _embed_cached(self, battle, mon, embed_fn, fingerprint, out):
+        cache = self._battle_cache(battle)
+        key = (embed_fn.__name__, mon.species)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            out[:] = cached[1]
+        else:
+            embed_fn(battle, mon, out=out)
+            cache[key] = (fingerprint, out.copy())
+
+        return out
+
+    # Returns the mon embeddings we remember for the battle (see _embed_cached), marking it as the most recently embedded
+    # battle and dropping the least recently embedded ones past MAX_CACHED_BATTLES
+    def _battle_cache(self, battle):
+        if battle.battle_tag not in self._cache: self._cache[battle.battle_tag] = {}
+        self._cache.move_to_end(battle.battle_tag)
+        while len(self._cache) > self.MAX_CACHED_BATTLES: self._cache.popitem(last=False)
+
+        return self._cache[battle.battle_tag]
+
+    # Drops the mon embeddings we remember for the battle; we do this automatically once battles finish
+    def forget_battle(self, battle):
+        self._cache.pop(battle.battle_tag, None)
+
+    # Returns the index of the mon in our active mons (its slot), or None if it isn't active
+    def _active_index(self, battle, mon):
+        actives = _as_list(battle.active_pokemon)
+        return actives.index(mon) if mon in actives else None
+
+    # Returns everything that can change during a battle that a mon's moves' embeddings depend on
+    def _moves_fingerprint(self, mon):
+        return tuple((move.id, move.current_pp, move.deduced_target) for move in mon.moves.values())
+
+    # Returns everything that can change during a battle that _embed_mon and _embed_mon_dense depend on
+    def _mon_fingerprint(self, battle, mon):
+        index = self._active_index(battle, mon)
+
+        return (
+            self._moves_fingerprint(mon), mon.ability, mon.active, mon.current_hp, mon.fainted, mon.level, mon.weight,
+            mon.must_recharge, mon.preparing, mon.is_dynamaxed, tuple(mon.stats.values()), tuple(mon.boosts.values()),
+            mon.status, mon.type_1, mon.type_2,
+            index is not None and _as_list(battle.trapped)[index], index is not None and _as_list(battle.force_switch)[index],
+        )
+
+    # Returns everything that can change during a battle that _embed_opp_mon and _embed_opp_mon_dense depend on
+    def _opp_mon_fingerprint(self, battle, mon):
+        index = self._active_index(battle, mon)
+
+        return (
+            self._moves_fingerprint(mon), mon.active, mon in battle.opponent_team.values(), mon.current_hp,
+            mon.fainted, mon.level, mon.weight, mon.must_recharge, mon.preparing, mon.is_dynamaxed,
+            tuple(mon.base_stats.values()), tuple(mon.boosts.values()), mon.status, mon.type_1, mon.type_2,
+            index is not None and _as_list(battle.trapped)[index], index is not None and _as_list(battle.force_switch)[index],
+        )
+
+    # Returns the opponent's mons in the order we embed them, at most OPP_TEAM_SIZE. teampreview_opponent_team has
+    # empty move slots while opponent_team has moves we remember. We first embed opponent_active_pokemon, then ones we
+    # remember from the team, then the rest
+    def _opp_mons_to_embed(self, battle):
+        opp_mons = []
         embedded_opp_mons = set()
-        for mon in battle.opponent_active_pokemon:
+        for mon in _as_list(battle.opponent_active_pokemon):
             if mon:
-                embeddings.append(self._embed_opp_mon(battle, mon))
+                opp_mons.append(mon)
                 embedded_opp_mons.add(mon.species)
 
         for mon in battle.opponent_team.values():
             if mon.species in embedded_opp_mons: continue
-            embeddings.append(self._embed_opp_mon(battle, mon))
+            opp_mons.append(mon)
             embedded_opp_mons.add(mon.species)
 
-        for mon in battle.teampreview_opponent_team:
+        # Singles battles don't have teampreview
+        teampreview_opponent_team = getattr(battle, 'teampreview_opponent_team', {})
+        for mon in teampreview_opponent_team:
             if mon in embedded_opp_mons: continue
-            embeddings.append(self._embed_opp_mon(battle, battle.teampreview_opponent_team[mon]))
+            opp_mons.append(teampreview_opponent_team[mon])
             embedded_opp_mons.add(mon)
 
-        # Add Dynamax stuff
-        embeddings.append(battle.can_dynamax + battle.opponent_can_dynamax + [battle.dynamax_turns_left, battle.opponent_dynamax_turns_left])
+        return opp_mons[:self.OPP_TEAM_SIZE]
 
-        # Add Fields;
-        embeddings.append([1 if field in battle.fields else 0 for field in self._knowledge['Field']])
+    # Embeds everything about the battle that isn't a mon
+    def _embed_conditions(self, battle, out=None):
+        embedding = np.zeros(self.BATTLE_LEN, dtype=np.float32) if out is None else out
+        if out is not None: embedding[:] = 0
 
-        # Add Side Conditions
-        embeddings.append([1 if sc in battle.side_conditions else 0 for sc in self._knowledge['SideCondition']])
+        # Add Dynamax stuff
+        dynamax = self.conditions_schema.length('dynamax')
+        embedding[0:dynamax] = list(map(lambda x: x if x is not None else -1,
+            _as_list(battle.can_dynamax) + _as_list(battle.opponent_can_dynamax) +
+            [battle.dynamax_turns_left, battle.opponent_dynamax_turns_left]))
 
-        # Add Weathers
-        embeddings.append([1 if weather == battle.weather else 0 for weather in self._knowledge['Weather']])
+        # Add Fields, Side Conditions and Weathers. poke_env gives us enums for fields and side conditions, which we
+        # store as strings
+        i = self._encoder.encode_all(embedding, dynamax, 'Field', map(enum_to_id, battle.fields))
+        i = self._encoder.encode_all(embedding, i, 'SideCondition', map(enum_to_id, battle.side_conditions))
+        i = self._encoder.encode(embedding, i, 'Weather', battle.weather)
 
         # Add Player Ratings, the battle's turn and a bias term
-        embeddings.append(list(map(lambda x: x if x else -1, [battle.rating, battle.opponent_rating, battle.turn, 1])))
+        embedding[i:i + 4] = list(map(lambda x: x if x else -1, [battle.rating, battle.opponent_rating, battle.turn, 1]))
 
-        # Flatten all the lists into a list
-        return np.array([item for sublist in embeddings for item in sublist])
+        return embedding
@@ -0,0 +1,68 @@
+import hashlib
+
+# Describes the layout of an embedding: named sections, in order, and how long each one is. This way, we derive
+# embedding widths and offsets from the knowledge sets instead of hard-coding them, and can slice out features by name.
+# Sections can be schemas themselves (e.g. a mon embedding contains move embeddings), in which case their own sections
+# are also available, prefixed by the section's name (e.g. "mon_0/move_1/target_type")
+#
+# Every schema has a version: a hash of its layout and of the knowledge sets its one-hot encodings come from. Two
+# embeddings are only compatible (e.g. with a trained model) if their versions match, even if their widths do
+class EmbeddingSchema():
+
+    # knowledge_version identifies the knowledge sets the schema's one-hot encodings come from (see knowledge.py)
+    def __init__(self, name, knowledge_version=''):
+        self.name = name
+        self.width = 0
+
+        # Maps section name -> (offset, length), in the order sections were added
+        self._sections = {}
+
+        self._hash = hashlib.sha1(("%s;%s;" % (name, knowledge_version)).encode())
+
+    # Appends a section, which is either a length or another schema, and returns self so that calls can be chained
+    def add(self, name, section):
+        if name in self._sections: raise ValueError(f"{self.name} already has a section named {name}")
+
+        if isinstance(section, EmbeddingSchema):
+            for subname, (offset, length) in section._sections.items():
+                self._sections[name + "/" + subname] = (self.width + offset, length)
+            length = section.width
+            self._hash.update(("%s=%s;" % (name, section.version)).encode())
+        else:
+            length = int(section)
+            self._hash.update(("%s=%d;" % (name, length)).encode())
+
+        self._sections[name] = (self.width, length)
+        self.width += length
+        return self
+
+    @property
+    def version(self):
+        return self._hash.hexdigest()[:16]
+
+    # Returns the names of all the sections (including the ones of nested schemas), in order
+    def names(self):
+        return list(self._sections.keys())
+
+    def offset(self, name):
+        return self._sections[name][0]
+
+    def length(self, name):
+        return self._sections[name][1]
+
+    # Returns a slice that we can use to index the section in an embedding (e.g. embedding[schema.slice("weather")])
+    def slice(self, name):
+        offset, length = self._sections[name]
+        return slice(offset, offset + length)
+
+    # Raises an error if an embedding (or model) built for the given version can't be used with this schema
+    def check_compatible(self, version):
+        if version != self.version:
+            raise ValueError(f"Embedding schema {self.name} is version {self.version}, but {version} was expected. "
+                             "The knowledge sets or the embedding layout changed since the model was trained")
+
+    def __len__(self):
+        return self.width
+
+    def __repr__(self):
+        return f"EmbeddingSchema({self.name}, width={self.width}, version={self.version})"
@@ -0,0 +1,43 @@
+import numpy as np
+
+# Converts an enum member (e.g. Field.ELECTRIC_TERRAIN) to the string that we store in our knowledge sets for classes
+# that poke_env returns as strings (e.g. 'electricterrain')
+def enum_to_id(member):
+    return member.name.lower().replace("_", "")
+
+# Maps every value of our knowledge sets (e.g. every Status, or every species) to its position in the set's one-hot
+# encoding. This way, one-hot encoding a value is a dict lookup that writes a single 1 into a preallocated (zeroed)
+# buffer, instead of comparing the value against everything we know about.
+class OneHotEncoder():
+
+    def __init__(self, knowledge):
+        self._index = {key: {value: i for i, value in enumerate(values)} for key, values in knowledge.items()}
+
+    # Returns the length of the one-hot encoding of the knowledge set stored under key
+    def size(self, key):
+        return len(self._index[key])
+
+    # Returns the position of value in key's one-hot encoding, or None if we don't know about the value
+    def index(self, key, value):
+        return self._index[key].get(value)
+
+    # Returns the id of value for embedding lookups: its position shifted by one, so that 0 stands for values we don't
+    # know about (or missing ones, like empty move slots)
+    def category_id(self, key, value):
+        i = self._index[key].get(value)
+        return 0 if i is None else i + 1
+
+    # Writes the one-hot encoding of value into out, starting at offset, and returns the offset right after the encoding
+    # so that calls can be chained. Values we don't know about (e.g. None) leave the encoding empty
+    def encode(self, out, offset, key, value):
+        i = self._index[key].get(value)
+        if i is not None: out[offset + i] = 1
+        return offset + len(self._index[key])
+
+    # Same as encode, but sets a 1 for every known value in values (e.g. every field that's active in a battle)
+    def encode_all(self, out, offset, key, values):
+        index = self._index[key]
+        for value in values:
+            i = index.get(value)
+            if i is not None: out[offset + i] = 1
+        return offset + len(index)
@@ -0,0 +1,57 @@
+import asyncio
+
+import numpy as np
+
+
+# Runs a model on observations coming from many concurrent battles, in batches: battles await predict, and we gather
+# their observations for up to max_delay seconds (or until we have max_batch_size of them) before running them through
+# predict_fn in one call and handing every battle its own output. One forward pass on a batch costs about as much as
+# one on a single observation, so with many concurrent battles this saves most of our CPU time.
+# predict_fn takes a batch of observations (n x observation shape) and returns a batch of outputs (e.g. a keras model's
+# predict_on_batch). It runs in the event loop's thread, like the rest of a player's logic
+class InferenceServer():
+
+    def __init__(self, predict_fn, max_batch_size=64, max_delay=.005):
+        self.predict_fn = predict_fn
+        self.max_batch_size, self.max_delay = max_batch_size, max_delay
+
+        # (observation, future) of every prediction we haven't run yet, and the timer that will run them
+        self._pending, self._timer = [], None
+
+        # How many batches and predictions we've run, to keep an eye on batch sizes
+        self.nb_batches, self.nb_predictions = 0, 0
+
+    # Returns predict_fn's output for an observation, once its batch has run
+    async def predict(self, observation):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((np.asarray(observation), future))
+
+        if len(self._pending) >= self.max_batch_size: self.flush()
+        elif self._timer is None: self._timer = loop.call_later(self.max_delay, self.flush)
+
+        return await future
+
+    # Runs every pending prediction now, in one batch
+    def flush(self):
+        if self._timer is not None: self._timer.cancel()
+        self._timer = None
+
+        pending, self._pending = self._pending, []
+        pending = [(observation, future) for observation, future in pending if not future.cancelled()]
+        if not pending: return
+
+        try:
+            outputs = np.asarray(self.predict_fn(np.stack([observation for observation, _ in pending])))
+        except Exception as e:
+            for _, future in pending: future.set_exception(e)
+            return
+
+        self.nb_batches += 1
+        self.nb_predictions += len(pending)
+        for (_, future), output in zip(pending, outputs): future.set_result(output)
+
+    # The average number of observations per batch we've run
+    @property
+    def average_batch_size(self):
+        return self.nb_predictions / self.nb_batches if self.nb_batches else 0.
@@ -0,0 +1,143 @@
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+
+import poke_env.data
+from poke_env.data import GEN_TO_MOVES, GEN_TO_POKEDEX, to_id_str
+from poke_env.environment.field import Field
+from poke_env.environment.side_condition import SideCondition
+from poke_env.environment.status import Status
+from poke_env.environment.weather import Weather
+from poke_env.environment.pokemon_type import PokemonType
+from poke_env.environment.move_category import MoveCategory
+from poke_env.environment.target_type import TargetType
+from poke_env.environment.volatile_status import VolatileStatus
+from reuniclusVGC.helpers.encoder import enum_to_id
+
+# Where we store static tables that are expensive to build, so that we only build them once per generation (and not
+# once per player). Can be overriden with the REUNICLUS_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get('REUNICLUS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'reuniclusVGC'))
+
+# Bump this whenever what we store in the cache changes, so that old caches are ignored
+CACHE_FORMAT = 1
+
+# The sets we one-hot encode that come from poke_env's enums. The tuples are key where we retrieve the classes, the
+# class, and whether poke_env supports returning the class (as opposed to string)
+ENUM_SETS = [
+    ('Field', Field, False),
+    ('SideCondition', SideCondition, False),
+    ('Status', Status, True),
+    ('Weather', Weather, True),
+    ('PokemonType', PokemonType, True),
+    ('MoveCategory', MoveCategory, True),
+    ('TargetType', TargetType, False),
+    ('VolatileStatus', VolatileStatus, False),
+]
+
+# Returns all the game-related knowledge that comes from enums, so that we can embed battle states
+def enum_knowledge():
+    knowledge = {}
+    for key, klass, supported in ENUM_SETS:
+        if supported: knowledge[key] = list(klass._member_map_.values())
+        else: knowledge[key] = list(map(enum_to_id, klass._member_map_.values()))
+    return knowledge
+
+# Returns a hash of the knowledge sets, so that embeddings built from different knowledge can't be mistaken for each
+# other (see EmbeddingSchema)
+def knowledge_version(knowledge):
+    digest = hashlib.sha1()
+    for key in sorted(knowledge):
+        digest.update(("%s:%s;" % (key, ",".join(map(str, knowledge[key])))).encode())
+    return digest.hexdigest()[:16]
+
+# Returns a hash of poke_env's data files, which everything we cache is derived from. If poke_env gets updated
+# (and its moves or pokedex change), this changes and we rebuild our caches
+@lru_cache(maxsize=None)
+def source_version(gen):
+    digest = hashlib.sha1(("%d;%d;" % (CACHE_FORMAT, gen)).encode())
+
+    data_dir = os.path.join(os.path.dirname(poke_env.data.__file__), 'data')
+    if os.path.isdir(data_dir):
+        for root, dirs, files in sorted(os.walk(data_dir)):
+            for filename in sorted(files):
+                stat = os.stat(os.path.join(root, filename))
+                digest.update(("%s:%d:%d;" % (filename, stat.st_size, stat.st_mtime_ns)).encode())
+    else:
+        digest.update(",".join(GEN_TO_MOVES[gen].keys()).encode())
+        digest.update(",".join(GEN_TO_POKEDEX[gen].keys()).encode())
+
+    return digest.hexdigest()[:16]
+
+# Returns the directory where we cache the static tables of a generation
+def cache_path(gen):
+    return os.path.join(CACHE_DIR, "gen%d_%s" % (gen, source_version(gen)))
+
+# Returns every vocabulary that we derive from the pokedex and moves of a generation, along with every species'
+# abilities. These are expensive to build (we walk the whole pokedex), so we store them in an .npz file the first time
+# and load them from there afterwards; they're also shared across every Embedder in the process
+@lru_cache(maxsize=None)
+def load_knowledge(gen):
+    path = os.path.join(cache_path(gen), 'knowledge.npz')
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            moves, species, abilities = list(data['moves']), list(data['species']), list(data['abilities'])
+            species_abilities = {
+                mon: [ability for ability in mon_abilities if ability]
+                for mon, mon_abilities in zip(species, data['species_abilities'].tolist())
+            }
+    except (OSError, KeyError, ValueError):
+        moves, species, abilities, species_abilities = _build_knowledge(gen)
+        _save(path, lambda f: np.savez(f, moves=np.array(moves), species=np.array(species), abilities=np.array(abilities),
+                                      species_abilities=_pad(list(species_abilities.values()))))
+
+    knowledge = enum_knowledge()
+    knowledge['Move'] = [str(move) for move in moves]
+    knowledge['Pokemon'] = [str(mon) for mon in species]
+    knowledge['Ability'] = [str(ability) for ability in abilities]
+
+    return knowledge, {str(mon): list(map(str, mon_abilities)) for mon, mon_abilities in species_abilities.items()}
+
+# Returns a table that we build with build_fn from the knowledge of a generation (e.g. every move's embedding),
+# storing it on disk the first time. We memory-map it, so processes that load the same table share its memory.
+# version should change whenever build_fn would return something different (e.g. the embedding schema's version)
+def load_table(gen, name, version, build_fn):
+    path = os.path.join(cache_path(gen), "%s_%s.npy" % (name, version))
+
+    try:
+        return np.load(path, mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        table = build_fn()
+        _save(path, lambda f: np.save(f, table))
+        return table
+
+# Walks the pokedex and moves of a generation to build our vocabularies. Abilities are stored as ids
+# (e.g. 'intimidate'), sorted so that embeddings are the same across runs
+def _build_knowledge(gen):
+    moves = list(GEN_TO_MOVES[gen].keys())
+    species = list(GEN_TO_POKEDEX[gen].keys())
+    species_abilities = {
+        mon: [to_id_str(ability) for ability in entry['abilities'].values()] for mon, entry in GEN_TO_POKEDEX[gen].items()
+    }
+    abilities = sorted(set([ability for mon_abilities in species_abilities.values() for ability in mon_abilities]))
+
+    return moves, species, abilities, species_abilities
+
+# Pads lists of strings with empty strings, so that we can store them as a 2d array
+def _pad(lists):
+    width = max([len(values) for values in lists] + [1])
+    return np.array([values + [''] * (width - len(values)) for values in lists])
+
+# Writes a file through save_fn atomically, so that players starting at the same time never read a half-written
+# cache. If we can't write (e.g. read-only home directory), we just don't cache
+def _save(path, save_fn):
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            save_fn(f)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
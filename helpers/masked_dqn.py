@@ -0,0 +1,130 @@
+from collections import namedtuple
+
+import numpy as np
+
+from rl.agents.dqn import DQNAgent
+
+# A batch of transitions as arrays, one row per transition (what MaskedDQNAgent trains on): states are (batch x
+# window_length x observation shape), mask1 is the legal action mask of state1 (batch x nb_actions, or batch x 0 if the
+# memory wasn't given masks), positions are where the transitions are stored in their memory (None if it doesn't say)
+# and weights are the importance-sampling weights of their loss (see PrioritizedRingBufferMemory). horizon is how many
+# steps after state0 state1 is (1 unless the memory stores n-step transitions), so its value is discounted by
+# gamma ** horizon
+ReplayBatch = namedtuple('ReplayBatch', 'state0, action, reward, state1, terminal1, mask1, positions, weights, horizon')
+
+
+# A DQNAgent that only considers legal actions: the policy chooses among the actions mask_fn says are legal for the
+# current observation (mask_fn returns a boolean array with an element per action), and the target of every update
+# bootstraps from the best legal action of the next state. Masks are stored in replay with their transitions, so memory
+# has to take them (a RingBufferMemory or a PrioritizedRingBufferMemory, see replay_memory); other memories are fine
+# without mask_fn, in which case every action is legal and this is a plain DQNAgent
+class MaskedDQNAgent(DQNAgent):
+
+    def __init__(self, *args, mask_fn=None, **kwargs):
+        self.mask_fn = mask_fn
+        super().__init__(*args, **kwargs)
+
+    def reset_states(self):
+        super().reset_states()
+        self.recent_mask = None
+
+    # Returns the legal action mask of the current observation
+    def current_mask(self):
+        mask = np.ones(self.nb_actions, dtype=bool) if self.mask_fn is None else np.asarray(self.mask_fn(), dtype=bool)
+
+        # If nothing is legal (e.g. the battle is over), anything goes
+        return mask if mask.any() else np.ones(self.nb_actions, dtype=bool)
+
+    # Selects an action like DQNAgent, but the policy only sees the q-values of legal actions
+    def forward(self, observation):
+        state = self.memory.get_recent_state(observation)
+        q_values = self.compute_q_values(state)
+
+        mask = self.current_mask()
+        legal = np.flatnonzero(mask)
+        policy = self.policy if self.training else self.test_policy
+        action = int(legal[policy.select_action(q_values=q_values[legal])])
+
+        # Book-keeping.
+        self.recent_observation, self.recent_action, self.recent_mask = observation, action, mask
+        return action
+
+    # Samples a batch from memory (see ReplayBatch), with processed states, float rewards and terminals (1 if terminal),
+    # and every mask1 filled in. Memories that sample batches as arrays (see RingBufferMemory.sample_batch) skip building
+    # experiences one by one
+    def _sample_batch(self):
+        all_legal = np.ones(self.nb_actions, dtype=bool)
+
+        if hasattr(self.memory, 'sample_batch'):
+            batch = self.memory.sample_batch(self.batch_size)
+            state0_batch, state1_batch = batch.state0.astype(np.float32), batch.state1.astype(np.float32)
+            if self.processor is not None:
+                state0_batch, state1_batch = self.process_state_batch(state0_batch), self.process_state_batch(state1_batch)
+
+            mask1_batch = batch.mask1 if batch.mask1.shape[1] == self.nb_actions else \
+                np.broadcast_to(all_legal, (self.batch_size, self.nb_actions))
+            return batch._replace(state0=state0_batch, reward=batch.reward.astype(np.float64), state1=state1_batch,
+                                  terminal1=batch.terminal1.astype(np.float64), mask1=mask1_batch)
+
+        experiences = self.memory.sample(self.batch_size)
+        assert len(experiences) == self.batch_size
+
+        return ReplayBatch(
+            state0=self.process_state_batch([e.state0 for e in experiences]),
+            action=np.array([e.action for e in experiences], dtype=np.intp),
+            reward=np.array([e.reward for e in experiences]),
+            state1=self.process_state_batch([e.state1 for e in experiences]),
+            terminal1=np.array([1. if e.terminal1 else 0. for e in experiences]),
+            mask1=np.array([all_legal if getattr(e, 'mask1', None) is None else e.mask1 for e in experiences], dtype=bool),
+            positions=None, weights=np.ones(self.batch_size), horizon=np.ones(self.batch_size, dtype=np.int64))
+
+    # Same as DQNAgent.backward, but the masks go in replay, we bootstrap from legal actions only, and we support
+    # prioritized memories (see PrioritizedRingBufferMemory)
+    def backward(self, reward, terminal):
+        if self.step % self.memory_interval == 0:
+            masks = {'mask': self.recent_mask} if self.mask_fn is not None else {}
+            self.memory.append(self.recent_observation, self.recent_action, reward, terminal, training=self.training,
+                               **masks)
+
+        metrics = [np.nan for _ in self.metrics_names]
+        if not self.training: return metrics
+
+        if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            batch = self._sample_batch()
+            rows = np.arange(self.batch_size)
+
+            # The best legal action of the next state, according to the online model with double DQN (van Hasselt et
+            # al., 2015) and the target model otherwise; its value always comes from the target model
+            target_q_values = self.target_model.predict_on_batch(batch.state1)
+            assert target_q_values.shape == (self.batch_size, self.nb_actions)
+
+            q_values = self.model.predict_on_batch(batch.state1) if self.enable_double_dqn else target_q_values
+            actions = np.argmax(np.where(batch.mask1, q_values, -np.inf), axis=1)
+            q_batch = target_q_values[rows, actions]
+
+            # r_t + gamma * max_a Q(s_t+1, a) (or the n-step return + gamma^n * max_a Q(s_t+n, a)), with nothing to
+            # bootstrap from in terminal states; only the output of the action we took gets a loss, weighted by the
+            # transition's importance-sampling weight
+            Rs = batch.reward + self.gamma ** batch.horizon * q_batch * (1. - batch.terminal1)
+            targets = np.zeros((self.batch_size, self.nb_actions), dtype='float32')
+            masks = np.zeros((self.batch_size, self.nb_actions), dtype='float32')
+            targets[rows, batch.action] = Rs
+            masks[rows, batch.action] = batch.weights
+            dummy_targets = Rs.astype('float32')
+
+            # Prioritized memories sample transitions by how wrong we were about them (their TD error)
+            if hasattr(self.memory, 'update_priorities'):
+                td_errors = Rs - np.asarray(self.model.predict_on_batch(batch.state0))[rows, batch.action]
+                self.memory.update_priorities(batch.positions, td_errors)
+
+            ins = [batch.state0] if type(self.model.input) is not list else batch.state0
+            metrics = self.trainable_model.train_on_batch(ins + [targets, masks], [dummy_targets, targets])
+            metrics = [metric for idx, metric in enumerate(metrics) if idx not in (1, 2)]  # throw away individual losses
+            metrics += self.policy.metrics
+            if self.processor is not None:
+                metrics += self.processor.metrics
+
+        if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            self.update_target_model_hard()
+
+        return metrics
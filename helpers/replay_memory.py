@@ -0,0 +1,315 @@
+import os
+import warnings
+from collections import deque, namedtuple
+
+import numpy as np
+
+from rl.memory import Memory
+from reuniclusVGC.helpers.masked_dqn import ReplayBatch
+
+# An experience (see rl.memory.Experience), along with the legal action mask of state1
+MaskedExperience = namedtuple('MaskedExperience', 'state0, action, reward, state1, terminal1, mask1')
+
+
+# A replay memory backed by preallocated numpy arrays used as ring buffers, instead of deques of python objects:
+# observations are stored as float16 (dtype), actions as int16, rewards as float32, terminals as uint8 and legal action
+# masks packed as bits (uint8). Arrays are allocated with the first observation, and only the pages we write take up
+# memory, so big limits are cheap until they fill up. Observations take most of the space (about 12KB each with our
+# 6033-wide embeddings); for more transitions than fit in RAM (e.g. millions), give a directory to keep the arrays memory-mapped
+# on disk instead (the OS then keeps the parts we use most in memory).
+# It follows SequentialMemory's semantics (transitions never cross episodes, and state1 is state0 shifted by one
+# observation), but samples with replacement and builds batches by fancy indexing (see sample_batch). It plugs into
+# DQNAgent (through sample) and MaskedDQNAgent (which uses sample_batch).
+# With n_step > 1, transitions are n-step ones: their reward is the discounted (by gamma) sum of the next n rewards,
+# and their state1 the observation n steps later; episodes that end sooner cut them short (see ReplayBatch.horizon).
+# Returns are computed as transitions are stored. Only MaskedDQNAgent knows to discount n-step transitions' state1
+class RingBufferMemory(Memory):
+
+    # How many times we redraw unsampleable transitions before picking among the sampleable ones directly
+    _MAX_REDRAWS = 16
+
+    def __init__(self, limit, dtype=np.float16, directory=None, n_step=1, gamma=None, **kwargs):
+        super().__init__(**kwargs)
+        self.limit, self.dtype, self.directory = int(limit), dtype, directory
+
+        if n_step > 1 and gamma is None: raise ValueError('n-step returns need the discount factor (gamma)')
+        self.n_step, self.gamma = int(n_step), gamma
+
+        self.observations = self.actions = self.rewards = self.terminals = self.masks = None
+        self.returns = self.horizons = None
+        self.nb_actions = None
+
+        # Where we write next, and how many transitions we hold
+        self._next, self._count = 0, 0
+
+        # The positions of the transitions whose return is still being summed (oldest first), and of those whose return
+        # we completed with the last transition (they can be sampled once their state1 is stored, with the next one)
+        self._pending, self._completed = deque(), []
+
+        # The positions of the transitions the last transition we stored is the state1 of
+        self._ready = []
+
+    # Returns a zeroed array, in memory or memory-mapped in our directory
+    def _zeros(self, name, shape, dtype):
+        if self.directory is None: return np.zeros(shape, dtype=dtype)
+
+        os.makedirs(self.directory, exist_ok=True)
+        return np.memmap(os.path.join(self.directory, name + '.dat'), dtype=dtype, mode='w+', shape=shape)
+
+    def _allocate(self, observation, mask):
+        observation = np.asarray(observation)
+        self.observations = self._zeros('observations', (self.limit,) + observation.shape, self.dtype)
+        self.actions = self._zeros('actions', self.limit, np.int16)
+        self.rewards = self._zeros('rewards', self.limit, np.float32)
+        self.terminals = self._zeros('terminals', self.limit, np.uint8)
+
+        # Each transition's (n-step) return, and how many steps later its state1 is (0 until we know)
+        self.returns = self._zeros('returns', self.limit, np.float32)
+        self.horizons = self._zeros('horizons', self.limit, np.uint8)
+
+        if mask is not None:
+            self.nb_actions = len(mask)
+            self.masks = self._zeros('masks', (self.limit, (self.nb_actions + 7) // 8), np.uint8)
+
+    # Appends a transition, and the legal action mask of its observation (all legal if we don't know it)
+    def append(self, observation, action, reward, terminal, training=True, mask=None):
+        super().append(observation, action, reward, terminal, training=training)
+        if not training: return
+
+        if self.observations is None: self._allocate(observation, mask)
+
+        i = self._next
+        self.observations[i] = observation
+        self.actions[i], self.rewards[i], self.terminals[i] = action, reward, terminal
+        self.returns[i], self.horizons[i] = 0, 0
+        if self.masks is not None:
+            self.masks[i] = np.packbits(np.ones(self.nb_actions, dtype=bool) if mask is None else np.asarray(mask, dtype=bool))
+
+        self._next = (i + 1) % self.limit
+        self._count = min(self._count + 1, self.limit)
+
+        # This observation is the state1 of the transitions we completed last time
+        self._ready = self._completed
+
+        # The reward goes to every pending transition, discounted by how many steps ago it was. A transition is complete
+        # when it has n rewards, or when the episode ends
+        self._pending.append(i)
+        pending = np.array(self._pending, dtype=np.int64)
+        steps = np.arange(len(pending))[::-1]
+        self.returns[pending] += reward * (self.gamma or 1.) ** steps
+
+        if terminal: completed, self._pending = pending, deque()
+        elif len(pending) == self.n_step: completed = pending[:1]; self._pending.popleft()
+        else: completed = pending[:0]
+
+        self.horizons[completed] = steps[:len(completed)] + 1
+        self._completed = completed
+
+    @property
+    def nb_entries(self):
+        return self._count
+
+    # Maps logical indices (0 is the oldest transition we hold) to positions in the arrays
+    def _positions(self, idxs):
+        return (self._next - self._count + idxs) % self.limit
+
+    # Maps positions in the arrays to logical indices
+    def _logical(self, positions):
+        return (np.asarray(positions, dtype=np.int64) - (self._next - self._count)) % self.limit
+
+    # Returns which of the transitions at logical indices can be sampled: they need window_length observations before
+    # them and their state1 stored, and can't start on the last observation of an episode (it'd end in the next one)
+    def _sampleable(self, idxs):
+        idxs = np.asarray(idxs, dtype=np.int64)
+        horizons = self.horizons[self._positions(idxs)].astype(np.int64)
+
+        return (idxs >= self.window_length) & (horizons > 0) & (idxs + horizons < self._count) & \
+            ~self.terminals[self._positions(idxs - 1)].astype(bool)
+
+    # Draws the logical indices of batch_size transitions that can be sampled (see _sampleable)
+    def _sample_indexes(self, batch_size):
+        low, high = self.window_length, self._count - 1
+        if high - low < batch_size:
+            warnings.warn('Not enough entries to sample a batch of distinct transitions. Consider increasing your warm-up phase to avoid oversampling!')
+
+        # Redrawing the few unsampleable ones is cheapest, but if we keep drawing them, we pick among every sampleable
+        # transition instead (there may be none, e.g. if the memory only holds the start of an episode)
+        idxs = np.random.randint(low, high, size=batch_size)
+        for _ in range(self._MAX_REDRAWS):
+            unsampleable = ~self._sampleable(idxs)
+            if not unsampleable.any(): return idxs
+            idxs[unsampleable] = np.random.randint(low, high, size=int(unsampleable.sum()))
+
+        candidates = np.arange(low, high)
+        candidates = candidates[self._sampleable(candidates)]
+        assert len(candidates) > 0, 'no transition in the memory can be sampled yet'
+        unsampleable = ~self._sampleable(idxs)
+        idxs[unsampleable] = np.random.choice(candidates, size=int(unsampleable.sum()))
+        return idxs
+
+    # Samples a batch of transitions as arrays (see ReplayBatch). Observations of a window that belong to a previous
+    # episode are zeroed, like SequentialMemory does
+    def sample_batch(self, batch_size, batch_idxs=None):
+        assert self.nb_entries >= self.window_length + 2, 'not enough entries in the memory'
+        idxs = self._sample_indexes(batch_size) if batch_idxs is None else np.asarray(batch_idxs, dtype=np.int64)
+
+        positions = self._positions(idxs)
+        horizons = self.horizons[positions].astype(np.int64)
+
+        # The windows of observations ending at each transition's observation and at its state1's, oldest first, as
+        # offsets from the transition's observation
+        offsets0 = np.arange(1 - self.window_length, 1)[None, :]
+        offsets1 = horizons[:, None] + offsets0
+
+        # Going back from the transition's observation, we stop at the first one that ends an episode; everything after
+        # it (up to state1) is in its episode
+        keep0 = np.ones((len(idxs), self.window_length), dtype=bool)
+        if self.window_length > 1:
+            ends = self.terminals[self._positions(idxs[:, None] - np.arange(2, self.window_length + 1)[None, :])].astype(bool)
+            keep0[:, :-1] = ~np.logical_or.accumulate(ends, axis=1)[:, ::-1]
+        in_window0 = np.clip(offsets1 + self.window_length - 1, 0, self.window_length - 1)
+        keep1 = np.where(offsets1 > 0, True, np.take_along_axis(keep0, in_window0, axis=1))
+
+        shape = (len(idxs), self.window_length) + (1,) * (self.observations.ndim - 1)
+        state0 = self.observations[self._positions(idxs[:, None] + offsets0)] * keep0.reshape(shape)
+        state1 = self.observations[self._positions(idxs[:, None] + offsets1)] * keep1.reshape(shape)
+
+        if self.masks is None: mask1 = np.ones((len(idxs), 0), dtype=bool)
+        else: mask1 = np.unpackbits(self.masks[self._positions(idxs + horizons)], axis=1, count=self.nb_actions).astype(bool)
+
+        # An n-step transition ends the episode if its last step does
+        return ReplayBatch(state0=state0, action=self.actions[positions].astype(np.intp), reward=self.returns[positions],
+                           state1=state1, terminal1=self.terminals[self._positions(idxs + horizons - 1)].astype(bool),
+                           mask1=mask1, positions=positions, weights=np.ones(len(idxs)), horizon=horizons)
+
+    # Samples experiences like SequentialMemory (for agents that expect them, e.g. DQNAgent); mask1 is None if we
+    # weren't given masks. Experiences can't say how many steps later their state1 is, so agents would discount n-step
+    # transitions wrong: with n_step > 1, use sample_batch (e.g. through MaskedDQNAgent) instead
+    def sample(self, batch_size, batch_idxs=None):
+        if self.n_step > 1:
+            raise ValueError('experiences drop the horizon of n-step transitions; use sample_batch (see MaskedDQNAgent)')
+
+        batch = self.sample_batch(batch_size, batch_idxs)
+        state0, state1 = batch.state0.astype(np.float32), batch.state1.astype(np.float32)
+
+        return [MaskedExperience(state0=list(state0[i]), action=int(batch.action[i]), reward=float(batch.reward[i]),
+                                 state1=list(state1[i]), terminal1=bool(batch.terminal1[i]),
+                                 mask1=batch.mask1[i] if self.masks is not None else None)
+                for i in range(len(batch.action))]
+
+    def get_config(self):
+        config = super().get_config()
+        config['limit'] = self.limit
+        return config
+
+
+# A sum tree over a fixed number of non-negative values: every node holds the sum of its two children, so that we can
+# update values and find the value a prefix sum falls in in O(log n). It's stored as a flat numpy array (the root at 1,
+# the children of node i at 2i and 2i + 1, and the values in the leaves), and works on whole batches at once, a tree
+# level at a time
+class SumTree():
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.depth = max(int(np.ceil(np.log2(max(capacity, 1)))), 0)
+        self.leaves = 1 << self.depth
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def values(self, positions):
+        return self.tree[self.leaves + np.asarray(positions)]
+
+    # Sets the values at positions (the last one wins if a position repeats), and updates their ancestors
+    def update(self, positions, values):
+        nodes = self.leaves + np.asarray(positions, dtype=np.int64)
+        self.tree[nodes] = values
+
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    # Returns the position of the value each prefix sum (in [0, total)) falls in
+    def find(self, prefixes):
+        prefixes = np.array(prefixes, dtype=np.float64)
+        nodes = np.ones(len(prefixes), dtype=np.int64)
+
+        for _ in range(self.depth):
+            left = self.tree[2 * nodes]
+            right = prefixes >= left
+            prefixes -= np.where(right, left, 0)
+            nodes = 2 * nodes + right
+
+        return nodes - self.leaves
+
+
+# A RingBufferMemory that samples transitions proportionally to their priority (Schaul et al., 2015): priorities are
+# (|TD error| + epsilon) ** alpha, kept in a SumTree. New transitions get the highest priority we've seen, so that they
+# get sampled at least once, and transitions that can't be sampled (e.g. the latest one, which doesn't have its state1
+# yet) get none. Samples come with importance-sampling weights that correct the bias of prioritizing, with
+# an exponent that goes from beta to 1 over beta_steps batches. The agent updates priorities after training on a batch
+# (see update_priorities and MaskedDQNAgent)
+class PrioritizedRingBufferMemory(RingBufferMemory):
+
+    def __init__(self, limit, alpha=.6, beta=.4, beta_steps=100000, epsilon=1e-3, **kwargs):
+        super().__init__(limit, **kwargs)
+        self.alpha, self.beta, self.beta_steps, self.epsilon = alpha, beta, beta_steps, epsilon
+
+        self.priorities = SumTree(self.limit)
+        self.max_priority = 1.
+        self.nb_batches = 0
+
+    # Appends a transition, with no priority until its state1 is stored; the transitions whose state1 it is get the
+    # highest priority (if they can be sampled, see _sampleable), and the oldest one loses its priority if it no longer
+    # has enough observations before it to fill a window
+    def append(self, observation, action, reward, terminal, training=True, mask=None):
+        super().append(observation, action, reward, terminal, training=training, mask=mask)
+        if not training: return
+
+        positions, priorities = [(self._next - 1) % self.limit], [0.]
+        if self._count == self.limit:
+            positions.append(self._positions(self.window_length - 1))
+            priorities.append(0.)
+
+        ready = self._logical(self._ready)
+        ready = self._positions(ready[self._sampleable(ready)])
+        positions.extend(ready)
+        priorities.extend([self.max_priority] * len(ready))
+
+        self.priorities.update(positions, priorities)
+
+    @property
+    def current_beta(self):
+        return min(1., self.beta + (1. - self.beta) * self.nb_batches / max(self.beta_steps, 1))
+
+    # Draws transitions proportionally to their priority, one in each of batch_size equal slices of the total priority
+    def _sample_indexes(self, batch_size):
+        total = self.priorities.total
+        prefixes = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * total / batch_size
+        positions = self.priorities.find(np.minimum(prefixes, np.nextafter(total, 0)))
+        idxs = self._logical(positions)
+
+        # Rounding errors in the tree's sums can (very rarely) lead us to a transition without priority
+        unsampleable = self.priorities.values(positions) <= 0
+        if unsampleable.any(): idxs[unsampleable] = super()._sample_indexes(int(unsampleable.sum()))
+        return idxs
+
+    # Samples a batch like RingBufferMemory, with importance-sampling weights: (N * P(i)) ** -beta, divided by the
+    # batch's largest so that they only ever scale updates down
+    def sample_batch(self, batch_size, batch_idxs=None):
+        batch = super().sample_batch(batch_size, batch_idxs)
+
+        probabilities = self.priorities.values(batch.positions) / self.priorities.total
+        weights = (self._count * np.maximum(probabilities, 1e-12)) ** -self.current_beta
+        self.nb_batches += 1
+
+        return batch._replace(weights=weights / weights.max())
+
+    # Sets the priorities of the transitions at positions (see ReplayBatch) from their TD errors
+    def update_priorities(self, positions, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.priorities.update(positions, priorities)
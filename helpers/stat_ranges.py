@@ -0,0 +1,68 @@
+from functools import lru_cache
+
+import numpy as np
+
+from poke_env.data import GEN_TO_POKEDEX
+from reuniclusVGC.helpers.knowledge import load_knowledge, load_table
+
+# The stats we store ranges for, in the order of the table's stat axis
+STATS = ['hp', 'atk', 'def', 'spa', 'spd', 'spe']
+STAT_INDEX = {stat: i for i, stat in enumerate(STATS)}
+
+MAX_LEVEL = 100
+
+# Bump this whenever how we compute the table changes
+STAT_RANGES_VERSION = 1
+
+# Returns the lowest and highest values a stat with the given base can have at a level (arrays broadcast), over every
+# nature, EV and IV spread: no IVs or EVs with a hindering nature, and max IVs and EVs with a boosting nature. We use
+# integer arithmetic, like the game does
+def stat_bounds(base, level, stat):
+    low = (2*base) * level // 100
+    high = (2*base + 31 + 252//4) * level // 100
+
+    if stat == 'hp': return low + level + 10, high + level + 10
+    return (low + 5) * 9 // 10, (high + 5) * 11 // 10
+
+# Builds the table of stat ranges of a generation: table[species, level - 1, stat] = (min, max), in the order of the
+# knowledge's species (see load_knowledge) and STATS
+def _build_stat_ranges(gen):
+    species = load_knowledge(gen)[0]['Pokemon']
+    pokedex = GEN_TO_POKEDEX[gen]
+
+    base_stats = np.array([[pokedex[mon]['baseStats'][stat] for stat in STATS] for mon in species], dtype=np.int64)
+    levels = np.arange(1, MAX_LEVEL + 1, dtype=np.int64)[None, :]
+
+    table = np.zeros((len(species), MAX_LEVEL, len(STATS), 2), dtype=np.uint16)
+    for i, stat in enumerate(STATS):
+        low, high = stat_bounds(base_stats[:, i:i + 1], levels, stat)
+        table[:, :, i, 0], table[:, :, i, 1] = low, high
+
+    # Shedinja always has 1 HP
+    for i, mon in enumerate(species):
+        if pokedex[mon].get('maxHP') == 1: table[i, :, STAT_INDEX['hp'], :] = 1
+
+    return table
+
+# Returns the table of stat ranges of a generation (see _build_stat_ranges) and the index of every species in it.
+# It's built once and stored on disk (see load_table)
+@lru_cache(maxsize=None)
+def load_stat_ranges(gen=8):
+    species_index = {mon: i for i, mon in enumerate(load_knowledge(gen)[0]['Pokemon'])}
+    table = load_table(gen, 'stat_ranges', STAT_RANGES_VERSION, lambda: _build_stat_ranges(gen))
+
+    # A plain view of the memory-mapped table; indexing np.memmap is a lot slower
+    return species_index, np.asarray(table)
+
+# Returns the (min, max) values a mon's stat can have, given its species and level. Unknown species (e.g. from another
+# generation) fall back to the stat formula on the mon's base stats
+def stat_range(mon, stat, gen=8):
+    species_index, table = load_stat_ranges(gen)
+    level = min(max(int(mon.level or MAX_LEVEL), 1), MAX_LEVEL)
+
+    if mon.species in species_index:
+        low, high = table[species_index[mon.species], level - 1, STAT_INDEX[stat]]
+        return int(low), int(high)
+
+    low, high = stat_bounds(mon.base_stats[stat], level, stat)
+    return int(low), int(high)
@@ -0,0 +1,85 @@
+import itertools
+from functools import lru_cache
+
+import numpy as np
+
+from reuniclusVGC.helpers.doubles_utils import compute_teampreview_matchup
+
+# How much we value our leads' matchup against the opponent's team, compared to our whole team's
+LEAD_WEIGHT = .5
+
+# How many of the best candidates (according to type matchups) we let a model score; models are slow, so we only ask
+# them about the candidates that are worth it, in one batch
+MODEL_CANDIDATES = 16
+
+# Returns the teams we can bring out of team_size mons: the chosen mons (as indices in our team), leads first. Teams
+# are grouped by the subset of mons they bring: returns the candidates (n_candidates x n_chosen), the index of each
+# candidate's subset, and the subsets themselves (n_subsets x n_chosen). With 6 mons, bringing 4 with 2 leads, that's
+# 15 subsets x 12 ways to pick the leads = 180 candidates. We don't score every ordering of the chosen mons: the back
+# mons always keep their order in our team (only which mons lead, and in which slot, varies), since we don't look at
+# which back mon comes in first
+@lru_cache(maxsize=None)
+def team_candidates(team_size, n_chosen=4, n_leads=2):
+    n_chosen, n_leads = min(n_chosen, team_size), min(n_leads, team_size)
+    subsets = list(itertools.combinations(range(team_size), n_chosen))
+
+    candidates, subset_ids = [], []
+    for i, subset in enumerate(subsets):
+        for leads in itertools.permutations(subset, n_leads):
+            candidates.append(leads + tuple(mon for mon in subset if mon not in leads))
+            subset_ids.append(i)
+
+    return np.array(candidates, dtype=np.intp).reshape(-1, n_chosen), np.array(subset_ids, dtype=np.intp), \
+        np.array(subsets, dtype=np.intp).reshape(-1, n_chosen)
+
+# Returns which subsets are dominated, given coverage (n_subsets x n_opp_mons, how well each subset answers each opponent
+# mon) and leads (the lead score of each subset's best pair of leads, see score_terms): another subset answers every
+# opponent mon at least as well and has leads at least as good, and is strictly better at one of them. No team of a
+# dominated subset can score higher than the best team of the subset that dominates it
+def dominated(coverage, leads):
+    at_least = (coverage[:, None, :] >= coverage[None, :, :]).all(axis=-1) & (leads[:, None] >= leads[None, :])
+    better = (coverage[:, None, :] > coverage[None, :, :]).any(axis=-1) | (leads[:, None] > leads[None, :])
+    return (at_least & better).any(axis=0)
+
+# Returns the two terms of the score of teams (see score_candidates): on average over the opponent's mons, how well our
+# best answer in the team does against it, and how well our best lead does
+def score_terms(matrix, candidates, n_leads=2):
+    if matrix.shape[1] == 0: return np.zeros(len(candidates)), np.zeros(len(candidates))
+
+    advantages = matrix[candidates]
+    return advantages.max(axis=1).mean(axis=-1), advantages[:, :n_leads].max(axis=1).mean(axis=-1)
+
+# Scores teams given our type advantage matrix against the opponent's team (see type_advantage_matrix): how well the
+# team answers the opponent's mons, plus LEAD_WEIGHT times how well its leads do (see score_terms)
+def score_candidates(matrix, candidates, n_leads=2):
+    coverage, leads = score_terms(matrix, candidates, n_leads)
+    return coverage + LEAD_WEIGHT * leads
+
+# Searches the teams we can bring (see team_candidates) against the opponent's team and returns the best one, as a
+# tuple of indices in our team, leads first. Teams of subsets of mons that are dominated by another subset (type-wise,
+# see dominated) are pruned, so that they don't take the place of better teams among the ones a model scores; the best
+# team is never pruned. If score_fn is given, it takes the best MODEL_CANDIDATES teams (an n x n_chosen array of
+# indices) and returns a score for each (e.g. from a model), which decides between them; type matchups break ties
+def select_team(matrix, score_fn=None, n_chosen=4, n_leads=2):
+    candidates, subset_ids, subsets = team_candidates(matrix.shape[0], n_chosen, n_leads)
+    coverage, leads = score_terms(matrix, candidates, n_leads)
+    scores = coverage + LEAD_WEIGHT * leads
+
+    if matrix.shape[1] > 0 and len(subsets) > 1:
+        best_leads = np.full(len(subsets), -np.inf)
+        np.maximum.at(best_leads, subset_ids, leads)
+        kept = ~dominated(matrix[subsets].max(axis=1), best_leads)[subset_ids]
+        candidates, scores = candidates[kept], scores[kept]
+
+    if score_fn is not None and len(candidates) > 1:
+        best = np.argsort(-scores, kind='stable')[:MODEL_CANDIDATES]
+        candidates, scores = candidates[best], scores[best]
+        order = np.lexsort((-scores, -np.asarray(score_fn(candidates), dtype=np.float64)))
+        return tuple(int(i) for i in candidates[order[0]])
+
+    return tuple(int(i) for i in candidates[np.argmax(scores)])
+
+# Returns the team we should bring at teampreview (see select_team), as indices in battle.team, leads first
+def choose_team(battle, score_fn=None, n_chosen=4, n_leads=2):
+    matrix, _ = compute_teampreview_matchup(battle)
+    return select_team(matrix, score_fn, n_chosen, n_leads)
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+from poke_env import utils
+from poke_env.player.battle_order import BattleOrder, DoubleBattleOrder
+
+# How many battles we keep a turn cache for; the least recently used ones get dropped first
+MAX_CACHED_BATTLES = 256
+
+# battle_tag -> (the state the cache is valid for, cache). Battles use __slots__, so we can't store this on them
+_TURN_CACHES = OrderedDict()
+
+# Returns the cache of the battle's current turn. Resolving targets and checking whether orders are valid only depend on
+# who is on the field, so a cache lives until the turn changes, or until mons are switched in (e.g. after a faint)
+def turn_cache(battle):
+    state = (
+        battle.turn,
+        tuple(battle.force_switch) if isinstance(battle.force_switch, list) else battle.force_switch,
+        tuple(map(id, battle.active_pokemon)) if isinstance(battle.active_pokemon, list) else id(battle.active_pokemon),
+        tuple(map(id, battle.opponent_active_pokemon)) if isinstance(battle.opponent_active_pokemon, list) else id(battle.opponent_active_pokemon),
+    )
+
+    entry = _TURN_CACHES.get(battle.battle_tag)
+    if entry is None or entry[0] != state:
+        entry = _TURN_CACHES[battle.battle_tag] = (state, {})
+    _TURN_CACHES.move_to_end(battle.battle_tag)
+
+    if len(_TURN_CACHES) > MAX_CACHED_BATTLES: _TURN_CACHES.popitem(last=False)
+    return entry[1]
+
+# Returns a key that identifies a single order within a turn: what it does, and which of our slots does it
+def _order_key(battle, order):
+    if order is None: return None
+
+    slot = next((i for i, mon in enumerate(battle.active_pokemon) if mon is not None and mon is order.actor), None)
+    if order.is_move(): return ('move', slot, order.order.id, order.move_target, order.dynamax)
+    return ('switch', slot, order.order.species)
+
+# BattleOrder.get_affected_targets, cached for the turn by (actor slot, move id, target)
+def cached_affected_targets(battle, order):
+    cache = turn_cache(battle)
+    key = ('targets', _order_key(battle, order))
+    if key not in cache: cache[key] = BattleOrder.get_affected_targets(battle, order)
+    return cache[key]
+
+# utils.showdown_target_to_mon, cached for the turn
+def cached_target_to_mon(battle, target):
+    cache = turn_cache(battle)
+    key = ('mon', target)
+    if key not in cache: cache[key] = utils.showdown_target_to_mon(battle, target)
+    return cache[key]
+
+# DoubleBattleOrder.is_valid, cached for the turn by what each of the double order's orders does
+def cached_is_valid(battle, double_order):
+    if not double_order: return DoubleBattleOrder.is_valid(battle, double_order)
+
+    cache = turn_cache(battle)
+    key = ('valid', _order_key(battle, double_order.first_order), _order_key(battle, double_order.second_order))
+    if key not in cache: cache[key] = DoubleBattleOrder.is_valid(battle, double_order)
+    return cache[key]
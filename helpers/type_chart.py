@@ -0,0 +1,72 @@
+from functools import lru_cache
+
+import numpy as np
+
+from poke_env.data import GEN_TO_POKEDEX, TYPE_CHART
+from poke_env.environment.pokemon_type import PokemonType
+
+# Every type gets an index in our matrices, and an extra one stands for "no type" (e.g. a mon's missing second type)
+TYPES = list(PokemonType)
+TYPE_INDEX = {type_: i for i, type_ in enumerate(TYPES)}
+TYPELESS = len(TYPES)
+NUM_TYPES = len(TYPES) + 1
+
+# TYPE_MATRIX[attacking type, defending type] is the damage multiplier of the attack. Attacking or defending without a
+# type is neutral (1)
+TYPE_MATRIX = np.ones((NUM_TYPES, NUM_TYPES))
+for attacking, i in TYPE_INDEX.items():
+    for defending, j in TYPE_INDEX.items():
+        TYPE_MATRIX[i, j] = TYPE_CHART[attacking.name][defending.name]
+
+# A mon's pair of types is stored as a single index: first type * NUM_TYPES + second type, with TYPELESS for missing types.
+# DUAL_TYPE_MATRIX[attacking type, defending pair] is the damage multiplier of an attack on a mon with both types
+DUAL_TYPE_MATRIX = (TYPE_MATRIX[:, :, None] * TYPE_MATRIX[:, None, :]).reshape(NUM_TYPES, NUM_TYPES * NUM_TYPES)
+
+# BEST_ATTACK_MATRIX[attacking pair, defending pair] is the best multiplier a mon of the first pair can get with its
+# STAB types on a mon of the second pair; -inf if the attacker doesn't have types (mirroring compute_type_advantage)
+_attacks = np.where((np.arange(NUM_TYPES) == TYPELESS)[:, None], -np.inf, DUAL_TYPE_MATRIX)
+BEST_ATTACK_MATRIX = np.maximum(_attacks[:, None, :], _attacks[None, :, :]).reshape(NUM_TYPES * NUM_TYPES, NUM_TYPES * NUM_TYPES)
+
+# ADVANTAGE_MATRIX[pair1, pair2] is how much better a mon of pair1 performs against a mon of pair2 than the other way
+# around: the difference between their best multipliers on each other
+with np.errstate(invalid='ignore'):
+    ADVANTAGE_MATRIX = BEST_ATTACK_MATRIX - BEST_ATTACK_MATRIX.T
+
+# Returns the index of a mon's pair of types in our matrices
+def type_pair_index(mon):
+    type_1, type_2 = mon.types
+    return TYPE_INDEX.get(type_1, TYPELESS) * NUM_TYPES + TYPE_INDEX.get(type_2, TYPELESS)
+
+# Returns a len(mons) x len(opp_mons) matrix of the type advantage of each mon against each opponent mon (see
+# compute_type_advantage in doubles_utils.py)
+def type_advantage_matrix(mons, opp_mons):
+    pairs = np.array([type_pair_index(mon) for mon in mons], dtype=np.intp)
+    opp_pairs = np.array([type_pair_index(mon) for mon in opp_mons], dtype=np.intp)
+    return ADVANTAGE_MATRIX[pairs[:, None], opp_pairs[None, :]]
+
+# How many (team, opponent team) matchups we remember. Every entry is a handful of small arrays, so this bounds the
+# cache to a few MB however many different teams we meet
+TEAM_MATCHUP_CACHE_SIZE = 4096
+
+# Returns the index of a species' pair of types in our matrices, from the pokedex; typeless if we don't know the species
+def species_type_pair_index(species, gen=8):
+    types = [TYPE_INDEX[PokemonType.from_name(type_)] for type_ in GEN_TO_POKEDEX[gen].get(species, {}).get('types', [])]
+    types = (types + [TYPELESS, TYPELESS])[:2]
+    return types[0] * NUM_TYPES + types[1]
+
+# Returns the type advantage matrix of a team against an opponent team (see type_advantage_matrix), and our team's
+# indices ranked by their average advantage against the opponent team, best first. Teams are tuples of species; the
+# same teams meet over and over again (e.g. TeamRepository teams on the ladder), so we remember the most recent
+# matchups. The matrix is shared across calls, so it's read-only
+@lru_cache(maxsize=TEAM_MATCHUP_CACHE_SIZE)
+def team_matchup(team, opp_team, gen=8):
+    pairs = np.array([species_type_pair_index(species, gen) for species in team], dtype=np.intp)
+    opp_pairs = np.array([species_type_pair_index(species, gen) for species in opp_team], dtype=np.intp)
+
+    matrix = ADVANTAGE_MATRIX[pairs[:, None], opp_pairs[None, :]]
+    matrix.setflags(write=False)
+
+    performance = matrix.mean(axis=1) if len(opp_team) > 0 else np.zeros(len(team))
+    ranking = tuple(int(i) for i in np.argsort(-performance, kind='stable'))
+
+    return matrix, ranking
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from tabulate import tabulate
+
+from reuniclusVGC.helpers.embedder import Embedder
+from reuniclusVGC.tests.record_battle_fixtures import FIXTURES_DIR, Replay, load_fixture
+
+# How much slower (as a fraction) a benchmark can get compared to a saved baseline before we call it a regression
+TOLERANCE = .2
+
+# Loads every recorded battle under directory. Returns a dict of format -> list of fixtures (see load_fixture)
+def load_fixtures(directory=FIXTURES_DIR):
+    fixtures = {}
+    if not os.path.isdir(directory): return fixtures
+
+    for battle_format in sorted(os.listdir(directory)):
+        for filename in sorted(os.listdir(os.path.join(directory, battle_format))):
+            if not filename.endswith('.pkl'): continue
+            fixtures.setdefault(battle_format, []).append(load_fixture(os.path.join(directory, battle_format, filename)))
+
+    return fixtures
+
+# Returns whether a fixture is a doubles battle
+def is_doubles(fixture):
+    header, _ = fixture
+    return 'vgc' in header['battle_format'] or 'double' in header['battle_format']
+
+# Replays every fixture, one after the other, and yields each battle every time the player has to choose a move, like
+# a player would see them
+def replay_battles(fixtures):
+    for fixture in fixtures:
+        replay = Replay(fixture)
+        battle = replay.next_battle()
+        while battle is not None:
+            yield battle
+            battle = replay.next_battle()
+
+# Times embed_fn on every move of every battle, rounds times over. If cold, we drop the Embedder's cache before every
+# embed, so every mon gets embedded from scratch (like the first turn of a battle). Otherwise, we replay each battle's
+# turns in order on an empty cache, like a player would see them. Returns per-embed latencies in seconds
+def time_embeds(embedder, embed_fn, fixtures, rounds, cold):
+    latencies = []
+    for _ in range(rounds):
+        embedder._cache.clear()
+        for battle in replay_battles(fixtures):
+            if cold: embedder.forget_battle(battle)
+            start = time.perf_counter()
+            embed_fn(battle)
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+# Measures memory allocated by embed_fn on one pass over the battles: the average peak of memory allocated during an
+# embed, and the average number of memory blocks an embed leaves allocated (e.g. what it caches)
+def trace_allocations(embedder, embed_fn, fixtures):
+    embedder._cache.clear()
+    peaks, blocks, n = 0, 0, 0
+
+    for battle in replay_battles(fixtures):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        embed_fn(battle)
+        after = tracemalloc.take_snapshot()
+        peaks += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        blocks += sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+        n += 1
+
+    return peaks / max(n, 1), blocks / max(n, 1)
+
+# Benchmarks one way of embedding battles, and returns a row of results
+def benchmark(name, embedder, embed_fn, battles, rounds, cold=False):
+    latencies = time_embeds(embedder, embed_fn, battles, rounds, cold)
+    peak, blocks = trace_allocations(embedder, embed_fn, battles)
+
+    return {
+        'name': name,
+        'embeds/sec': len(latencies) / latencies.sum(),
+        'p50 (ms)': np.percentile(latencies, 50) * 1000,
+        'p99 (ms)': np.percentile(latencies, 99) * 1000,
+        'peak KB/embed': peak / 1024,
+        'blocks/embed': blocks,
+    }
+
+# Benchmarks embedding the battles of every fixture at once with embed_battles, a move at a time: we replay the battles
+# side by side, like a player with many concurrent battles waiting on its moves would embed them
+def benchmark_batch(name, embedder, fixtures, rounds):
+    out = np.empty((len(fixtures), embedder.EMBEDDING_LEN), dtype=np.float32)
+
+    latencies = []
+    for _ in range(rounds):
+        embedder._cache.clear()
+        replays = [Replay(fixture) for fixture in fixtures]
+        while replays:
+            battles = [replay.next_battle() for replay in replays]
+            replays = [replay for replay, battle in zip(replays, battles) if battle is not None]
+            battles = [battle for battle in battles if battle is not None]
+            if not battles: break
+
+            start = time.perf_counter()
+            embedder.embed_battles(battles, out=out[:len(battles)])
+            latencies.append((time.perf_counter() - start) / len(battles))
+    latencies = np.array(latencies)
+
+    peak, blocks = trace_allocations(embedder, lambda battle: embedder.embed_battles([battle]), fixtures)
+
+    return {
+        'name': name,
+        'embeds/sec': 1 / latencies.mean(),
+        'p50 (ms)': np.percentile(latencies, 50) * 1000,
+        'p99 (ms)': np.percentile(latencies, 99) * 1000,
+        'peak KB/embed': peak / 1024,
+        'blocks/embed': blocks,
+    }
+
+# Builds the DQN players, to benchmark how they embed battles. They need tensorflow and keras-rl; without them, we
+# return None for both (and only benchmark the Embedder profiles they use)
+def dqn_players():
+    try:
+        from reuniclusVGC.bots.simple_dqn_player import SimpleDQNPlayer
+        from reuniclusVGC.bots.singles_dqn_player import SinglesDQNPlayer
+    except ImportError as e:
+        print("\033[93m Skipping the DQN players ({0}) \033[0m".format(e))
+        return None, None
+
+    return SimpleDQNPlayer(battle_format='gen8vgc2021', start_listening=False), \
+        SinglesDQNPlayer(battle_format='gen8randombattle', start_listening=False)
+
+# Runs every benchmark we have fixtures for: the Embedder's profiles, and the DQN players' embed_battle when we can build
+# them (SimpleDQNPlayer uses the doubles_no_ohe profile and SinglesDQNPlayer singles_no_ohe)
+def run(fixtures, rounds):
+    doubles = [fixture for format_fixtures in fixtures.values() for fixture in format_fixtures if is_doubles(fixture)]
+    singles = [fixture for format_fixtures in fixtures.values() for fixture in format_fixtures if not is_doubles(fixture)]
+    simple_dqn_player, singles_dqn_player = dqn_players()
+
+    results = []
+    if doubles:
+        embedder = Embedder(profile='doubles')
+        results.append(benchmark('Embedder (doubles, cold)', embedder, embedder.embed_battle, doubles, rounds, cold=True))
+        results.append(benchmark('Embedder (doubles)', embedder, embedder.embed_battle, doubles, rounds))
+        results.append(benchmark('Embedder (doubles, sparse)', embedder, embedder.embed_battle_sparse, doubles, rounds))
+        results.append(benchmark_batch('Embedder (doubles, batched)', embedder, doubles, rounds))
+
+        embedder = Embedder(profile='doubles_no_ohe')
+        results.append(benchmark('Embedder (doubles_no_ohe, cold)', embedder, embedder.embed_battle, doubles, rounds, cold=True))
+        results.append(benchmark('Embedder (doubles_no_ohe)', embedder, embedder.embed_battle, doubles, rounds))
+        results.append(benchmark_batch('Embedder (doubles_no_ohe, batched)', embedder, doubles, rounds))
+
+        if simple_dqn_player is not None:
+            player = simple_dqn_player
+            results.append(benchmark('SimpleDQNPlayer (cold)', player._embedder, player.embed_battle, doubles, rounds, cold=True))
+            results.append(benchmark('SimpleDQNPlayer', player._embedder, player.embed_battle, doubles, rounds))
+
+    if singles:
+        embedder = Embedder(profile='singles_no_ohe')
+        results.append(benchmark('Embedder (singles_no_ohe, cold)', embedder, embedder.embed_battle, singles, rounds, cold=True))
+        results.append(benchmark('Embedder (singles_no_ohe)', embedder, embedder.embed_battle, singles, rounds))
+
+        if singles_dqn_player is not None:
+            player = singles_dqn_player
+            results.append(benchmark('SinglesDQNPlayer (cold)', player._embedder, player.embed_battle, singles, rounds, cold=True))
+            results.append(benchmark('SinglesDQNPlayer', player._embedder, player.embed_battle, singles, rounds))
+
+    return results
+
+# Compares results to a saved baseline, and returns the names of the benchmarks that got slower than TOLERANCE allows
+def regressions(results, baseline):
+    previous = {row['name']: row for row in baseline}
+    return [
+        row['name'] for row in results
+        if row['name'] in previous and row['embeds/sec'] < previous[row['name']]['embeds/sec'] * (1 - TOLERANCE)
+    ]
+
+# Benchmarks embedding battles offline, against the battles recorded by record_battle_fixtures.py. To run from command
+# line, run this in the root directory: python3.8 tests/benchmark_embeddings.py [--save results.json] [--compare results.json]
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='directory of recorded battles')
+    parser.add_argument('--rounds', type=int, default=5, help='how many times to replay every battle')
+    parser.add_argument('--save', help='file to save results to, to compare against later')
+    parser.add_argument('--compare', help='file of saved results to check for regressions against')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print("No recorded battles in {0}. Record some first with: python3.8 tests/record_battle_fixtures.py".format(args.fixtures))
+        sys.exit(1)
+
+    print("\033[92m Benchmarking embeddings on {0} recorded battles ({1})... \033[0m".format(
+        sum(len(battles) for battles in fixtures.values()), ", ".join(fixtures)))
+
+    results = run(fixtures, args.rounds)
+    print(tabulate([list(row.values()) for row in results], headers=list(results[0].keys()), floatfmt='.3f'))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = regressions(results, json.load(f))
+
+        if slower:
+            print("\033[91m Slower than baseline: {0} \033[0m".format(", ".join(slower)))
+            sys.exit(1)
+        print("\033[92m No regressions against {0} \033[0m".format(args.compare))
+
+
+if __name__ == "__main__":
+    main()
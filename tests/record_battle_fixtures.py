@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import copy
+import os
+import pickle
+
+from poke_env.player.player import Player
+from poke_env.player.random_player import RandomPlayer
+from poke_env.player.utils import cross_evaluate
+from poke_env.data import to_id_str
+from poke_env.player_configuration import PlayerConfiguration
+from reuniclusVGC.bots.random_doubles_player import RandomDoublesPlayer
+from reuniclusVGC.helpers.team_repo import TeamRepository
+
+# Where we store recorded battles; benchmark_embeddings.py reads them from here
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'battles')
+
+# Appends the messages of a battle a player received to the battle's fixture file. Each file starts with a header (who
+# we are and the battle's format) followed by every message the player received, pickled one after the other, in order.
+# We record messages rather than battle objects, so that fixtures replay (see replay) with any version of poke_env
+def record(username, battle_format, split_messages):
+    battle_tag = split_messages[0][0][1:]
+    directory = os.path.join(FIXTURES_DIR, battle_format)
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, battle_tag + '-' + to_id_str(username) + '.pkl')
+    with open(path, 'ab') as f:
+        if f.tell() == 0: pickle.dump({'username': username, 'battle_format': battle_format}, f)
+        pickle.dump(split_messages, f)
+
+class RecordingDoublesPlayer(RandomDoublesPlayer):
+
+    async def _handle_battle_message(self, split_messages):
+        record(self.username, self._format, copy.deepcopy(split_messages))
+        await super()._handle_battle_message(split_messages)
+
+class RecordingSinglesPlayer(RandomPlayer):
+
+    async def _handle_battle_message(self, split_messages):
+        record(self.username, self._format, copy.deepcopy(split_messages))
+        await super()._handle_battle_message(split_messages)
+
+# Loads a fixture file (see record). Returns its header and the messages the player received, in order
+def load_fixture(path):
+    with open(path, 'rb') as f:
+        header, messages = pickle.load(f), []
+        while True:
+            try: messages.append(pickle.load(f))
+            except EOFError: break
+
+    return header, messages
+
+# A player that never connects to a server: we hand it recorded messages, and it remembers the battle (and how many
+# moves it chose) every time it has to choose a move
+class ReplayPlayer(Player):
+
+    def __init__(self, username, battle_format):
+        super().__init__(player_configuration=PlayerConfiguration(username, None), battle_format=battle_format,
+                         max_concurrent_battles=0, start_listening=False)
+        self.battle, self.nb_moves = None, 0
+
+    def choose_move(self, battle):
+        self.battle, self.nb_moves = battle, self.nb_moves + 1
+        return self.choose_default_move(battle)
+
+    async def _send_message(self, *args, **kwargs):
+        pass
+
+# Replays a recorded battle (see load_fixture) with a ReplayPlayer, one move at a time. Battles are rebuilt from their
+# messages by whatever version of poke_env we run
+class Replay():
+
+    def __init__(self, fixture):
+        header, messages = fixture
+        self.player = ReplayPlayer(header['username'], header['battle_format'])
+        self._messages = iter(messages)
+
+    # Feeds the player the battle's messages until it has to choose its next move, and returns the battle as it is
+    # then; None once there are no more messages
+    def next_battle(self):
+        nb_moves = self.player.nb_moves
+        for split_messages in self._messages:
+            # The player pops the first message of a battle, so we give it a copy
+            asyncio.get_event_loop().run_until_complete(self.player._handle_battle_message(list(split_messages)))
+            if self.player.nb_moves > nb_moves: return self.player.battle
+
+        return None
+
+# Plays battles against a local showdown server and records every message of them, so that we can benchmark embeddings
+# offline. To run from command line, run this in the root directory: python3.8 tests/record_battle_fixtures.py
+async def main():
+    print("\033[92m Starting script... \033[0m")
+
+    # Each pair of players plays n times against each other
+    n = 5
+
+    doubles_players = [
+      RecordingDoublesPlayer(max_concurrent_battles=10, battle_format='gen8vgc2021', team=TeamRepository.teams['garchomp']),
+      RecordingDoublesPlayer(max_concurrent_battles=10, battle_format='gen8vgc2021', team=TeamRepository.teams['spectrier']),
+    ]
+    singles_players = [
+      RecordingSinglesPlayer(max_concurrent_battles=10, battle_format='gen8randombattle'),
+      RecordingSinglesPlayer(max_concurrent_battles=10, battle_format='gen8randombattle'),
+    ]
+
+    print("About to record " + str(2*n) + " battles...")
+    await cross_evaluate(doubles_players, n_challenges=n)
+    await cross_evaluate(singles_players, n_challenges=n)
+
+    print("\033[92m Recorded battles to {0} \033[0m".format(FIXTURES_DIR))
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from collections import defaultdict
+
+import numpy as np
+
+from poke_env.environment.field import Field
+from poke_env.environment.move import Move
+from poke_env.environment.pokemon_type import PokemonType
+from poke_env.environment.side_condition import SideCondition
+from poke_env.environment.status import Status
+from reuniclusVGC.helpers.damage import compute_damage, damage_rolls
+
+# Reference damage calcs, worked out by hand with showdown's damage formula (and its rounding). Stats are given directly,
+# so that every calc only depends on the formula; targets are the opponent's mons
+
+
+# Just what compute_damage reads of a mon
+class FakeMon():
+
+    def __init__(self, species, types, level=50, ability=None, item=None, status=None, **stats):
+        self.species, self.types, self.level = species, types, level
+        self.ability, self.item, self.status = ability, item, status
+        self.stats, self.boosts = stats, defaultdict(int)
+        self.current_hp_fraction, self.fainted = 1., False
+
+
+# Just what compute_damage reads of a battle; doubles battles have a list of active mons
+class FakeBattle():
+
+    def __init__(self, attacker, targets, doubles=True, fields=(), opponent_side_conditions=()):
+        self.team = {'attacker': attacker}
+        self.active_pokemon = [attacker, None] if doubles else attacker
+        self.opponent_active_pokemon = (list(targets) + [None])[:2] if doubles else targets[0]
+        self.weather, self.fields = None, {field: 0 for field in fields}
+        self.side_conditions, self.opponent_side_conditions = {}, {condition: 0 for condition in opponent_side_conditions}
+
+
+def garchomp(**kwargs):
+    return FakeMon('garchomp', (PokemonType.DRAGON, PokemonType.GROUND), atk=182, **kwargs)
+
+
+def snorlax(**kwargs):
+    return FakeMon('snorlax', (PokemonType.NORMAL, None), **{'def': 100, 'spd': 100}, **kwargs)
+
+
+# Returns the lowest and highest rolls of an attack on the first target
+def rolls(battle, attacker, move, target):
+    damage, _ = compute_damage(battle, [(attacker, Move(move), target)])
+    return damage[0, 0], damage[0, -1]
+
+
+# Bulbapedia's example: a level 75 Glaceon's Ice Fang (65 bp, STAB, 4x) with 123 attack on a Garchomp with 163 defense
+def test_damage_formula():
+    damage = damage_rolls([75], [65], [123], [163], [4096], [4096], [6144], [4.], [False], [4096])
+    print("Ice Fang:", damage[0])
+    assert (damage[0, 0], damage[0, -1]) == (168, 196)
+
+
+# Earthquake: 82 base damage (103-123 with STAB), down to 61 (76-91) when it hits both foes
+def test_spread():
+    attacker, target = garchomp(), snorlax()
+    assert rolls(FakeBattle(attacker, [target]), attacker, 'earthquake', target) == (103, 123)
+    assert rolls(FakeBattle(attacker, [target, snorlax()]), attacker, 'earthquake', target) == (76, 91)
+    assert rolls(FakeBattle(attacker, [target], doubles=False), attacker, 'earthquake', target) == (103, 123)
+
+
+# Burns halve physical damage, unless the attacker has guts
+def test_burn():
+    target = snorlax()
+    attacker = garchomp(status=Status.BRN)
+    assert rolls(FakeBattle(attacker, [target]), attacker, 'earthquake', target) == (51, 61)
+    attacker = garchomp(status=Status.BRN, ability='guts')
+    assert rolls(FakeBattle(attacker, [target]), attacker, 'earthquake', target) == (103, 123)
+
+
+# Screens take a third off in doubles (2732/4096) and half in singles
+def test_screens():
+    attacker, target = garchomp(), snorlax()
+    for conditions in [[SideCondition.REFLECT], [SideCondition.AURORA_VEIL]]:
+        battle = FakeBattle(attacker, [target], opponent_side_conditions=conditions)
+        assert rolls(battle, attacker, 'earthquake', target) == (69, 82)
+        battle = FakeBattle(attacker, [target], doubles=False, opponent_side_conditions=conditions)
+        assert rolls(battle, attacker, 'earthquake', target) == (51, 61)
+
+    battle = FakeBattle(attacker, [target], opponent_side_conditions=[SideCondition.LIGHT_SCREEN])
+    assert rolls(battle, attacker, 'earthquake', target) == (103, 123)
+
+
+# Seismic Toss does the attacker's level, unless the target is immune to its type
+def test_fixed_damage():
+    attacker, target = garchomp(), snorlax()
+    assert rolls(FakeBattle(attacker, [target]), attacker, 'seismictoss', target) == (50, 50)
+
+    target = FakeMon('gengar', (PokemonType.GHOST, PokemonType.POISON), **{'def': 100})
+    assert rolls(FakeBattle(attacker, [target]), attacker, 'seismictoss', target) == (0, 0)
+
+
+# Ground moves don't touch mons with levitate or an air balloon
+def test_levitate():
+    attacker = garchomp()
+    for target in [snorlax(ability='levitate'), snorlax(item='airballoon')]:
+        assert rolls(FakeBattle(attacker, [target]), attacker, 'earthquake', target) == (0, 0)
+
+
+# Electric terrain boosts Thunderbolt's base power to 117, which gives 79 base damage; boosting the final damage instead
+# would give 66-79
+def test_terrain():
+    attacker, target = FakeMon('snorlax', (PokemonType.NORMAL, None), spa=150), snorlax()
+    assert rolls(FakeBattle(attacker, [target]), attacker, 'thunderbolt', target) == (51, 61)
+    battle = FakeBattle(attacker, [target], fields=[Field.ELECTRIC_TERRAIN])
+    assert rolls(battle, attacker, 'thunderbolt', target) == (67, 79)
+
+    # Only grounded attackers get the boost
+    attacker.ability = 'levitate'
+    assert rolls(battle, attacker, 'thunderbolt', target) == (51, 61)
+
+
+async def main():
+    print("\033[92m Starting script... \033[0m")
+
+    test_damage_formula()
+    test_spread()
+    test_burn()
+    test_screens()
+    test_fixed_damage()
+    test_levitate()
+    test_terrain()
+
+    print("\033[92m Done! \033[0m")
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
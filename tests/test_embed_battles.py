@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from reuniclusVGC.helpers.embedder import Embedder
+from reuniclusVGC.tests.benchmark_embeddings import is_doubles, load_fixtures
+from reuniclusVGC.tests.record_battle_fixtures import Replay
+
+
+# Replays the battles side by side and checks that embed_battles gives, row by row, what embed_battle gives for each
+# battle. Each gets its own Embedder, so that they don't share caches
+def check_profile(profile, fixtures):
+    batched, single = Embedder(profile=profile), Embedder(profile=profile)
+    replays = [Replay(fixture) for fixture in fixtures]
+
+    n = 0
+    while replays:
+        battles = [replay.next_battle() for replay in replays]
+        replays = [replay for replay, battle in zip(replays, battles) if battle is not None]
+        battles = [battle for battle in battles if battle is not None]
+        if not battles: break
+
+        # Every other step, start from an empty cache, so that we check embedding mons from scratch and from the cache
+        if n % 2 == 0: batched._cache.clear()
+
+        embeddings = batched.embed_battles(battles)
+        for battle, embedding in zip(battles, embeddings):
+            expected = single.embed_battle(battle)
+            assert np.array_equal(embedding, expected), \
+                (profile, battle.battle_tag, battle.turn, np.flatnonzero(embedding != expected))
+        n += len(battles)
+
+    print("embed_battles matches embed_battle on {0} battles with the {1} profile".format(n, profile))
+
+
+# Replay runs poke_env's event loop itself, so unlike our other tests, main isn't a coroutine
+def main():
+    print("\033[92m Starting script... \033[0m")
+
+    fixtures = [fixture for format_fixtures in load_fixtures().values() for fixture in format_fixtures]
+    doubles = [fixture for fixture in fixtures if is_doubles(fixture)]
+    singles = [fixture for fixture in fixtures if not is_doubles(fixture)]
+
+    for profile in ['doubles', 'doubles_no_ohe']: check_profile(profile, doubles)
+    for profile in ['singles', 'singles_no_ohe']: check_profile(profile, singles)
+
+    print("\033[92m Done! \033[0m")
+
+if __name__ == "__main__":
+    main()
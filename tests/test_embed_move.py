@@ -6,6 +6,8 @@ import time
 import json
 import traceback
 
+import numpy as np
+
 from poke_env.data import GEN_TO_POKEDEX
 from poke_env.environment.move import Move
 from reuniclusVGC.helpers.embedder import Embedder
@@ -21,14 +23,15 @@ def importMoves(gen=8):
     return {move_id: Move(move_id) for move_id in moves}
 
 # Check whether the move lengths are always consistent
-def validateLength(embedded_moves):
+def validateLength(embedded_moves, expected_len):
     hist = {}
 
     for embed in embedded_moves.values():
         if len(embed) not in hist: hist[len(embed)] = 1
         else: hist[len(embed)] += 1
 
-    if len(hist) == 1: print("\tAll moves have a length of {0} -- everything looks good!".format(list(hist.keys())[0]))
+    if list(hist.keys()) == [expected_len]: print("\tAll moves have a length of {0} -- everything looks good!".format(expected_len))
+    elif len(hist) == 1: print("\tError: All moves have a length of {0}, but the schema expects {1}".format(list(hist.keys())[0], expected_len))
     else:
         most_common_len = max(hist, key=hist.get)
 
@@ -61,7 +64,7 @@ def validateUniqueness(embedded_moves):
             # Hidden Power is an edge-case that needs to be fixed
             if m1 == m2 or 'hiddenpower' in m1: continue
 
-            elif embedded_moves[m1] == embedded_moves[m2]:
+            elif np.array_equal(embedded_moves[m1], embedded_moves[m2]):
                 if not alerted:
                     print("\tError: Not all moves are unique...")
                     alerted = True
@@ -77,7 +80,6 @@ def main():
     print("\033[92m Starting script... \033[0m")
     t0 = time.time()
 
-    expected_len = 180
     gen = 8
 
     print("\033[92m Loading Embedder & Moves... \033[0m")
@@ -86,6 +88,7 @@ def main():
     # Load Embedder and Moves
     embedder = Embedder(gen)
     moves = importMoves(gen)
+    expected_len = embedder.move_schema.width
 
     t1 = time.time()
     print("\tFinished in {0:.3f} seconds\n".format(t0 - t1))
@@ -101,7 +104,7 @@ def main():
     print("\tFinished in {0:.3f} seconds\n".format(t2 - t1))
     print("\033[92m Validating Moves... \033[0m")
 
-    validateLength(embedded_moves)
+    validateLength(embedded_moves, expected_len)
     validateUniqueness(embedded_moves)
 
     print("\033[92m Done in {0:.3f} seconds! \033[0m".format(time.time() - t0))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import numpy as np
+
+from reuniclusVGC.helpers.inference_server import InferenceServer
+
+
+# A model that doubles its inputs, and remembers the size of every batch it ran
+class Model():
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict_on_batch(self, observations):
+        self.batch_sizes.append(len(observations))
+        return observations * 2
+
+
+# Predictions are batched up to max_batch_size, without waiting for max_delay once a batch is full, and every battle
+# gets its own output
+async def test_max_batch_size():
+    model = Model()
+    server = InferenceServer(model.predict_on_batch, max_batch_size=4, max_delay=10)
+
+    outputs = await asyncio.wait_for(asyncio.gather(*[server.predict(np.full(3, i)) for i in range(8)]), timeout=1)
+    assert model.batch_sizes == [4, 4], model.batch_sizes
+    assert all((output == 2*i).all() for i, output in enumerate(outputs))
+    assert server.nb_batches == 2 and server.average_batch_size == 4
+
+
+# Batches that don't fill up run after max_delay
+async def test_max_delay():
+    model = Model()
+    server = InferenceServer(model.predict_on_batch, max_batch_size=64, max_delay=.01)
+
+    start = asyncio.get_event_loop().time()
+    outputs = await asyncio.gather(*[server.predict(np.full(3, i)) for i in range(3)])
+    assert asyncio.get_event_loop().time() - start >= .01
+    assert model.batch_sizes == [3] and all((output == 2*i).all() for i, output in enumerate(outputs))
+
+
+# If the model fails, every battle waiting on the batch gets the error, and the server keeps working
+async def test_errors():
+    def predict_on_batch(observations):
+        raise RuntimeError("model failed")
+    server = InferenceServer(predict_on_batch, max_batch_size=64, max_delay=.001)
+
+    results = await asyncio.gather(*[server.predict(np.zeros(3)) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results), results
+    assert server.nb_batches == 0
+
+    server.predict_fn = Model().predict_on_batch
+    assert (await server.predict(np.ones(3)) == 2).all()
+
+
+# Battles that stop waiting (e.g. they end) are dropped from their batch
+async def test_cancelled():
+    model = Model()
+    server = InferenceServer(model.predict_on_batch, max_batch_size=64, max_delay=.01)
+
+    tasks = [asyncio.ensure_future(server.predict(np.full(3, i))) for i in range(4)]
+    await asyncio.sleep(0)
+    tasks[1].cancel()
+    tasks[2].cancel()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert isinstance(results[1], asyncio.CancelledError) and isinstance(results[2], asyncio.CancelledError)
+    assert (results[0] == 0).all() and (results[3] == 6).all()
+    assert model.batch_sizes == [2] and server.nb_predictions == 2
+
+
+async def main():
+    print("\033[92m Starting script... \033[0m")
+
+    await test_max_batch_size()
+    await test_max_delay()
+    await test_errors()
+    await test_cancelled()
+
+    print("\033[92m Done! \033[0m")
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import numpy as np
+
+from reuniclusVGC.helpers.replay_memory import RingBufferMemory, PrioritizedRingBufferMemory, SumTree
+
+
+# Stores episodes the way keras-rl does: every step's observation, action, reward and whether it ended the episode,
+# and then the last observation, with no reward. Observations are the number of the step, so that we can tell how many
+# steps apart two observations are
+def fill(memory, episode_lengths, nb_actions=6):
+    step = 0
+    for length in episode_lengths:
+        for t in range(length):
+            memory.append(np.full(3, step), step % nb_actions, t + 1., t == length - 1, mask=np.arange(nb_actions) != step % nb_actions)
+            step += 1
+        memory.append(np.full(3, step), 0, 0., False, mask=np.ones(nb_actions, dtype=bool))
+        step += 1
+
+
+# n-step returns are the discounted sum of the next n rewards, cut short by the end of the episode
+def test_n_step_returns():
+    memory = RingBufferMemory(limit=100, window_length=1, n_step=3, gamma=.5)
+    fill(memory, [5])
+
+    returns, horizons = memory.returns[:5], memory.horizons[:5]
+    print("Returns:", returns, "Horizons:", horizons)
+    assert np.allclose(returns, [2.75, 4.5, 6.25, 6.5, 5.])
+    assert list(horizons) == [3, 3, 3, 2, 1]
+
+
+# Every sampled transition's state1 is horizon steps after its state0, within its episode, even once we've wrapped
+# around the ring buffer many times
+def test_horizons_across_wrap():
+    for memory in [RingBufferMemory(limit=40, window_length=1, n_step=3, gamma=.5),
+                   PrioritizedRingBufferMemory(limit=40, window_length=1, n_step=3, gamma=.5)]:
+        fill(memory, [1, 2, 7, 3, 5, 4] * 10)
+
+        batch = memory.sample_batch(256)
+        steps = (batch.state1[:, -1, 0] - batch.state0[:, -1, 0]).astype(np.int64)
+        assert (steps == batch.horizon).all(), (steps, batch.horizon)
+        assert ((batch.horizon >= 1) & (batch.horizon <= 3)).all()
+    print("Horizons match across wrap")
+
+
+# Experiences can't carry the horizon of n-step transitions, so sample refuses to build them
+def test_sample_needs_one_step():
+    memory = RingBufferMemory(limit=40, window_length=1, n_step=3, gamma=.5)
+    fill(memory, [5, 5])
+    try:
+        memory.sample(4)
+    except ValueError:
+        print("sample refuses n-step transitions")
+    else:
+        raise AssertionError("sample should refuse n-step transitions")
+
+    memory = RingBufferMemory(limit=40, window_length=1)
+    fill(memory, [5, 5])
+    assert all(experience.state1[0][0] - experience.state0[0][0] == 1 for experience in memory.sample(16))
+
+
+# Prefix sums land on values proportionally to them
+def test_sum_tree_sampling():
+    np.random.seed(0)
+    priorities = np.random.uniform(size=37) ** 3
+    priorities[[3, 20]] = 0
+
+    tree = SumTree(37)
+    tree.update(np.arange(37), priorities)
+    assert np.isclose(tree.total, priorities.sum())
+
+    found = tree.find(np.random.uniform(size=200000) * tree.total)
+    frequencies = np.bincount(found, minlength=37) / len(found)
+    print("Largest frequency error:", np.abs(frequencies - priorities / priorities.sum()).max())
+    assert np.allclose(frequencies, priorities / priorities.sum(), atol=.005)
+    assert frequencies[3] == 0 and frequencies[20] == 0
+
+
+# Importance-sampling weights are normalized by the largest one, and the transitions we sample the most weigh the least
+def test_importance_sampling_weights():
+    memory = PrioritizedRingBufferMemory(limit=200, window_length=1, beta=.4)
+    fill(memory, [10] * 12)
+
+    batch = memory.sample_batch(32)
+    memory.update_priorities(batch.positions, np.linspace(0, 10, 32))
+
+    for _ in range(20):
+        batch = memory.sample_batch(32)
+        print("Weights: min %.3f, max %.3f" % (batch.weights.min(), batch.weights.max()))
+        assert np.isclose(batch.weights.max(), 1.) and (batch.weights > 0).all()
+
+        priorities = memory.priorities.values(batch.positions)
+        order = np.argsort(priorities)
+        assert (np.diff(batch.weights[order]) <= 1e-6).all()
+
+        memory.update_priorities(batch.positions, np.random.uniform(0, 10, 32))
+
+
+async def main():
+    print("\033[92m Starting script... \033[0m")
+
+    test_n_step_returns()
+    test_horizons_across_wrap()
+    test_sample_needs_one_step()
+    test_sum_tree_sampling()
+    test_importance_sampling_weights()
+
+    print("\033[92m Done! \033[0m")
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
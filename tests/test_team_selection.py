@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import numpy as np
+
+from reuniclusVGC.helpers.team_selection import MODEL_CANDIDATES, choose_team, score_candidates, select_team, team_candidates
+from reuniclusVGC.helpers.type_chart import team_matchup
+
+
+# Every way to bring 4 of 6 mons with 2 leads: 15 subsets x 12 ordered pairs of leads, back mons in team order
+def test_team_candidates():
+    candidates, subset_ids, subsets = team_candidates(6)
+    assert candidates.shape == (180, 4) and subsets.shape == (15, 4)
+    assert len({tuple(candidate) for candidate in candidates}) == 180
+
+    for candidate, subset_id in zip(candidates, subset_ids):
+        assert sorted(candidate) == list(subsets[subset_id])
+        assert candidate[2] < candidate[3]
+
+
+# select_team's pick scores as high as the best of every candidate, however we prune
+def test_select_team_is_exhaustive():
+    np.random.seed(0)
+    candidates, _, _ = team_candidates(6)
+
+    for _ in range(2000):
+        # Few distinct values, so that we get lots of ties and dominated subsets
+        matrix = np.random.randint(-4, 5, size=(6, 6)) / 2
+        scores = score_candidates(matrix, candidates)
+
+        team = select_team(matrix)
+        assert np.isclose(score_candidates(matrix, np.array([team]))[0], scores.max()), (matrix, team, scores.max())
+    print("select_team picks a best team on 2000 random matrices")
+
+
+# With a model, its ranking decides; type matchups only break ties between teams it scores the same
+def test_select_team_with_model():
+    np.random.seed(1)
+    for _ in range(200):
+        matrix = np.random.uniform(-2, 2, size=(6, 6))
+
+        # The model likes the teams it's given in reverse order, so it has to pick the last one it sees
+        seen = []
+        def score_fn(candidates):
+            seen.append(candidates)
+            return np.arange(len(candidates))[::-1] * -1.
+        team = select_team(matrix, score_fn)
+        assert len(seen) == 1 and 1 < len(seen[0]) <= MODEL_CANDIDATES
+        assert team == tuple(seen[0][-1])
+
+        # A model that can't tell teams apart leaves the choice to type matchups
+        assert select_team(matrix, lambda candidates: np.zeros(len(candidates))) == select_team(matrix)
+
+        # A model that likes two teams the same picks the better of them type-wise
+        def tied(candidates):
+            scores = np.zeros(len(candidates))
+            scores[[1, len(candidates) - 1]] = 1
+            return scores
+        team = select_team(matrix, lambda candidates: seen.append(candidates) or tied(candidates))
+        pair = seen[-1][[1, len(seen[-1]) - 1]]
+        assert team == tuple(pair[np.argmax(score_candidates(matrix, pair))])
+
+
+# choose_team selects a team from the type matchups of the battle's teams
+def test_choose_team():
+
+    class Mon():
+        def __init__(self, species): self.species = species
+
+    class Battle():
+        def __init__(self, team, opponent_team):
+            self.team = {species: Mon(species) for species in team}
+            self.opponent_team = {species: Mon(species) for species in opponent_team}
+
+    team = ('garchomp', 'spectrier', 'swampert', 'regirock', 'mamoswine', 'rillaboom')
+    opponent_team = ('incineroar', 'urshifu', 'zapdos', 'amoonguss', 'tornadus', 'landorus')
+    assert choose_team(Battle(team, opponent_team)) == select_team(team_matchup(team, opponent_team)[0])
+
+
+async def main():
+    print("\033[92m Starting script... \033[0m")
+
+    test_team_candidates()
+    test_select_team_is_exhaustive()
+    test_select_team_with_model()
+    test_choose_team()
+
+    print("\033[92m Done! \033[0m")
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())